@@ -1,26 +1,81 @@
 import uuid 
+import asyncio
 import numpy as np
 
-from typing import Any, Optional, List, Tuple
-from fastapi import APIRouter, HTTPException, Query, status
+from typing import Any, Dict, Optional, List, Tuple
+from fastapi import APIRouter, HTTPException, Query, Request, status
 from sqlmodel import select
 from sqlalchemy.orm.attributes import flag_modified
 
 from app.api.deps import SessionDep
 from app.core.config import settings
-from app.core.db import get_all_user_ids, add_embedding, get_embeddings_for_user
+from app.core.db import (
+    get_all_user_ids, add_embedding, add_embeddings, count_embeddings_for_user, ann_self_check,
+    quantization_report
+)
+from app.core.quantization import QUANTIZATION_MODES
 from app.services.face_verification_service import face_service
-from app.utils import decode_base64_image, verify_face, send_queue
+from app.services.image_quality import ImageQualityError
+from app.utils import (
+    decode_base64_image, verify_face_for_users, verify_image_for_users, identify_face, send_queue
+)
 from app.model import (
     CameraPublic, Camera, CameraCreate, Message, CameraUpdate, Device,
     FaceRegistrationRequest,
     FaceRegistrationResponse,
+    FaceBulkRegistrationRequest,
+    FaceBulkRegistrationResult,
+    FaceBulkRegistrationResponse,
     FaceVerificationRequest,
     FaceVerificationResponse,
+    FaceIdentificationRequest,
+    FaceIdentificationResponse,
     ErrorResponse 
 )
 
 router = APIRouter(prefix="/cameras", tags=["cameras"])
+
+NOT_REGISTERED_MESSAGE = Message(message="The user is not registered in the system. Door can't be opened.")
+
+# Mô tả body cho các endpoint upload ảnh nhị phân (đọc trực tiếp từ Request nên FastAPI không tự sinh)
+IMAGE_UPLOAD_OPENAPI: dict[str, Any] = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"image": {"type": "string", "format": "binary"}},
+                    "required": ["image"],
+                }
+            },
+        },
+    }
+}
+
+async def read_image_upload(request: Request) -> bytes:
+    """
+    Đọc ảnh nhị phân từ body: multipart/form-data (file ở trường "image") hoặc
+    application/octet-stream / image/* (toàn bộ body là ảnh). Bytes được đưa thẳng cho
+    bộ giải mã ảnh, không qua chuỗi base64 và validate JSON.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail='Missing "image" file field.'
+            )
+        image_bytes = await upload.read()
+    else:
+        image_bytes = await request.body()
+    if not image_bytes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Empty image data."
+        )
+    return image_bytes
 @router.get(
     "/",
     response_model=list[CameraPublic]
@@ -84,34 +139,72 @@ def camera_create(*, session: SessionDep, camera_create: CameraCreate) -> Any:
             "model": ErrorResponse,
             "description": "Invalid image data or user ID",
         },
+        422: {
+            "description": "Image rejected by the quality gate (blurry, dark, low contrast)",
+        },
         status.HTTP_500_INTERNAL_SERVER_ERROR: {
             "model": ErrorResponse,
             "description": "Failed to process image or save embedding",
         },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ErrorResponse,
+            "description": "Face model is saturated or still warming up, retry later",
+        },
     },
 )
 async def register_face(request_data: FaceRegistrationRequest):
-    user_id_cleaned = request_data.user_id.strip()
-    if not user_id_cleaned: 
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="User ID cannot be empty or just whitespace.",
-        )
     image_bytes = decode_base64_image(request_data.image_base64)
     if not image_bytes:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid base64 image data."
         )
+    return await register_face_image(request_data.user_id, image_bytes)
 
-    embedding = face_service.get_embedding(image_bytes)
+@router.post(
+    "/register_face/upload",
+    response_model=FaceRegistrationResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Register a face from a binary image upload (multipart or raw body)",
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "model": ErrorResponse,
+            "description": "Missing image data or invalid user ID",
+        },
+        422: {
+            "description": "Image rejected by the quality gate (blurry, dark, low contrast)",
+        },
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {
+            "model": ErrorResponse,
+            "description": "Failed to process image or save embedding",
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ErrorResponse,
+            "description": "Face model is saturated or still warming up, retry later",
+        },
+    },
+    openapi_extra=IMAGE_UPLOAD_OPENAPI,
+)
+async def register_face_upload(request: Request, user_id: str = Query(...)):
+    """Như /register_face nhưng ảnh gửi dạng nhị phân thay vì base64 trong JSON."""
+    return await register_face_image(user_id, await read_image_upload(request))
+
+async def register_face_image(user_id: str, image_bytes: bytes) -> FaceRegistrationResponse:
+    user_id_cleaned = user_id.strip()
+    if not user_id_cleaned: 
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User ID cannot be empty or just whitespace.",
+        )
+
+    embedding = await face_service.get_embedding_async(image_bytes)
     if embedding is None:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to extract embedding from the image.",
         )
 
-    success = add_embedding(
-        user_id_cleaned, embedding
+    success = await asyncio.to_thread(
+        add_embedding, user_id_cleaned, embedding
     ) 
     if not success:
         raise HTTPException(
@@ -119,11 +212,8 @@ async def register_face(request_data: FaceRegistrationRequest):
             detail="Failed to save embedding to store.",
         )
 
-    current_user_embeddings = get_embeddings_for_user(
-        user_id_cleaned
-    )  
-    num_embeddings_for_user = (
-        len(current_user_embeddings) if current_user_embeddings else 0
+    num_embeddings_for_user = await asyncio.to_thread(
+        count_embeddings_for_user, user_id_cleaned
     )
 
     return FaceRegistrationResponse(
@@ -131,6 +221,85 @@ async def register_face(request_data: FaceRegistrationRequest):
         user_id=user_id_cleaned
     )
 
+@router.post(
+    "/register_faces",
+    response_model=FaceBulkRegistrationResponse,
+    summary="Register many faces (for one or more users) in a single request",
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "model": ErrorResponse,
+            "description": "Empty request or too many images",
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ErrorResponse,
+            "description": "Face model is saturated or still warming up, retry later",
+        },
+    },
+)
+async def register_faces(request_data: FaceBulkRegistrationRequest):
+    if not request_data.items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No images to register."
+        )
+    if len(request_data.items) > settings.MAX_BULK_REGISTRATION_IMAGES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many images, at most {settings.MAX_BULK_REGISTRATION_IMAGES} per request.",
+        )
+    face_service.ensure_ready()
+    # Giải mã, chạy model và ghi store đều là việc nặng, chạy trên thread pool của model
+    async with face_service.executor.admit():
+        return await face_service.executor.run(register_faces_batch, request_data.items)
+
+def register_faces_batch(items: List[FaceRegistrationRequest]) -> FaceBulkRegistrationResponse:
+    """
+    Đăng ký nhiều ảnh: embedding được tính theo batch và toàn bộ được lưu trong một lần commit.
+    Ảnh lỗi chỉ làm hỏng kết quả của chính nó, không làm hỏng cả request.
+    """
+    results = [
+        FaceBulkRegistrationResult(index=index, user_id=item.user_id.strip(), success=False)
+        for index, item in enumerate(items)
+    ]
+    pending: List[int] = []
+    images: List[bytes] = []
+    for index, item in enumerate(items):
+        if not results[index].user_id:
+            results[index].detail = "User ID cannot be empty or just whitespace."
+            continue
+        image_bytes = decode_base64_image(item.image_base64)
+        if not image_bytes:
+            results[index].detail = "Invalid base64 image data."
+            continue
+        pending.append(index)
+        images.append(image_bytes)
+
+    rejected: Dict[int, ImageQualityError] = {}
+    embeddings = face_service.get_embeddings(images, rejected)
+    entries: List[Tuple[str, np.ndarray]] = []
+    embedded: List[int] = []
+    for position, (index, embedding) in enumerate(zip(pending, embeddings)):
+        if position in rejected:
+            results[index].detail = str(rejected[position])
+            continue
+        if embedding is None:
+            results[index].detail = "Failed to extract embedding from the image."
+            continue
+        entries.append((results[index].user_id, embedding))
+        embedded.append(index)
+
+    totals = add_embeddings(entries) if entries else {}
+    for index in embedded:
+        if totals is None:
+            results[index].detail = "Failed to save embedding to store."
+            continue
+        results[index].success = True
+        results[index].embeddings_count = totals.get(results[index].user_id)
+
+    registered = sum(result.success for result in results)
+    return FaceBulkRegistrationResponse(
+        registered=registered, failed=len(results) - registered, results=results
+    )
+
 @router.post(
     "/verify_face",
     response_model=FaceVerificationResponse | Message,
@@ -144,47 +313,104 @@ async def register_face(request_data: FaceRegistrationRequest):
             "model": ErrorResponse,
             "description": "Registered user ID not found or no embeddings",
         },
+        422: {
+            "description": "Image rejected by the quality gate (blurry, dark, low contrast)",
+        },
         status.HTTP_500_INTERNAL_SERVER_ERROR: {
             "model": ErrorResponse,
             "description": "Failed to process image",
         },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ErrorResponse,
+            "description": "Face model is saturated or still warming up, retry later",
+        },
     },
 )
 async def camera_identification(request_data: FaceVerificationRequest, session: SessionDep):
     """
     Xác thực khuôn mặt với user_id đã đăng ký của camera để quyết định mở cửa hay không.
-    So sánh embedding của ảnh mới với TẤT CẢ embedding đã lưu của user_id đó.
-    Tính confidence score và đưa ra quyết định.
+    Embedding của ảnh mới chỉ được tính một lần rồi so sánh với TẤT CẢ embedding đã lưu
+    của mọi user_id được đăng ký với camera.
+    Tính confidence score cho từng user và chọn user khớp nhất.
     """
-    camera = session.get(Camera, request_data.camera_verify_id)
-    final_message = Message(message="The user is not registered in the system. Door can't be opened.")
+    camera = get_verifying_camera(session, request_data.camera_verify_id)
+    if not camera.user_ids:
+        return NOT_REGISTERED_MESSAGE
+    result: Tuple[bool, int, str | dict[str, Any]] = await verify_face_for_users(
+        user_ids=camera.user_ids,
+        image_base64=request_data.image_base64_to_check,
+        frame_stream=str(camera.id),
+    )
+    return await build_verification_response(session, camera, result)
+
+@router.post(
+    "/verify_face/upload",
+    response_model=FaceVerificationResponse | Message,
+    summary="Verify a face from a binary image upload (multipart or raw body)",
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "model": ErrorResponse,
+            "description": "Missing image data or inactive camera",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "model": ErrorResponse,
+            "description": "Camera not found or registered users have no embeddings",
+        },
+        422: {
+            "description": "Image rejected by the quality gate (blurry, dark, low contrast)",
+        },
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {
+            "model": ErrorResponse,
+            "description": "Failed to process image",
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ErrorResponse,
+            "description": "Face model is saturated or still warming up, retry later",
+        },
+    },
+    openapi_extra=IMAGE_UPLOAD_OPENAPI,
+)
+async def camera_identification_upload(
+    request: Request, session: SessionDep, camera_verify_id: uuid.UUID = Query(...)
+):
+    """Như /verify_face nhưng ảnh gửi dạng nhị phân thay vì base64 trong JSON."""
+    camera = get_verifying_camera(session, camera_verify_id)
+    if not camera.user_ids:
+        return NOT_REGISTERED_MESSAGE
+    image_bytes = await read_image_upload(request)
+    result = await verify_image_for_users(camera.user_ids, image_bytes, str(camera.id))
+    return await build_verification_response(session, camera, result)
+
+def get_verifying_camera(session: SessionDep, camera_id: uuid.UUID) -> Camera:
+    camera = session.get(Camera, camera_id)
     if not camera:
-        raise HTTPException(status_code=404, detail=f"Camera with ID {request_data.camera_verify_id} not found")
+        raise HTTPException(status_code=404, detail=f"Camera with ID {camera_id} not found")
     if not camera.status:
         raise HTTPException(status_code=400, detail="Camera is not active")
-    for user_id in camera.user_ids:
-        result: Tuple[bool, int, str | dict[str, Any]] = await verify_face(
-            user_id=user_id,
-            image_base64=request_data.image_base64_to_check
+    return camera
+
+async def build_verification_response(
+    session: SessionDep, camera: Camera, result: Tuple[bool, int, str | dict[str, Any]]
+) -> FaceVerificationResponse | Message:
+    final_message = NOT_REGISTERED_MESSAGE
+    success, status_code, message = result
+    if not success:
+        raise HTTPException(
+            status_code=status_code,
+            detail=message
+        )
+    if type(message) is dict:
+        min_distance_found = message.get("min_distance_found")
+        final_message = FaceVerificationResponse(
+            is_signed_person= message.get("is_signed_person"),
+            confidence_score= message.get("confidence_score"),
+            min_distance_found=(
+                min_distance_found if min_distance_found != float("inf") else None
+            ),
+            threshold_used_for_distance=settings.OPTIMAL_THRESHOLD,
+            confidence_threshold_used=settings.CONFIDENCE_VERIFICATION_THRESHOLD,
+            user_confidences=message.get("user_confidences"),
         )
-        success, status_code, message = result
-        if not success:
-            raise HTTPException(
-                status_code=status_code,
-                detail=message
-            )
-        if type(message) is dict:
-            min_distance_found = message.get("min_distance_found")
-            final_message = FaceVerificationResponse(
-                is_signed_person= message.get("is_signed_person"),
-                confidence_score= message.get("confidence_score"),
-                min_distance_found=(
-                    min_distance_found if min_distance_found != float("inf") else None
-                ),
-                threshold_used_for_distance=settings.OPTIMAL_THRESHOLD,
-                confidence_threshold_used=settings.CONFIDENCE_VERIFICATION_THRESHOLD
-            )
-            break
     if type(final_message) is FaceVerificationResponse:
         # door_device = session.exec(
         #     select(Device).where(Device.type == "door" and Device.room_id == camera.room_id)
@@ -204,6 +430,112 @@ async def camera_identification(request_data: FaceVerificationRequest, session:
         pass
     return final_message
 
+@router.post(
+    "/identify_face",
+    response_model=FaceIdentificationResponse,
+    summary="Identify a face among all registered users without a user ID hint",
+    responses={
+        status.HTTP_400_BAD_REQUEST: {
+            "model": ErrorResponse,
+            "description": "Invalid image data",
+        },
+        status.HTTP_404_NOT_FOUND: {
+            "model": ErrorResponse,
+            "description": "No embeddings registered",
+        },
+        422: {
+            "description": "Image rejected by the quality gate (blurry, dark, low contrast)",
+        },
+        status.HTTP_500_INTERNAL_SERVER_ERROR: {
+            "model": ErrorResponse,
+            "description": "Failed to process image",
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "model": ErrorResponse,
+            "description": "Face model is saturated or still warming up, retry later",
+        },
+    },
+)
+async def face_identification(request_data: FaceIdentificationRequest):
+    """
+    Nhận diện khuôn mặt 1:N: tìm các user đã đăng ký gần nhất với ảnh (không cần user_id),
+    dùng index ANN khi chạy với backend pgvector.
+    """
+    success, status_code, message = await identify_face(
+        image_base64=request_data.image_base64,
+        top_k=request_data.top_k or settings.IDENTIFY_TOP_K,
+    )
+    if not success:
+        raise HTTPException(
+            status_code=status_code,
+            detail=message
+        )
+    return FaceIdentificationResponse(
+        is_signed_person=message["is_signed_person"],
+        candidates=message["candidates"],
+        threshold_used_for_distance=settings.OPTIMAL_THRESHOLD,
+        confidence_threshold_used=settings.CONFIDENCE_VERIFICATION_THRESHOLD
+    )
+
+@router.get(
+    "/identify_face/self_check",
+    summary="Measure recall of the in-memory ANN index against exact search",
+)
+async def identify_face_self_check(
+    queries: int = Query(default=100, ge=1, le=10000),
+    k: int = Query(default=1, ge=1),
+    nprobe: Optional[int] = Query(default=None, ge=1),
+) -> dict[str, Any]:
+    """
+    Tự kiểm tra index ANN: recall@k so với tìm kiếm chính xác và độ trễ trung bình,
+    dùng để chỉnh ANN_NPROBE / ANN_NLIST.
+    """
+    report = await asyncio.to_thread(ann_self_check, queries, k, nprobe)
+    if report is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="In-memory ANN index is not enabled for the current embeddings backend.",
+        )
+    return report
+
+@router.get(
+    "/face_model/stats",
+    summary="Micro-batching statistics of the face embedding model",
+)
+async def face_model_stats() -> dict[str, Any]:
+    """
+    Độ sâu hàng đợi và kích thước batch thực tế của bộ micro-batching model khuôn mặt,
+    số request đang xử lý / bị từ chối của thread pool model và tỉ lệ trúng cache khung hình.
+    """
+    return {
+        "model_ready": face_service.model_ready.is_set(),
+        "load_error": face_service.load_error,
+        "micro_batching_enabled": settings.FACE_MICRO_BATCHING_ENABLED,
+        **face_service.batcher.stats(),
+        "executor": face_service.executor.stats(),
+        "frame_cache": (
+            face_service.frame_cache.stats() if face_service.frame_cache is not None else None
+        ),
+    }
+
+@router.get(
+    "/embeddings/calibration",
+    summary="Compare float32 and quantized embedding decisions",
+)
+async def embeddings_calibration(
+    mode: str = Query(default="int8"),
+) -> dict[str, Any]:
+    """
+    Báo cáo độ lệch khoảng cách và số quyết định (theo OPTIMAL_THRESHOLD và
+    CONFIDENCE_VERIFICATION_THRESHOLD) bị thay đổi khi lưu embedding dạng float16/int8.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Quantization mode must be one of {list(QUANTIZATION_MODES)}.",
+        )
+    return await asyncio.to_thread(quantization_report, mode)
+
 @router.put(
     "/{id}", response_model=Camera
 )
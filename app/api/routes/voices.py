@@ -171,9 +171,28 @@ async def handle_voice_logic(
     return HistoryPublic(
         request=history.request,
         response=history.response,
-        created_at=history.created_at
+        created_at=history.created_at,
+        candidates=message.get("candidates"),
+        margin=message.get("margin"),
+        ambiguous=message.get("ambiguous"),
+        matched_by=message.get("matched_by"),
     )
 
+@router.get(
+    "/nlp/stats",
+    summary="Batching statistics of the sentence embedding model",
+)
+async def nlp_model_stats() -> dict[str, Any]:
+    """
+    Độ sâu hàng đợi và kích thước batch thực tế của luồng chạy model NLP, cùng tỉ lệ trúng
+    cache kết quả câu lệnh.
+    """
+    return {
+        **voice_service.batcher.stats(),
+        "result_cache": voice_service.result_cache.stats(),
+        "lexicon": voice_service.lexicon.stats(),
+    }
+
 @router.delete(
     "/",
     response_model=Message,
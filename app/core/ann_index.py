@@ -0,0 +1,329 @@
+import threading
+import time
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+
+class IVFFlatIndex:
+    """
+    Index tìm kiếm láng giềng gần đúng (ANN) trong bộ nhớ cho embedding khuôn mặt.
+    - Ít hơn `flat_threshold` vector: quét toàn bộ (flat) bằng một phép nhân ma trận-vector.
+    - Từ `flat_threshold` trở lên: IVF - các vector được chia vào `nlist` cụm bằng k-means,
+      truy vấn k user quét `nprobe` x k cụm gần nhất: user thứ 2..k thường nằm rải rác ở các
+      cụm khác nhau nên số cụm cần quét để giữ recall@k tăng theo k.
+    Vector mới được thêm trực tiếp vào cụm gần nhất; index được huấn luyện lại khi
+    số vector tăng gấp `retrain_factor` lần so với lần huấn luyện trước.
+    Vector của user bị thay thế (`replace`) được đánh dấu xóa và chỉ bị dọn khi huấn luyện lại;
+    nếu sau khi dọn còn ít hơn `flat_threshold` vector, index quay về quét toàn bộ.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        nprobe: int = 8,
+        nlist: int = 0,
+        flat_threshold: int = 2048,
+        retrain_factor: float = 4.0,
+        seed: int = 0,
+    ):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.nlist = nlist  # 0: tự chọn ~ sqrt(n)
+        self.flat_threshold = flat_threshold
+        self.retrain_factor = retrain_factor
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.RLock()
+        self._user_ids: List[str] = []
+        self._user_index: Dict[str, int] = {}
+        # Toàn bộ vector (dùng cho flat search, self-check và huấn luyện lại)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._size = 0
+        self._deleted = 0  # Số vector đã đánh dấu xóa (bình phương chuẩn = inf)
+        # Trạng thái IVF
+        self._centroids: Optional[np.ndarray] = None
+        self._centroid_sq_norms: Optional[np.ndarray] = None
+        self._lists: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._list_of = np.empty(0, dtype=np.int32)  # Cụm chứa từng vector
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return self._size - self._deleted
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    # --- Xây dựng / cập nhật ---
+    def build(self, users: List[Tuple[str, np.ndarray]]) -> None:
+        with self._lock:
+            self._user_ids, self._user_index = [], {}
+            self._vectors = np.empty((0, self.dim), dtype=np.float32)
+            self._labels = np.empty(0, dtype=np.int32)
+            self._sq_norms = np.empty(0, dtype=np.float32)
+            self._size = 0
+            self._deleted = 0
+            self._centroids = None
+            self._lists = []
+            for user_id, matrix in users:
+                self._append(user_id, matrix)
+            if self._size >= self.flat_threshold:
+                self._train()
+
+    def add(self, user_id: str, matrix: np.ndarray) -> None:
+        with self._lock:
+            start = self._size
+            self._append(user_id, matrix)
+            if not self.is_trained:
+                if self._size >= self.flat_threshold:
+                    self._train()
+                return
+            # Đã huấn luyện thì vector mới luôn phải vào một cụm, kể cả khi số vector
+            # còn sống đã giảm dưới flat_threshold, nếu không sẽ không bao giờ được tìm thấy
+            if self._size >= self._trained_size * self.retrain_factor:
+                self._train()
+                return
+            self._assign(np.arange(start, self._size))
+
+    def replace(self, user_id: str, matrix: np.ndarray) -> None:
+        """Thay toàn bộ vector của user (vd: sau khi được tóm tắt thành prototype)."""
+        with self._lock:
+            self.remove(user_id)
+            self.add(user_id, matrix)
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            label = self._user_index.get(user_id)
+            if label is None:
+                return
+            rows = np.flatnonzero(
+                (self._labels[:self._size] == label) & np.isfinite(self._sq_norms[:self._size])
+            )
+            if len(rows) == 0:
+                return
+            # Khoảng cách tới vector đã xóa luôn là inf nên không bao giờ được chọn
+            self._sq_norms[rows] = np.inf
+            self._deleted += len(rows)
+            if self.is_trained:
+                for list_id in np.unique(self._list_of[rows]):
+                    vectors, ids, sq_norms = self._lists[list_id]
+                    keep = np.isfinite(self._sq_norms[ids])
+                    self._lists[list_id] = (vectors[keep], ids[keep], sq_norms[keep])
+
+    def _append(self, user_id: str, matrix: np.ndarray) -> None:
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, self.dim)
+        label = self._user_index.get(user_id)
+        if label is None:
+            label = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._user_index[user_id] = label
+        needed = self._size + matrix.shape[0]
+        if needed > self._vectors.shape[0]:
+            # Tăng dung lượng theo cấp số nhân để thêm vector có chi phí trung bình O(1)
+            capacity = max(needed, self._vectors.shape[0] * 2, 1024)
+            vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            vectors[:self._size] = self._vectors[:self._size]
+            labels = np.empty(capacity, dtype=np.int32)
+            labels[:self._size] = self._labels[:self._size]
+            sq_norms = np.empty(capacity, dtype=np.float32)
+            sq_norms[:self._size] = self._sq_norms[:self._size]
+            list_of = np.zeros(capacity, dtype=np.int32)
+            list_of[:self._size] = self._list_of[:self._size]
+            self._vectors, self._labels, self._sq_norms = vectors, labels, sq_norms
+            self._list_of = list_of
+        self._vectors[self._size:needed] = matrix
+        self._labels[self._size:needed] = label
+        self._sq_norms[self._size:needed] = np.einsum("ij,ij->i", matrix, matrix)
+        self._size = needed
+
+    def _drop_deleted(self) -> None:
+        alive = np.flatnonzero(np.isfinite(self._sq_norms[:self._size]))
+        size = len(alive)
+        self._vectors[:size] = self._vectors[alive]
+        self._labels[:size] = self._labels[alive]
+        self._sq_norms[:size] = self._sq_norms[alive]
+        self._size = size
+        self._deleted = 0
+
+    def _train(self, iterations: int = 10, samples_per_list: int = 64) -> None:
+        if self._deleted:
+            self._drop_deleted()
+        if self._size < self.flat_threshold:
+            # Sau khi dọn vector đã xóa không còn đủ vector cho IVF: quay lại quét toàn bộ
+            self._centroids = None
+            self._centroid_sq_norms = None
+            self._lists = []
+            self._trained_size = 0
+            return
+        vectors = self._vectors[:self._size]
+        nlist = self.nlist or int(np.sqrt(self._size))
+        nlist = max(1, min(nlist, self._size))
+        sample_ids = self._rng.choice(
+            self._size, size=min(self._size, nlist * samples_per_list), replace=False
+        )
+        sample = vectors[sample_ids]
+        centroids = sample[self._rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = self._nearest_centroids(sample, centroids)
+            order = np.argsort(assignment, kind="stable")
+            non_empty, starts, counts = np.unique(
+                assignment[order], return_index=True, return_counts=True
+            )
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[non_empty] = sums / counts[:, None]
+        self._centroids = centroids
+        self._centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        empty = np.empty(0, dtype=np.int64)
+        self._lists = [
+            (np.empty((0, self.dim), dtype=np.float32), empty, np.empty(0, dtype=np.float32))
+            for _ in range(nlist)
+        ]
+        self._trained_size = self._size
+        self._assign(np.arange(self._size))
+
+    @staticmethod
+    def _nearest_centroids(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        scores = points @ centroids.T
+        scores *= -2.0
+        scores += np.einsum("ij,ij->i", centroids, centroids)
+        return np.argmin(scores, axis=1)
+
+    def _assign(self, row_ids: np.ndarray) -> None:
+        points = self._vectors[row_ids]
+        assignment = self._nearest_centroids(points, self._centroids)
+        self._list_of[row_ids] = assignment
+        for list_id in np.unique(assignment):
+            members = row_ids[assignment == list_id]
+            member_vectors = self._vectors[members]
+            vectors, ids, sq_norms = self._lists[list_id]
+            self._lists[list_id] = (
+                np.concatenate([vectors, member_vectors]),
+                np.concatenate([ids, members]),
+                np.concatenate([sq_norms, self._sq_norms[members]]),
+            )
+
+    # --- Truy vấn ---
+    def search(
+        self, query: np.ndarray, k: int, nprobe: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """Trả về tối đa k user gần nhất: [(user_id, khoảng cách nhỏ nhất)] tăng dần."""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            if self._size == 0:
+                return []
+            if not self.is_trained:
+                vectors = self._vectors[:self._size]
+                distances_sq = self._sq_norms[:self._size] - 2.0 * (vectors @ query)
+                labels = self._labels[:self._size]
+            else:
+                distances_sq, labels = self._search_ivf(query, self._probes(k, nprobe))
+            user_ids = list(self._user_ids)
+        distances_sq = distances_sq + float(query @ query)
+        return self._top_users(distances_sq, labels, user_ids, k)
+
+    def _probes(self, k: int, nprobe: Optional[int]) -> int:
+        """Số cụm cần quét: `nprobe` nếu được chỉ định, ngược lại self.nprobe cho mỗi user cần tìm."""
+        return nprobe or self.nprobe * max(1, k)
+
+    def _search_ivf(self, query: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        centroid_scores = self._centroid_sq_norms - 2.0 * (self._centroids @ query)
+        nprobe = min(nprobe, len(self._lists))
+        probes = np.argpartition(centroid_scores, nprobe - 1)[:nprobe]
+        distances, labels = [], []
+        for list_id in probes:
+            vectors, ids, sq_norms = self._lists[list_id]
+            if len(ids) == 0:
+                continue
+            distances.append(sq_norms - 2.0 * (vectors @ query))
+            labels.append(self._labels[ids])
+        if not distances:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int32)
+        return np.concatenate(distances), np.concatenate(labels)
+
+    @staticmethod
+    def _top_users(
+        distances_sq: np.ndarray, labels: np.ndarray, user_ids: List[str], k: int
+    ) -> List[Tuple[str, float]]:
+        finite = np.isfinite(distances_sq)
+        if not finite.all():
+            distances_sq, labels = distances_sq[finite], labels[finite]
+        if len(distances_sq) == 0:
+            return []
+        # Sắp xếp ứng viên theo khoảng cách rồi giữ lần xuất hiện đầu tiên (gần nhất) của mỗi user.
+        # Thử trước với một phần nhỏ ứng viên gần nhất, chỉ sắp xếp toàn bộ khi chưa đủ k user.
+        shortlist = min(len(distances_sq), k * 32)
+        while True:
+            if shortlist < len(distances_sq):
+                order = np.argpartition(distances_sq, shortlist - 1)[:shortlist]
+                order = order[np.argsort(distances_sq[order])]
+            else:
+                order = np.argsort(distances_sq)
+            _, first = np.unique(labels[order], return_index=True)
+            if len(first) >= k or shortlist >= len(distances_sq):
+                break
+            shortlist = len(distances_sq)
+        top = np.sort(first)[:k]
+        return [
+            (user_ids[labels[order[i]]], float(np.sqrt(max(distances_sq[order[i]], 0.0))))
+            for i in top
+        ]
+
+    # --- Tự kiểm tra ---
+    def self_check(
+        self,
+        queries: int = 100,
+        k: int = 5,
+        noise: float = 0.05,
+        nprobe: Optional[int] = None,
+    ) -> dict:
+        """
+        Đo recall@k (theo user) của index so với tìm kiếm chính xác, dùng các truy vấn là
+        embedding đã lưu cộng nhiễu Gauss nhỏ. Dùng để chỉnh nprobe/nlist.
+        """
+        with self._lock:
+            alive = np.flatnonzero(np.isfinite(self._sq_norms[:self._size]))
+            if len(alive) == 0:
+                return {"size": 0, "queries": 0, "recall": None}
+            vectors = self._vectors[alive]
+            labels = self._labels[alive]
+            sq_norms = self._sq_norms[alive]
+            user_ids = list(self._user_ids)
+        sample = vectors[self._rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)]
+        scale = noise * float(np.mean(np.linalg.norm(sample, axis=1)) / np.sqrt(self.dim))
+        sample = sample + self._rng.normal(0.0, scale, size=sample.shape).astype(np.float32)
+
+        hits = 0
+        total = 0
+        top1_hits = 0
+        ann_time = 0.0
+        exact_time = 0.0
+        for query in sample:
+            started = time.perf_counter()
+            approx = self.search(query, k, nprobe=nprobe)
+            ann_time += time.perf_counter() - started
+
+            started = time.perf_counter()
+            exact = self._top_users(
+                sq_norms - 2.0 * (vectors @ query) + float(query @ query), labels, user_ids, k
+            )
+            exact_time += time.perf_counter() - started
+
+            expected = {user_id for user_id, _ in exact}
+            hits += len(expected & {user_id for user_id, _ in approx})
+            total += len(expected)
+            if approx and exact and approx[0][0] == exact[0][0]:
+                top1_hits += 1
+        return {
+            "size": len(self),
+            "mode": "ivf" if self.is_trained else "flat",
+            "nlist": len(self._lists),
+            "nprobe": min(self._probes(k, nprobe), len(self._lists)) if self.is_trained else None,
+            "queries": len(sample),
+            "k": k,
+            "recall": hits / total if total else None,
+            "recall_at_1": top1_hits / len(sample),
+            "ann_avg_ms": ann_time / len(sample) * 1000,
+            "exact_avg_ms": exact_time / len(sample) * 1000,
+        }
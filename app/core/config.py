@@ -103,6 +103,48 @@ class Settings(BaseSettings):
     # Thông số đánh giá độ chính xác của nhân diện khuôn mặt
     OPTIMAL_THRESHOLD : float = 1.2 
     CONFIDENCE_VERIFICATION_THRESHOLD : float = 0.6
+    # True: nạp model khuôn mặt ở nền ngay khi khởi động; False: chỉ nạp khi có request khuôn
+    # mặt đầu tiên (worker không dùng model không phải import TensorFlow)
+    FACE_MODEL_PRELOAD : bool = True
+    # Đăng ký nhiều ảnh một lần (/cameras/register_faces)
+    MAX_BULK_REGISTRATION_IMAGES : int = 64
+    FACE_EMBEDDING_BATCH_SIZE : int = 32  # Số ảnh mỗi lần chạy model
+    FACE_DECODE_WORKERS : int = 4  # Số luồng giải mã ảnh song song
+    # Micro-batching: gom các yêu cầu embedding đồng thời thành một lần chạy model
+    FACE_MICRO_BATCHING_ENABLED : bool = True
+    FACE_BATCH_MAX_SIZE : int = 16
+    FACE_BATCH_MAX_WAIT_MS : float = 5.0  # Thời gian chờ tối đa tính từ yêu cầu đầu tiên của batch
+    # Thread pool riêng cho model khuôn mặt và giới hạn số request đang xử lý (vượt quá -> 503)
+    FACE_INFERENCE_WORKERS : int = 2  # Cũng là số lần chạy model đồng thời tối đa
+    FACE_INFERENCE_MAX_PENDING : int = 32  # 0 = không giới hạn
+    # Suy luận bằng hàm đã biên dịch (tf.function) với các kích thước batch cố định;
+    # batch được đệm tới bucket nhỏ nhất chứa vừa. False: dùng model.predict như cũ
+    FACE_COMPILED_INFERENCE : bool = True
+    FACE_BATCH_BUCKETS : tuple[int, ...] = (1, 2, 4, 8, 16, 32)
+    # Cache embedding cho khung hình gần trùng (camera gửi liên tục khi có người đứng trước cửa):
+    # ảnh có dHash lệch <= FACE_FRAME_CACHE_MAX_HAMMING bit (trên 64) so với ảnh của CÙNG camera
+    # đã tính trong FACE_FRAME_CACHE_TTL_SECONDS giây gần nhất dùng lại embedding cũ.
+    # Chỉ dùng khi xác thực theo camera; đăng ký và nhận diện luôn chạy model
+    FACE_FRAME_CACHE_ENABLED : bool = True
+    FACE_FRAME_CACHE_SIZE : int = 256
+    FACE_FRAME_CACHE_TTL_SECONDS : float = 2.0
+    FACE_FRAME_CACHE_MAX_HAMMING : int = 4
+    # Cổng chất lượng ảnh trước khi chạy model (áp dụng cho cả đăng ký và xác thực), đo trên
+    # ảnh đã resize, thang mức xám 0-255. Ảnh không đạt bị từ chối (422) kèm mã lý do.
+    # Mặc định tắt: các ngưỡng dưới đây chưa được hiệu chỉnh trên ảnh camera thật, cần đo chỉ số
+    # (ImageQualityError.metrics) trên ảnh của từng camera trước khi bật
+    FACE_QUALITY_GATE_ENABLED : bool = False
+    FACE_QUALITY_MIN_SHARPNESS : float = 20.0  # Phương sai Laplacian, thấp hơn -> "too_blurry"
+    FACE_QUALITY_MIN_BRIGHTNESS : float = 30.0  # -> "too_dark"
+    FACE_QUALITY_MAX_BRIGHTNESS : float = 225.0  # -> "too_bright"
+    FACE_QUALITY_MIN_CONTRAST : float = 10.0  # Độ lệch chuẩn mức xám -> "low_contrast"
+    # Backend chạy model khuôn mặt: "tensorflow" hoặc "onnx" (ONNX Runtime trên CPU,
+    # cần pip install onnxruntime tf2onnx; file .onnx được tự xuất từ MODEL_PATH).
+    # Kiểm tra độ lệch trước khi bật: python -m app.services.onnx_face_backend --images <thư mục>
+    FACE_MODEL_BACKEND : str = "tensorflow"
+    FACE_ONNX_PATH : Path = BASE_DIR / "models_AI" / "siamese_branch_model_best.onnx"
+    FACE_ONNX_QUANTIZE_INT8 : bool = False  # Lượng tử hóa trọng số int8 (dynamic quantization)
+    FACE_ONNX_THREADS : int = 0  # Số luồng intra-op của ONNX Runtime, 0 = mặc định
     # Thông tin về model Siamese branch
     MODEL_NAME : str = "siamese_branch_model_best.h5"  # Tên file model của bạn
     MODEL_PATH : Path = BASE_DIR / "models_AI" / MODEL_NAME
@@ -112,5 +154,54 @@ class Settings(BaseSettings):
     EMBEDDINGS_STORE_DIR : Path = BASE_DIR / "app" / "embeddings"
     EMBEDDINGS_STORE_FILE_NAME : Path = "embeddings_store.json"
     EMBEDDINGS_STORE_PATH : Path = EMBEDDINGS_STORE_DIR / EMBEDDINGS_STORE_FILE_NAME
+    # File nhị phân (memory-mapped) chứa toàn bộ embedding dạng float32 liên tục.
+    # Nếu chưa tồn tại, dữ liệu sẽ được chuyển đổi một lần từ EMBEDDINGS_STORE_PATH (JSON cũ)
+    EMBEDDINGS_SNAPSHOT_FILE_NAME : str = "embeddings_store.bin"
+    EMBEDDINGS_SNAPSHOT_PATH : Path = EMBEDDINGS_STORE_DIR / EMBEDDINGS_SNAPSHOT_FILE_NAME
+    # Số chiều của vector embedding (output của lớp fc3_embedding)
+    EMBEDDING_DIM : int = 400
+    # Chu kỳ (giây) gộp journal các embedding mới vào snapshot
+    EMBEDDINGS_COMPACTION_INTERVAL : float = 300.0
+    # Lượng tử hóa embedding trong snapshot và cache: "none" (float32), "float16" hoặc "int8"
+    EMBEDDINGS_QUANTIZATION : str = "none"
+    # Giới hạn số embedding mỗi user (0 = không giới hạn, mặc định). Khi vượt giới hạn, embedding
+    # của user được tóm tắt thành PROTOTYPES_PER_USER prototype (medoid) có trọng số và các
+    # embedding gốc bị ghi đè - không khôi phục được, nên chỉ bật khi đã sao lưu kho embedding
+    MAX_EMBEDDINGS_PER_USER : int = 0
+    PROTOTYPES_PER_USER : int = 10
+    # Backend lưu embedding: "file" (snapshot + journal cục bộ) hoặc "pgvector" (Postgres dùng chung)
+    EMBEDDINGS_BACKEND : str = "file"
+    # Index ANN của pgvector: "hnsw" hoặc "ivfflat"
+    PGVECTOR_INDEX_TYPE : str = "hnsw"
+    PGVECTOR_IVFFLAT_LISTS : int = 100
+    PGVECTOR_IVFFLAT_PROBES : int = 10
+    PGVECTOR_HNSW_EF_SEARCH : int = 40
+    # Số user gần nhất trả về khi nhận diện khuôn mặt không có user_id
+    IDENTIFY_TOP_K : int = 5
+    # Index ANN trong bộ nhớ cho backend "file" (IVF, quét toàn bộ khi ít vector)
+    ANN_INDEX_ENABLED : bool = True
+    ANN_FLAT_THRESHOLD : int = 2048  # Dưới ngưỡng này dùng tìm kiếm chính xác (flat)
+    ANN_NLIST : int = 0  # Số cụm IVF, 0 = tự chọn ~ sqrt(số vector)
+    ANN_NPROBE : int = 8  # Số cụm được quét cho mỗi user cần tìm (top-k quét k x ANN_NPROBE cụm)
+
+    # Model NLP (sentence embedding) dùng để hiểu lệnh giọng nói
+    NLP_MODEL_NAME : str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    NLP_ENCODE_BATCH_SIZE : int = 32  # Số câu mỗi lần chạy model khi mã hóa nhiều câu
+    # Micro-batching các câu lệnh đồng thời trên luồng riêng của model NLP
+    NLP_BATCH_MAX_SIZE : int = 16
+    NLP_BATCH_MAX_WAIT_MS : float = 5.0
+    # Cache embedding của các câu mẫu intent (khóa theo tên model + hash tập câu mẫu),
+    # khởi động lại không phải mã hóa lại nếu model và câu mẫu không đổi
+    INTENT_EMBEDDINGS_CACHE_DIR : Path = BASE_DIR / "app" / "embeddings" / "intents"
+    # Số intent ứng viên trả về và ngưỡng độ chênh (cosine) giữa intent tốt nhất và intent khác
+    # gần nhất; chênh ít hơn ngưỡng thì lệnh được đánh dấu mơ hồ ("ambiguous")
+    NLP_INTENT_TOP_K : int = 3
+    NLP_AMBIGUITY_MARGIN : float = 0.05
+    # Số kết quả hiểu câu lệnh được cache (LRU, theo câu đã chuẩn hóa), 0 = tắt
+    NLP_RESULT_CACHE_SIZE : int = 256
+    # Tra câu mẫu trực tiếp (không phân biệt dấu tiếng Việt, bỏ dấu câu) trước khi chạy model;
+    # khớp tiền tố theo từ ("bật đèn phòng khách" -> "bật đèn") tắt mặc định
+    NLP_LEXICAL_MATCH_ENABLED : bool = True
+    NLP_LEXICAL_PREFIX_MATCH : bool = False
 
 settings = Settings() 
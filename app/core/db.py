@@ -1,16 +1,20 @@
 import json
 import numpy as np
-from pathlib import Path
 
-from typing import Dict, Optional, List, Any  # Thêm Any
+from typing import Dict, Optional, List, Tuple
 from sqlmodel import Session, create_engine, select
 
 # from app import crud
 from app.core.config import settings
+from app.core.ann_index import IVFFlatIndex
+from app.core.embedding_store import EmbeddingStore
+from app.core.pgvector_store import PgVectorEmbeddingStore
+from app.core.quantization import StoredMatrix, calibration_report
 from app.model import Room, RoomCreate, Device
 
 engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
 store_path = settings.EMBEDDINGS_STORE_PATH
+snapshot_path = settings.EMBEDDINGS_SNAPSHOT_PATH
 store_dir = settings.EMBEDDINGS_STORE_DIR.mkdir(parents=True, exist_ok=True)
 
 # aio = settings.ADAFRUIT_IO_CLIENT
@@ -51,53 +55,80 @@ def init_db(session: Session) -> None:
         list_device = crud.setting_device(session=session, room=room)
         print(list_device)
 
-def load_store() -> Dict[str, List[List[float]]]:
-    """Tải dữ liệu embeddings từ file JSON."""
-    if store_path.exists():
+def load_file_store(ann_index: Optional[IVFFlatIndex] = None) -> EmbeddingStore:
+    """
+    Mở store file: snapshot nhị phân (memory-mapped) + journal. Lần chạy đầu tiên sẽ chuyển đổi
+    dữ liệu từ file JSON cũ sang định dạng nhị phân.
+    """
+    store = EmbeddingStore(
+        snapshot_path,
+        settings.EMBEDDING_DIM,
+        ann_index=ann_index,
+        quantization=settings.EMBEDDINGS_QUANTIZATION,
+        max_per_user=settings.MAX_EMBEDDINGS_PER_USER,
+        prototypes_per_user=settings.PROTOTYPES_PER_USER,
+    )
+    if not snapshot_path.exists() and store_path.exists():
         try:
-            with open(store_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # Đảm bảo value của mỗi key là một list (có thể chứa các list embedding)
-                for user_id, embeddings in data.items():
-                    if not isinstance(embeddings, list):
-                        print(
-                            f"Dữ liệu cho user_id '{user_id}' trong store không phải là list, bỏ qua user này."
-                        )
-                        # Có thể xóa key này hoặc xử lý khác: data[user_id] = []
-                        continue  # Bỏ qua user này nếu định dạng không đúng
-                    # Kiểm tra sâu hơn (tùy chọn): mỗi item trong list embedding có phải là list of numbers
-                    for emb_list in embeddings:
-                        if not (
-                            isinstance(emb_list, list)
-                            and all(isinstance(x, (int, float)) for x in emb_list)
-                        ):
-                            print(
-                                f"Một embedding cho user_id '{user_id}' không phải là list of numbers. Cần kiểm tra file store."
-                            )
-                            # Có thể lọc bỏ embedding không hợp lệ này
-                print(f"Đã tải {len(data)} users từ {store_path}")
-                return data
+            rows = store.migrate_from_json(store_path)
+            print(f"Đã chuyển đổi {rows} embeddings từ {store_path} sang {snapshot_path}")
         except json.JSONDecodeError:
             print(
                 f"Lỗi decode JSON từ {store_path}. Trả về store rỗng."
             )
-            return {}
         except Exception as e:
             print(
-                f"Lỗi không xác định khi tải embedding store từ {store_path}:"
+                f"Lỗi khi chuyển đổi embedding store từ {store_path}: {e}"
             )
-            return {}
-    print(f"File store {store_path} không tồn tại. Khởi tạo store rỗng.")
-    return {}
-
-def save_store():
-    """Lưu dữ liệu embeddings hiện tại vào file JSON."""
     try:
-        with open(store_path, "w", encoding="utf-8") as f:
-            json.dump(embeddings_data, f, indent=4)
-        print(f"Dữ liệu Embeddings đã được lưu vào {store_path}")
+        store.open()
+        print(f"Đã tải {len(store.user_ids())} users ({len(store)} embeddings) từ {snapshot_path}")
     except Exception as e:
-        print(f"Lỗi khi lưu embedding store tại {store_path}:")
+        print(
+            f"Lỗi không xác định khi tải embedding store từ {snapshot_path}: {e}"
+        )
+    return store
+
+def has_file_store_data() -> bool:
+    """Có dữ liệu của store file (snapshot, journal chưa compaction hoặc JSON cũ) hay không."""
+    if snapshot_path.exists() or store_path.exists():
+        return True
+    return any(snapshot_path.parent.glob(f"{snapshot_path.name}.journal.*"))
+
+def load_store() -> EmbeddingStore | PgVectorEmbeddingStore:
+    """
+    Mở kho embedding theo settings.EMBEDDINGS_BACKEND.
+    - "file": store file (xem load_file_store).
+    - "pgvector": bảng vector trong Postgres. Store file chỉ được mở khi bảng đang rỗng và có
+      dữ liệu file cũ cần chép sang.
+    """
+    if settings.EMBEDDINGS_BACKEND == "pgvector":
+        pg_store = PgVectorEmbeddingStore(
+            engine,
+            settings.EMBEDDING_DIM,
+            index_type=settings.PGVECTOR_INDEX_TYPE,
+            ivfflat_lists=settings.PGVECTOR_IVFFLAT_LISTS,
+            ef_search=settings.PGVECTOR_HNSW_EF_SEARCH,
+            ivfflat_probes=settings.PGVECTOR_IVFFLAT_PROBES,
+        )
+        pg_store.open()
+        if len(pg_store) == 0 and has_file_store_data():
+            store = load_file_store()
+            if len(store) > 0:
+                rows = pg_store.import_from(store.items())
+                print(f"Đã chép {rows} embeddings từ {snapshot_path} sang pgvector")
+        print(f"Đang dùng pgvector ({settings.PGVECTOR_INDEX_TYPE}) làm kho embedding.")
+        return pg_store
+
+    ann_index = None
+    if settings.ANN_INDEX_ENABLED:
+        ann_index = IVFFlatIndex(
+            settings.EMBEDDING_DIM,
+            nprobe=settings.ANN_NPROBE,
+            nlist=settings.ANN_NLIST,
+            flat_threshold=settings.ANN_FLAT_THRESHOLD,
+        )
+    return load_file_store(ann_index)
 
 def add_embedding(user_id: str, embedding: np.ndarray) -> bool:
     """
@@ -109,51 +140,86 @@ def add_embedding(user_id: str, embedding: np.ndarray) -> bool:
             f"Attempted to save non-numpy array embedding for user {user_id}"
         )
         return False
+    if embedding.size != settings.EMBEDDING_DIM:
+        print(
+            f"Embedding cho user {user_id} có kích thước {embedding.size}, cần {settings.EMBEDDING_DIM}"
+        )
+        return False
 
-    embedding_as_list = (
-        embedding.tolist()
-    )  # Chuyển NumPy array thành list of floats
-
-    if user_id not in embeddings_data:
-        embeddings_data[user_id] = []
-
-    embeddings_data[user_id].append(embedding_as_list)
-    save_store()
+    try:
+        total = embedding_store.add(user_id, embedding)
+    except Exception as e:
+        print(f"Lỗi khi lưu embedding store tại {snapshot_path}: {e}")
+        return False
     print(
-        f"Đã thêm embedding mới cho user_id: {user_id}. Tổng số embeddings: {len(embeddings_data[user_id])}"
+        f"Đã thêm embedding mới cho user_id: {user_id}. Tổng số embeddings: {total}"
     )
     return True
 
-def get_embeddings_for_user(user_id: str) -> Optional[List[np.ndarray]]:
+def add_embeddings(entries: List[Tuple[str, np.ndarray]]) -> Optional[Dict[str, int]]:
     """
-    Lấy danh sách các embedding (dưới dạng NumPy array) của một user_id.
-    Trả về list các NumPy array hoặc None nếu không tìm thấy user_id hoặc không có embedding.
+    Thêm nhiều embedding (có thể của nhiều user) trong một lần commit duy nhất.
+    Trả về số embedding hiện có của từng user, hoặc None nếu không lưu được.
     """
-    list_of_embedding_lists = embeddings_data.get(user_id)
-    if list_of_embedding_lists:
-        try:
-            # Chuyển mỗi list con (embedding) lại thành NumPy array
-            numpy_embeddings = [
-                np.array(emb_list, dtype=np.float32)
-                for emb_list in list_of_embedding_lists
-            ]
-            print(
-                f"Đã tìm thấy {len(numpy_embeddings)} embeddings cho user_id: {user_id}"
-            )
-            return numpy_embeddings
-        except Exception as e:
+    for user_id, embedding in entries:
+        if not isinstance(embedding, np.ndarray) or embedding.size != settings.EMBEDDING_DIM:
             print(
-                f"Lỗi khi chuyển đổi embeddings sang NumPy array cho user {user_id}:"
+                f"Embedding cho user {user_id} không hợp lệ, cần numpy array {settings.EMBEDDING_DIM} phần tử"
             )
-            return None  # Hoặc một list rỗng
+            return None
+    if not entries:
+        return {}
 
+    try:
+        totals = embedding_store.add_many(entries)
+    except Exception as e:
+        print(f"Lỗi khi lưu embedding store tại {snapshot_path}: {e}")
+        return None
     print(
-        f"Không tìm thấy user_id '{user_id}' hoặc không có embeddings nào trong store."
+        f"Đã thêm {len(entries)} embeddings mới cho {len(totals)} users trong một lần commit."
+    )
+    return totals
+
+def count_embeddings_for_user(user_id: str) -> int:
+    """Số embedding hiện có của user_id (0 nếu chưa đăng ký), không đọc ma trận embedding."""
+    return embedding_store.count(user_id)
+
+def get_embedding_matrix(user_id: str) -> Optional[StoredMatrix]:
+    """
+    Lấy ma trận embedding (n x EMBEDDING_DIM, có thể đã lượng tử hóa) kèm bình phương chuẩn
+    từng hàng đã được cache của user. Cache được mở rộng tự động khi user đăng ký thêm embedding.
+    """
+    return embedding_store.get_matrix(user_id)
+
+def search_nearest_users(embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+    """Tìm k user có embedding gần `embedding` nhất: danh sách (user_id, khoảng cách nhỏ nhất)."""
+    return embedding_store.search(embedding, k)
+
+def ann_self_check(queries: int, k: int, nprobe: Optional[int] = None) -> Optional[dict]:
+    """
+    Đo recall của index ANN trong bộ nhớ so với tìm kiếm chính xác.
+    Trả về None nếu backend hiện tại không dùng index trong bộ nhớ.
+    """
+    ann_index = getattr(embedding_store, "ann_index", None)
+    if ann_index is None:
+        return None
+    return ann_index.self_check(queries=queries, k=k, nprobe=nprobe)
+
+def quantization_report(mode: str) -> dict:
+    """
+    So sánh quyết định xác thực theo OPTIMAL_THRESHOLD / CONFIDENCE_VERIFICATION_THRESHOLD
+    giữa float32 và dạng lượng tử hóa `mode` trên toàn bộ embedding hiện có.
+    """
+    users = [(user_id, embedding_store.get(user_id)) for user_id in embedding_store.user_ids()]
+    return calibration_report(
+        [(user_id, matrix) for user_id, matrix in users if matrix is not None],
+        mode,
+        distance_threshold=settings.OPTIMAL_THRESHOLD,
+        confidence_threshold=settings.CONFIDENCE_VERIFICATION_THRESHOLD,
     )
-    return None  # Hoặc trả về list rỗng: []
 
 def get_all_user_ids() -> List[str]:
     """Trả về danh sách tất cả user_id đã đăng ký."""
-    return list(embeddings_data.keys())
+    return embedding_store.user_ids()
 
-embeddings_data : Dict[str, List[List[float]]] = load_store()
\ No newline at end of file
+embedding_store : EmbeddingStore | PgVectorEmbeddingStore = load_store()
@@ -0,0 +1,387 @@
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+import numpy as np
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# --- Định dạng file journal ---
+# [MAGIC 8 byte][dim uint32] rồi nối tiếp các bản ghi:
+# [op uint8][độ dài user_id uint16][số hàng uint32][crc32 uint32][user_id utf-8][rows x dim float32]
+# Bản ghi OP_REPLACE có thêm [rows float32] trọng số sau ma trận và thay thế toàn bộ embedding của user
+# (dùng khi tóm tắt embedding của user thành các prototype).
+# Bản ghi cuối bị ghi dở (crash giữa chừng) được phát hiện nhờ độ dài/crc và bị cắt bỏ khi replay.
+JOURNAL_MAGIC = b"FEMBJRN1"
+_FILE_HEADER = struct.Struct("<I")
+_RECORD_HEADER = struct.Struct("<BHII")
+OP_ADD = 1
+OP_REPLACE = 2
+
+# (op, user_id, ma trận rows x dim, trọng số từng hàng hoặc None)
+JournalEntry = Tuple[int, str, np.ndarray, Optional[np.ndarray]]
+
+
+def encode_record(
+    op: int, user_id: str, matrix: np.ndarray, weights: Optional[np.ndarray] = None
+) -> bytes:
+    user_bytes = user_id.encode("utf-8")
+    payload = user_bytes + np.ascontiguousarray(matrix, dtype=np.float32).tobytes()
+    if op == OP_REPLACE:
+        payload += np.ascontiguousarray(weights, dtype=np.float32).tobytes()
+    header = _RECORD_HEADER.pack(op, len(user_bytes), matrix.shape[0], zlib.crc32(payload))
+    return header + payload
+
+
+def journal_path(base: Path, generation: int) -> Path:
+    return base.with_name(f"{base.name}.journal.{generation}")
+
+
+def lock_path(base: Path) -> Path:
+    return base.with_name(f"{base.name}.lock")
+
+
+def compaction_lock_path(base: Path) -> Path:
+    return base.with_name(f"{base.name}.compact.lock")
+
+
+def version_path(base: Path) -> Path:
+    return base.with_name(f"{base.name}.version")
+
+
+@contextmanager
+def file_lock(path: Path, exclusive: bool = True, blocking: bool = True) -> Iterator[bool]:
+    """
+    Khóa flock trên `path`, dùng chung giữa các worker (process) của cùng một store.
+    Mỗi lần khóa mở một file descriptor riêng nên các luồng trong cùng process cũng loại trừ nhau.
+    Trả về False (không chờ) nếu `blocking=False` và khóa đang bị giữ.
+    """
+    fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(fd, mode if blocking else mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)  # Đóng file descriptor cũng nhả khóa
+
+
+class SharedVersion:
+    """
+    Bộ đếm phiên bản dùng chung giữa các worker, là một file nhỏ được memory-map:
+    [số lần ghi uint64][generation của snapshot mới nhất uint64].
+    Chỉ được thay đổi khi đang giữ khóa ghi; việc đọc không cần khóa nên kiểm tra
+    "worker khác có ghi gì mới không" chỉ tốn một lần đọc bộ nhớ.
+    """
+
+    _LAYOUT = struct.Struct("<QQ")
+
+    def __init__(self, path: Path):
+        fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < self._LAYOUT.size:
+                os.ftruncate(fd, self._LAYOUT.size)
+            self._map = mmap.mmap(fd, self._LAYOUT.size)
+        finally:
+            os.close(fd)
+
+    def read(self) -> Tuple[int, int]:
+        return self._LAYOUT.unpack_from(self._map, 0)
+
+    def bump(self, snapshot_generation: Optional[int] = None) -> None:
+        commits, snapshot = self.read()
+        if snapshot_generation is not None:
+            snapshot = snapshot_generation
+        self._LAYOUT.pack_into(self._map, 0, commits + 1, snapshot)
+
+
+def list_journals(base: Path) -> List[Tuple[int, Path]]:
+    """Liệt kê các file journal của snapshot `base`, sắp xếp theo generation."""
+    pattern = re.compile(re.escape(base.name) + r"\.journal\.(\d+)$")
+    found = []
+    if base.parent.exists():
+        for child in base.parent.iterdir():
+            match = pattern.match(child.name)
+            if match:
+                found.append((int(match.group(1)), child))
+    return sorted(found)
+
+
+_JOURNAL_HEADER_SIZE = len(JOURNAL_MAGIC) + _FILE_HEADER.size
+
+
+def _parse_records(data: bytes, offset: int, dim: int) -> Tuple[List[JournalEntry], int]:
+    """Giải mã các bản ghi hợp lệ liên tiếp từ `offset`. Trả về (bản ghi, vị trí sau bản ghi cuối)."""
+    entries: List[JournalEntry] = []
+    row_bytes = dim * 4
+    while offset < len(data):
+        if offset + _RECORD_HEADER.size > len(data):
+            break
+        op, user_len, rows, crc = _RECORD_HEADER.unpack_from(data, offset)
+        start = offset + _RECORD_HEADER.size
+        end = start + user_len + rows * row_bytes
+        if op == OP_REPLACE:
+            end += rows * 4
+        if op not in (OP_ADD, OP_REPLACE) or end > len(data) or zlib.crc32(data[start:end]) != crc:
+            break
+        user_id = data[start:start + user_len].decode("utf-8")
+        matrix = np.frombuffer(
+            data, dtype=np.float32, count=rows * dim, offset=start + user_len
+        ).reshape(rows, dim)
+        weights = None
+        if op == OP_REPLACE:
+            weights = np.frombuffer(
+                data, dtype=np.float32, count=rows, offset=start + user_len + rows * row_bytes
+            )
+        entries.append((op, user_id, matrix, weights))
+        offset = end
+    return entries, offset
+
+
+def replay(path: Path, dim: int) -> Iterator[JournalEntry]:
+    """
+    Đọc tuần tự các bản ghi hợp lệ của một file journal.
+    Phần đuôi bị ghi dở hoặc hỏng sẽ bị cắt khỏi file để lần ghi tiếp theo nối tiếp đúng chỗ.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _JOURNAL_HEADER_SIZE or data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+        raise ValueError(f"File journal {path} không đúng định dạng.")
+    (file_dim,) = _FILE_HEADER.unpack_from(data, len(JOURNAL_MAGIC))
+    if file_dim != dim:
+        raise ValueError(f"Journal {path} có dim={file_dim} nhưng cấu hình yêu cầu dim={dim}.")
+
+    entries, offset = _parse_records(data, _JOURNAL_HEADER_SIZE, dim)
+    yield from entries
+
+    if offset < len(data):
+        print(f"Journal {path} có {len(data) - offset} byte cuối bị ghi dở, cắt bỏ.")
+        with open(path, "r+b") as f:
+            f.truncate(offset)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class _PendingCommit:
+    __slots__ = ("data", "payload", "done", "error")
+
+    def __init__(self, data: bytes, payload):
+        self.data = data
+        self.payload = payload
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+
+class EmbeddingJournal:
+    """
+    Journal chỉ ghi nối (append-only) cho các embedding mới, hỗ trợ group commit:
+    khi nhiều luồng cùng ghi, một luồng "leader" gom tất cả bản ghi đang chờ,
+    ghi bằng một lần write + fsync, rồi báo hoàn tất cho cả nhóm.
+    `on_commit(payloads, generation)` được gọi sau khi nhóm đã bền vững trên đĩa
+    và trước khi các luồng ghi được giải phóng.
+
+    Nhiều worker (process) có thể dùng chung journal: việc ghi được tuần tự hóa bằng flock,
+    trước khi ghi leader đọc nốt các bản ghi do worker khác ghi (`on_records(entries, generation)`)
+    để thứ tự áp dụng khớp thứ tự trong file, sau đó tăng `version` để báo cho các worker khác.
+    Khi file journal đang đọc đã bị compaction của worker khác gộp và xóa, `on_stale()` được gọi
+    để map lại snapshot và trả về generation của snapshot đó.
+    """
+
+    def __init__(
+        self,
+        base: Path,
+        dim: int,
+        generation: int,
+        on_commit: Callable[[List[object], int], None],
+        on_records: Optional[Callable[[List[JournalEntry], int], None]] = None,
+        on_stale: Optional[Callable[[], int]] = None,
+    ):
+        self.base = Path(base)
+        self.dim = dim
+        self.generation = generation
+        self._on_commit = on_commit
+        self._on_records = on_records
+        self._on_stale = on_stale
+        self._lock_path = lock_path(self.base)
+        self.version = SharedVersion(version_path(self.base))
+        self._cond = threading.Condition()
+        self._queue: List[_PendingCommit] = []
+        # Chỉ một luồng được ghi/đọc file journal tại một thời điểm (leader, sync hoặc rotate)
+        self._flushing = False
+        self._fd: Optional[int] = None
+        # Vị trí đã ghi/đọc tới trong file journal hiện tại
+        self._size = 0
+        # `version` ngay sau nhóm commit gần nhất của process này: mọi bản ghi tới phiên bản đó
+        # (của mọi worker) đã được áp dụng khi on_commit được gọi
+        self.committed_version: Tuple[int, int] = (0, 0)
+        self._open(generation)
+
+    @property
+    def path(self) -> Path:
+        return journal_path(self.base, self.generation)
+
+    def _open(self, generation: int, from_start: bool = False) -> None:
+        self.generation = generation
+        path = self.path
+        fd = os.open(str(path), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        size = os.fstat(fd).st_size
+        if size == 0:
+            header = JOURNAL_MAGIC + _FILE_HEADER.pack(self.dim)
+            os.write(fd, header)
+            os.fsync(fd)
+            size = len(header)
+        self._fd = fd
+        self._size = _JOURNAL_HEADER_SIZE if from_start else size
+
+    def _switch(self, generation: int) -> None:
+        os.close(self._fd)
+        self._open(generation, from_start=True)
+
+    def _catch_up(self, exclusive: bool) -> None:
+        """
+        Đọc các bản ghi do worker khác ghi sau vị trí hiện tại và chuyển sang các generation
+        mới hơn. Gọi khi đang giữ khóa file; với khóa ghi (`exclusive`) phần đuôi ghi dở
+        (worker bị crash giữa chừng) được cắt bỏ.
+        """
+        while True:
+            size = os.fstat(self._fd).st_size
+            if size > self._size:
+                data = os.pread(self._fd, size - self._size, self._size)
+                entries, consumed = _parse_records(data, 0, self.dim)
+                if entries and self._on_records is not None:
+                    self._on_records(entries, self.generation)
+                self._size += consumed
+                if consumed < len(data) and exclusive:
+                    print(f"Journal {self.path} có {len(data) - consumed} byte cuối bị ghi dở, cắt bỏ.")
+                    os.ftruncate(self._fd, self._size)
+            if journal_path(self.base, self.generation + 1).exists():
+                self._switch(self.generation + 1)
+                continue
+            if os.fstat(self._fd).st_nlink == 0 and self._on_stale is not None:
+                # Worker khác đã gộp (và xóa) journal này cùng các generation kế tiếp vào snapshot
+                self._switch(max(self.generation, self._on_stale()) + 1)
+                continue
+            return
+
+    def _acquire_role(self, wait: bool) -> bool:
+        with self._cond:
+            while self._flushing:
+                if not wait:
+                    return False
+                self._cond.wait()
+            self._flushing = True
+            return True
+
+    def _release_role(self) -> None:
+        with self._cond:
+            self._flushing = False
+            self._cond.notify_all()
+
+    def append(self, data: bytes, payload=None) -> None:
+        """Ghi một bản ghi đã mã hóa, chỉ trả về khi bản ghi đã được fsync."""
+        self.append_many([(data, payload)])
+
+    def append_many(self, records: List[Tuple[bytes, object]]) -> None:
+        """
+        Ghi nhiều bản ghi (data, payload) trong cùng một nhóm commit (một lần write + fsync).
+        Chỉ trả về khi tất cả đã được fsync.
+        """
+        pendings = [_PendingCommit(data, payload) for data, payload in records]
+        if not pendings:
+            return
+        with self._cond:
+            self._queue.extend(pendings)
+            while not pendings[-1].done:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                # Luồng này trở thành leader của nhóm commit tiếp theo
+                self._flushing = True
+                batch, self._queue = self._queue, []
+                self._cond.release()
+                error: Optional[BaseException] = None
+                try:
+                    with file_lock(self._lock_path):
+                        self._catch_up(exclusive=True)
+                        generation = self.generation
+                        self._write_batch(batch)
+                        self.version.bump()
+                        self.committed_version = self.version.read()
+                    self._on_commit([item.payload for item in batch], generation)
+                except BaseException as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    for item in batch:
+                        item.error = error
+                        item.done = True
+                    self._cond.notify_all()
+        for pending in pendings:
+            if pending.error is not None:
+                raise pending.error
+
+    def _write_batch(self, batch: List[_PendingCommit]) -> None:
+        buffer = memoryview(b"".join(item.data for item in batch))
+        try:
+            written = 0
+            while written < len(buffer):
+                written += os.write(self._fd, buffer[written:])
+            os.fsync(self._fd)
+        except BaseException:
+            # Bỏ phần đã ghi dở để file journal luôn kết thúc ở ranh giới bản ghi
+            try:
+                os.ftruncate(self._fd, self._size)
+            except OSError:
+                pass
+            raise
+        self._size += len(buffer)
+
+    def sync(self) -> bool:
+        """
+        Đọc các bản ghi mới do worker khác ghi. Trả về False (không chờ) nếu một luồng khác
+        của process đang ghi/đọc journal - luồng đó sẽ tự đọc nốt các bản ghi mới.
+        """
+        if self._fd is None or not self._acquire_role(wait=False):
+            return False
+        try:
+            with file_lock(self._lock_path, exclusive=False):
+                self._catch_up(exclusive=False)
+        finally:
+            self._release_role()
+        return True
+
+    def rotate(self) -> int:
+        """
+        Chuyển sang file journal generation kế tiếp. Trả về generation cũ;
+        mọi bản ghi của generation đó (kể cả của worker khác) đều đã được ghi và áp dụng
+        khi hàm trả về, và không worker nào còn ghi vào nó.
+        """
+        self._acquire_role(wait=True)
+        try:
+            with file_lock(self._lock_path):
+                self._catch_up(exclusive=True)
+                old_generation = self.generation
+                os.close(self._fd)
+                self._open(old_generation + 1)
+                self.version.bump()
+            return old_generation
+        finally:
+            self._release_role()
+
+    def close(self) -> None:
+        self._acquire_role(wait=True)
+        try:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+        finally:
+            self._release_role()
@@ -0,0 +1,774 @@
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import numpy as np
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.ann_index import IVFFlatIndex
+from app.core.prototypes import centroid_bounds, summarize
+from app.core.quantization import (
+    StoredMatrix,
+    dequantize,
+    dot_products,
+    quantize,
+    row_sq_norms,
+    storage_dtype,
+    to_stored_matrix,
+)
+from app.core.embedding_journal import (
+    OP_ADD,
+    OP_REPLACE,
+    EmbeddingJournal,
+    JournalEntry,
+    compaction_lock_path,
+    encode_record,
+    file_lock,
+    list_journals,
+    lock_path,
+    replay,
+)
+
+# --- Định dạng file snapshot ---
+# [MAGIC 8 byte][độ dài header uint32][header JSON][padding][ma trận (rows x dim)][padding][scales]
+# [padding][weights]
+# Ma trận là float32, hoặc float16/int8 khi bật lượng tử hóa; "scales" (float32, mỗi hàng một giá trị)
+# chỉ có với int8; "weights" (float32, mỗi hàng một giá trị) chỉ có khi header có "weights": true,
+# tức có user đã được tóm tắt thành prototype có trọng số. Header JSON chứa bảng chỉ mục user_id -> (hàng bắt đầu, số hàng), các hàng của
+# cùng một user luôn nằm liền nhau nên việc lấy embedding chỉ là cắt một view.
+SNAPSHOT_MAGIC = b"FEMBSNP1"
+SNAPSHOT_VERSION = 1
+_HEADER_LEN = struct.Struct("<I")
+_DATA_ALIGNMENT = 64
+
+
+def _align(offset: int, alignment: int = _DATA_ALIGNMENT) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _data_offset(header_len: int) -> int:
+    """Ma trận bắt đầu ở vị trí căn lề 64 byte ngay sau header."""
+    return _align(len(SNAPSHOT_MAGIC) + _HEADER_LEN.size + header_len)
+
+
+def _scales_offset(data_offset: int, rows: int, dim: int, dtype: np.dtype) -> int:
+    """Mảng scales (int8) bắt đầu ở vị trí căn lề ngay sau ma trận."""
+    return _align(data_offset + rows * dim * dtype.itemsize)
+
+
+def _weights_offset(data_offset: int, rows: int, dim: int, dtype: np.dtype) -> int:
+    """Mảng weights bắt đầu ở vị trí căn lề ngay sau scales (hoặc sau ma trận nếu không có scales)."""
+    offset = _scales_offset(data_offset, rows, dim, dtype)
+    if dtype == np.int8:
+        offset = _align(offset + rows * 4)
+    return offset
+
+
+def _fsync_dir(path: Path) -> None:
+    """Đồng bộ thư mục chứa file để thao tác os.replace được ghi bền vững."""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(
+    path: Path,
+    dim: int,
+    users: Iterable[Tuple[str, np.ndarray]],
+    generation: int = 0,
+    quantization: str = "none",
+    weights: Optional[Dict[str, np.ndarray]] = None,
+) -> int:
+    """
+    Ghi một snapshot mới ra file tạm rồi os.replace để thay file cũ một cách nguyên tử.
+    `users` là các cặp (user_id, ma trận n x dim); `generation` là generation journal
+    cuối cùng đã được gộp vào snapshot; `quantization` là "none", "float16" hoặc "int8";
+    `weights` là trọng số từng hàng của các user đã được tóm tắt (user khác có trọng số 1).
+    Trả về tổng số hàng đã ghi.
+    """
+    weights = weights or {}
+    dtype = storage_dtype(quantization)
+    path = Path(path)
+    blocks: List[Tuple[str, np.ndarray]] = []
+    ranges: Dict[str, List[int]] = {}
+    rows = 0
+    for user_id, matrix in users:
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, dim)
+        if matrix.shape[0] == 0:
+            continue
+        ranges[user_id] = [rows, int(matrix.shape[0])]
+        blocks.append((user_id, matrix))
+        rows += int(matrix.shape[0])
+
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "dim": dim,
+        "rows": rows,
+        "dtype": dtype.name,
+        "generation": generation,
+        "weights": bool(weights),
+        "users": ranges,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_offset = _data_offset(len(header_bytes))
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_HEADER_LEN.pack(len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_offset - f.tell()))
+        scales = []
+        for _, matrix in blocks:
+            codes, block_scales = quantize(matrix, quantization)
+            f.write(np.ascontiguousarray(codes).tobytes())
+            if block_scales is not None:
+                scales.append(block_scales)
+        if quantization == "int8":
+            f.write(b"\0" * (_scales_offset(data_offset, rows, dim, dtype) - f.tell()))
+            for block_scales in scales:
+                f.write(block_scales.astype(np.float32).tobytes())
+        if weights:
+            f.write(b"\0" * (_weights_offset(data_offset, rows, dim, dtype) - f.tell()))
+            for user_id, matrix in blocks:
+                block_weights = weights.get(user_id)
+                if block_weights is None:
+                    block_weights = np.ones(matrix.shape[0], dtype=np.float32)
+                f.write(np.asarray(block_weights, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+    return rows
+
+
+def read_snapshot_header(f: io.BufferedReader) -> dict:
+    magic = f.read(len(SNAPSHOT_MAGIC))
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("File snapshot embedding không đúng định dạng (sai magic).")
+    (header_len,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+    header = json.loads(f.read(header_len).decode("utf-8"))
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Phiên bản snapshot không được hỗ trợ: {header.get('version')}")
+    header["data_offset"] = _data_offset(header_len)
+    return header
+
+
+class EmbeddingStore:
+    """
+    Kho embedding khuôn mặt gồm hai phần:
+    - snapshot: toàn bộ vector trong một file liên tục, được memory-map khi khởi động
+      (không phải parse JSON); lấy embedding của một user là một view không sao chép.
+      Có thể lưu dạng lượng tử hóa float16 / int8 (`quantization`) để giảm 2-4 lần dung lượng
+      file và cache; khoảng cách được tính trực tiếp trên dữ liệu lượng tử hóa.
+    - journal: các embedding mới được ghi nối vào journal (group commit, O(1) I/O mỗi lần
+      đăng ký) và được gộp định kỳ vào snapshot mới bởi luồng compaction chạy nền.
+    Khi một user vượt quá `max_per_user` embedding, các embedding của user được tóm tắt thành
+    `prototypes_per_user` prototype có trọng số (bản ghi OP_REPLACE trong journal).
+    Nhiều worker (process) có thể mở cùng một store: mỗi lần đọc, `sync()` so bộ đếm phiên bản
+    dùng chung và chỉ áp dụng phần journal mới do worker khác ghi (không tải lại toàn bộ store).
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        dim: int,
+        ann_index: Optional[IVFFlatIndex] = None,
+        quantization: str = "none",
+        max_per_user: int = 0,
+        prototypes_per_user: int = 0,
+    ):
+        if max_per_user and not 0 < prototypes_per_user < max_per_user:
+            raise ValueError(
+                "prototypes_per_user phải lớn hơn 0 và nhỏ hơn max_per_user khi bật giới hạn embedding."
+            )
+        self.path = Path(path)
+        self.dim = dim
+        self.quantization = quantization
+        self.max_per_user = max_per_user  # 0: không giới hạn
+        self.prototypes_per_user = prototypes_per_user
+        self._storage_dtype = storage_dtype(quantization)
+        # Index ANN (tùy chọn) cho truy vấn "đây là ai?", được cập nhật mỗi khi thêm embedding
+        self.ann_index = ann_index
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._mmap: Optional[mmap.mmap] = None
+        self._matrix: np.ndarray = np.empty((0, dim), dtype=np.float32)
+        self._scales: Optional[np.ndarray] = None
+        self._weights: Optional[np.ndarray] = None
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        self._generation = 0
+        # Các bản ghi journal chưa gộp vào snapshot:
+        # user_id -> [(generation, op, ma trận, trọng số hoặc None)]
+        self._tail: Dict[str, List[Tuple[int, int, np.ndarray, Optional[np.ndarray]]]] = {}
+        self._tail_rows = 0
+        # Cache ma trận đã xếp chồng (n x dim, theo kiểu lưu trữ đã cấu hình) và bình phương chuẩn từng hàng
+        self._matrix_cache: Dict[str, StoredMatrix] = {}
+        # Khóa theo user: việc thêm embedding và tóm tắt của cùng một user không chen nhau
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._journal: Optional[EmbeddingJournal] = None
+        self._compaction_thread: Optional[threading.Thread] = None
+        self._compaction_stop = threading.Event()
+        self._replaying = False
+        # Phiên bản dùng chung (số lần ghi, generation snapshot) đã được áp dụng
+        self._seen_version: Tuple[int, int] = (0, 0)
+
+    # --- Mở store ---
+    def open(self) -> None:
+        """Memory-map snapshot hiện tại, replay các journal chưa gộp và mở journal để ghi."""
+        with file_lock(lock_path(self.path)), self._lock:
+            self._map_snapshot()
+            self._tail = {}
+            self._tail_rows = 0
+            self._replaying = True
+            journals = list_journals(self.path)
+            for generation, journal_file in journals:
+                if generation <= self._generation:
+                    # Journal đã được gộp vào snapshot (crash sau compaction) -> xóa
+                    journal_file.unlink(missing_ok=True)
+                    continue
+                replayed = 0
+                for op, user_id, matrix, weights in replay(journal_file, self.dim):
+                    self._apply(op, user_id, matrix, weights, generation)
+                    replayed += matrix.shape[0]
+                print(f"Đã replay {replayed} embeddings từ {journal_file}")
+            self._replaying = False
+            if self.ann_index is not None:
+                self.ann_index.build(self._items_locked())
+            current = max(
+                [self._generation + 1] + [g for g, _ in journals if g > self._generation]
+            )
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = EmbeddingJournal(
+                self.path,
+                self.dim,
+                current,
+                on_commit=self._on_commit,
+                on_records=self._on_records,
+                on_stale=self._on_stale,
+            )
+            self._seen_version = self._journal.version.read()
+
+    # --- Đồng bộ giữa các worker ---
+    def sync(self) -> None:
+        """
+        Áp dụng thay đổi do worker khác ghi: chỉ đọc phần journal mới, và map lại snapshot
+        nếu worker khác vừa compaction. Khi không có gì mới chỉ tốn một lần đọc bộ nhớ.
+        Không được gọi khi đang giữ self._lock.
+        """
+        journal = self._journal
+        if journal is None:
+            return
+        version = journal.version.read()
+        if version == self._seen_version or not journal.sync():
+            return
+        self._seen_version = version
+        if version[1] > self._generation:
+            with self._lock:
+                self._remap_snapshot()
+
+    def _on_records(self, entries: List[JournalEntry], generation: int) -> None:
+        with self._lock:
+            for op, user_id, matrix, weights in entries:
+                if generation > self._generation:
+                    self._apply(op, user_id, matrix, weights, generation)
+                elif self.ann_index is not None:
+                    # Bản ghi đã nằm trong snapshot mà worker khác vừa ghi: chỉ cập nhật index ANN
+                    if op == OP_REPLACE:
+                        self.ann_index.replace(user_id, matrix)
+                    else:
+                        self.ann_index.add(user_id, matrix)
+
+    def _on_stale(self) -> int:
+        """Journal đang đọc đã bị worker khác gộp vào snapshot và xóa: map lại snapshot mới."""
+        with self._lock:
+            self._remap_snapshot()
+            if self.ann_index is not None:
+                # Có thể đã bỏ qua bản ghi chưa đọc, xây lại index từ snapshot
+                self.ann_index.build(self._items_locked())
+            return self._generation
+
+    def _remap_snapshot(self) -> None:
+        """Map lại snapshot trên đĩa và bỏ các bản ghi journal đã được gộp vào nó."""
+        self._map_snapshot()
+        absorbed = self._generation
+        for user_id in list(self._tail):
+            remaining = [entry for entry in self._tail[user_id] if entry[0] > absorbed]
+            if remaining:
+                self._tail[user_id] = remaining
+            else:
+                del self._tail[user_id]
+        self._tail_rows = sum(
+            entry[2].shape[0] for entries in self._tail.values() for entry in entries
+        )
+
+    def _map_snapshot(self) -> None:
+        # Bỏ cache để không giữ lại vùng map của snapshot cũ
+        self._matrix_cache = {}
+        if not self.path.exists():
+            self._set_empty()
+            return
+        with open(self.path, "rb") as f:
+            header = read_snapshot_header(f)
+            if header["dim"] != self.dim:
+                raise ValueError(
+                    f"Snapshot có dim={header['dim']} nhưng cấu hình yêu cầu dim={self.dim}."
+                )
+            rows = int(header["rows"])
+            ranges = {
+                user_id: (int(start), int(count))
+                for user_id, (start, count) in header["users"].items()
+            }
+            generation = int(header.get("generation", 0))
+            if rows == 0:
+                self._set_empty()
+                self._generation = generation
+                return
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        dtype = np.dtype(header.get("dtype", "float32"))
+        matrix = np.frombuffer(
+            mapped,
+            dtype=dtype,
+            count=rows * self.dim,
+            offset=int(header["data_offset"]),
+        ).reshape(rows, self.dim)
+        scales = None
+        if dtype == np.int8:
+            scales = np.frombuffer(
+                mapped,
+                dtype=np.float32,
+                count=rows,
+                offset=_scales_offset(int(header["data_offset"]), rows, self.dim, dtype),
+            )
+        weights = None
+        if header.get("weights"):
+            weights = np.frombuffer(
+                mapped,
+                dtype=np.float32,
+                count=rows,
+                offset=_weights_offset(int(header["data_offset"]), rows, self.dim, dtype),
+            )
+        # Không đóng mmap cũ: các view đang được request khác giữ vẫn phải hợp lệ,
+        # vùng map sẽ được giải phóng khi view cuối cùng bị thu hồi.
+        self._mmap = mapped
+        self._matrix = matrix
+        self._scales = scales
+        self._weights = weights
+        self._ranges = ranges
+        self._generation = generation
+
+    def _set_empty(self) -> None:
+        self._mmap = None
+        self._matrix = np.empty((0, self.dim), dtype=self._storage_dtype)
+        self._scales = None
+        self._weights = None
+        self._ranges = {}
+        self._generation = 0
+
+    # --- Đọc ---
+    def __len__(self) -> int:
+        self.sync()
+        with self._lock:
+            if not self._tail:
+                return int(self._matrix.shape[0])
+            return sum(self._count_locked(user_id) for user_id in self._user_ids_locked())
+
+    def user_ids(self) -> List[str]:
+        self.sync()
+        with self._lock:
+            return self._user_ids_locked()
+
+    def _user_ids_locked(self) -> List[str]:
+        ids = list(self._ranges.keys())
+        ids.extend(user_id for user_id in self._tail if user_id not in self._ranges)
+        return ids
+
+    def count(self, user_id: str) -> int:
+        self.sync()
+        with self._lock:
+            return self._count_locked(user_id)
+
+    def _count_locked(self, user_id: str) -> int:
+        entry = self._ranges.get(user_id)
+        total = entry[1] if entry else 0
+        for _, op, matrix, _ in self._tail.get(user_id, ()):
+            total = matrix.shape[0] if op == OP_REPLACE else total + matrix.shape[0]
+        return total
+
+    def get(self, user_id: str) -> Optional[np.ndarray]:
+        """
+        Trả về ma trận float32 (n x dim) của user, hoặc None.
+        Với snapshot float32 và user không có embedding nào đang nằm trong journal, kết quả
+        là view chỉ đọc trên vùng nhớ đã map (không sao chép); snapshot lượng tử hóa
+        được giải lượng tử thành bản sao.
+        """
+        self.sync()
+        with self._lock:
+            return self._get_locked(user_id)
+
+    def _get_locked(
+        self, user_id: str, max_generation: Optional[int] = None
+    ) -> Optional[np.ndarray]:
+        return self._resolve_locked(user_id, max_generation)[0]
+
+    def _resolve_locked(
+        self, user_id: str, max_generation: Optional[int] = None
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Ghép embedding của user từ snapshot và các bản ghi journal (tới `max_generation`).
+        Bản ghi OP_REPLACE thay thế mọi hàng trước đó. Trả về (ma trận float32, trọng số hoặc None).
+        """
+        entry = self._ranges.get(user_id)
+        blocks: List[np.ndarray] = []
+        block_weights: List[Optional[np.ndarray]] = []
+        if entry:
+            start, count = entry
+            base = self._matrix[start:start + count]
+            if self._scales is not None:
+                base = dequantize(base, self._scales[start:start + count])
+            elif base.dtype != np.float32:
+                base = dequantize(base)
+            blocks.append(base)
+            block_weights.append(
+                None if self._weights is None else self._weights[start:start + count]
+            )
+        for generation, op, matrix, weights in self._tail.get(user_id, ()):
+            if max_generation is not None and generation > max_generation:
+                continue
+            if op == OP_REPLACE:
+                blocks, block_weights = [], []
+            blocks.append(matrix)
+            block_weights.append(weights)
+        if not blocks:
+            return None, None
+        matrix = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+        if all(w is None for w in block_weights):
+            return matrix, None
+        weights = np.concatenate([
+            np.ones(len(block), dtype=np.float32) if w is None else w
+            for block, w in zip(blocks, block_weights)
+        ])
+        if np.all(weights == 1.0):
+            weights = None
+        return matrix, weights
+
+    def get_matrix(self, user_id: str) -> Optional[StoredMatrix]:
+        """
+        Trả về StoredMatrix (ma trận n x dim theo kiểu lưu trữ đã cấu hình, bình phương chuẩn
+        từng hàng, scales với int8) của user từ cache, tạo mới nếu chưa có.
+        Dùng để tính khoảng cách bằng một phép nhân ma trận-vector.
+        """
+        self.sync()
+        with self._lock:
+            cached = self._matrix_cache.get(user_id)
+            if cached is not None:
+                return cached
+            entry = self._ranges.get(user_id)
+            if (
+                entry
+                and user_id not in self._tail
+                and self._matrix.dtype == self._storage_dtype
+            ):
+                # Dùng thẳng vùng nhớ đã map, không sao chép
+                start, count = entry
+                codes = self._matrix[start:start + count]
+                scales = None if self._scales is None else self._scales[start:start + count]
+                weights = None if self._weights is None else self._weights[start:start + count]
+                if weights is not None and np.all(weights == 1.0):
+                    weights = None
+                cached = StoredMatrix(codes, row_sq_norms(codes, scales), scales, weights)
+            else:
+                matrix, weights = self._resolve_locked(user_id)
+                if matrix is None or len(matrix) == 0:
+                    return None
+                cached = to_stored_matrix(matrix, self.quantization)._replace(weights=weights)
+            cached = self._with_bounds(cached)
+            self._matrix_cache[user_id] = cached
+            return cached
+
+    @staticmethod
+    def _with_bounds(stored: StoredMatrix) -> StoredMatrix:
+        """Bổ sung tâm và bán kính (tính trên giá trị đã giải lượng tử) cho entry cache."""
+        centroid, radius = centroid_bounds(dequantize(stored.matrix, stored.scales), stored.weights)
+        return stored._replace(centroid=centroid, radius=radius)
+
+    def search(self, embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """
+        Tìm k user gần nhất với `embedding`: qua index ANN nếu có, ngược lại quét toàn bộ store.
+        Trả về danh sách (user_id, khoảng cách nhỏ nhất) theo thứ tự tăng dần.
+        """
+        self.sync()
+        if self.ann_index is not None:
+            return self.ann_index.search(embedding, k)
+        query = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        query_sq_norm = float(query @ query)
+        nearest = []
+        for user_id in self.user_ids():
+            cached = self.get_matrix(user_id)
+            if cached is None:
+                continue
+            min_sq = float(np.min(
+                cached.sq_norms - 2.0 * dot_products(query, cached.matrix, cached.scales)
+            )) + query_sq_norm
+            nearest.append((user_id, float(np.sqrt(max(min_sq, 0.0)))))
+        nearest.sort(key=lambda item: item[1])
+        return nearest[:k]
+
+    def items(self) -> List[Tuple[str, np.ndarray]]:
+        self.sync()
+        with self._lock:
+            return self._items_locked()
+
+    def _items_locked(self) -> List[Tuple[str, np.ndarray]]:
+        return [(user_id, matrix) for user_id, matrix, _ in self._weighted_items()]
+
+    def _weighted_items(
+        self, max_generation: Optional[int] = None
+    ) -> List[Tuple[str, np.ndarray, Optional[np.ndarray]]]:
+        with self._lock:
+            result = []
+            for user_id in self._user_ids_locked():
+                matrix, weights = self._resolve_locked(user_id, max_generation)
+                if matrix is not None:
+                    result.append((user_id, matrix, weights))
+            return result
+
+    # --- Ghi ---
+    def add(self, user_id: str, embedding: np.ndarray) -> int:
+        """
+        Thêm embedding cho user_id bằng một bản ghi journal (không ghi lại toàn bộ store).
+        Chỉ trả về sau khi bản ghi đã fsync. Nếu user vượt quá `max_per_user` embedding,
+        các embedding được tóm tắt thành prototype ngay sau đó.
+        Trả về số embedding (hoặc prototype) hiện có của user.
+        """
+        matrix = np.array(embedding, dtype=np.float32).reshape(-1, self.dim)
+        if self._journal is None:
+            raise RuntimeError("EmbeddingStore chưa được mở.")
+        with self._user_lock(user_id):
+            record = encode_record(OP_ADD, user_id, matrix)
+            self._journal.append(record, payload=(OP_ADD, user_id, matrix, None))
+            total = self.count(user_id)
+            if self.max_per_user and total > self.max_per_user:
+                total = self._summarize(user_id)
+        return total
+
+    def add_many(self, entries: List[Tuple[str, np.ndarray]]) -> Dict[str, int]:
+        """
+        Thêm embedding cho nhiều user trong MỘT nhóm commit journal (một lần write + fsync).
+        Các user vượt quá `max_per_user` được tóm tắt sau khi ghi.
+        Trả về số embedding (hoặc prototype) hiện có của từng user.
+        """
+        if self._journal is None:
+            raise RuntimeError("EmbeddingStore chưa được mở.")
+        records = []
+        for user_id, embedding in entries:
+            matrix = np.array(embedding, dtype=np.float32).reshape(-1, self.dim)
+            records.append(
+                (encode_record(OP_ADD, user_id, matrix), (OP_ADD, user_id, matrix, None))
+            )
+        user_ids = sorted({user_id for user_id, _ in entries})
+        # Khóa theo thứ tự cố định để không deadlock với các lần thêm song song khác
+        locks = [self._user_lock(user_id) for user_id in user_ids]
+        for lock in locks:
+            lock.acquire()
+        try:
+            self._journal.append_many(records)
+            totals = {}
+            for user_id in user_ids:
+                total = self.count(user_id)
+                if self.max_per_user and total > self.max_per_user:
+                    total = self._summarize(user_id)
+                totals[user_id] = total
+            return totals
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+
+    def _summarize(self, user_id: str) -> int:
+        """Thay embedding của user bằng `prototypes_per_user` prototype (gọi khi giữ khóa của user)."""
+        with self._lock:
+            matrix, weights = self._resolve_locked(user_id)
+        prototypes, prototype_weights = summarize(matrix, weights, self.prototypes_per_user)
+        record = encode_record(OP_REPLACE, user_id, prototypes, prototype_weights)
+        self._journal.append(
+            record, payload=(OP_REPLACE, user_id, prototypes, prototype_weights)
+        )
+        print(
+            f"Đã tóm tắt {len(matrix)} embeddings của user_id: {user_id} "
+            f"thành {len(prototypes)} prototypes."
+        )
+        return len(prototypes)
+
+    def _on_commit(
+        self,
+        payloads: List[Tuple[int, str, np.ndarray, Optional[np.ndarray]]],
+        generation: int,
+    ) -> None:
+        with self._lock:
+            for op, user_id, matrix, weights in payloads:
+                self._apply(op, user_id, matrix, weights, generation)
+            # Bản ghi của worker khác đã được đọc hết trước khi ghi nên lần đọc sau không cần
+            # khóa journal nữa; nếu worker khác vừa compaction thì để sync() map lại snapshot
+            version = self._journal.committed_version
+            if version[1] <= self._generation:
+                self._seen_version = max(self._seen_version, version)
+
+    def _apply(
+        self,
+        op: int,
+        user_id: str,
+        matrix: np.ndarray,
+        weights: Optional[np.ndarray],
+        generation: int,
+    ) -> None:
+        self._tail.setdefault(user_id, []).append((generation, op, matrix, weights))
+        self._tail_rows += matrix.shape[0]
+        if op == OP_REPLACE:
+            if self.ann_index is not None and not self._replaying:
+                self.ann_index.replace(user_id, matrix)
+            # Entry cache được tạo lại (kèm trọng số) ở lần đọc tiếp theo
+            self._matrix_cache.pop(user_id, None)
+            return
+        if self.ann_index is not None and not self._replaying:
+            self.ann_index.add(user_id, matrix)
+        cached = self._matrix_cache.get(user_id)
+        if cached is not None:
+            # Mở rộng entry cache thay vì xếp chồng lại toàn bộ
+            added = to_stored_matrix(matrix, self.quantization)
+            self._matrix_cache[user_id] = self._with_bounds(StoredMatrix(
+                np.concatenate([cached.matrix, added.matrix]),
+                np.concatenate([cached.sq_norms, added.sq_norms]),
+                None if added.scales is None else np.concatenate([cached.scales, added.scales]),
+                None if cached.weights is None else np.concatenate(
+                    [cached.weights, np.ones(len(matrix), dtype=np.float32)]
+                ),
+            ))
+
+    # --- Compaction ---
+    def compact(self) -> bool:
+        """
+        Gộp snapshot hiện tại và các journal đã đóng thành snapshot mới.
+        Việc ghi snapshot diễn ra ngoài lock nên đọc/ghi embedding không bị chặn.
+        Mỗi thời điểm chỉ một worker được compaction; worker khác bỏ qua lượt này.
+        """
+        with self._compact_lock:
+            if self._journal is None:
+                return False
+            self.sync()
+            with file_lock(compaction_lock_path(self.path), blocking=False) as acquired:
+                if not acquired:
+                    return False
+                return self._compact_locked()
+
+    def _compact_locked(self) -> bool:
+        # Vẫn ghi lại snapshot khi kiểu lưu trữ khác cấu hình (vd: vừa bật lượng tử hóa)
+        if self._tail_rows == 0 and (
+            len(self._matrix) == 0 or self._matrix.dtype == self._storage_dtype
+        ):
+            return False
+        absorbed = self._journal.rotate()
+        users = self._weighted_items(max_generation=absorbed)
+        rows = write_snapshot(
+            self.path,
+            self.dim,
+            [(user_id, matrix) for user_id, matrix, _ in users],
+            generation=absorbed,
+            quantization=self.quantization,
+            weights={
+                user_id: weights for user_id, _, weights in users if weights is not None
+            },
+        )
+        with file_lock(lock_path(self.path)):
+            with self._lock:
+                self._remap_snapshot()
+            # Báo cho các worker khác map lại snapshot mới
+            self._journal.version.bump(snapshot_generation=absorbed)
+        for generation, journal_file in list_journals(self.path):
+            if generation <= absorbed:
+                journal_file.unlink(missing_ok=True)
+        print(f"Compaction embedding store: {rows} embeddings trong snapshot mới.")
+        return True
+
+    def start_background_compaction(self, interval: float) -> None:
+        if self._compaction_thread is not None:
+            return
+        self._compaction_stop.clear()
+
+        def _run():
+            while not self._compaction_stop.wait(interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"Lỗi khi compaction embedding store: {e}")
+
+        self._compaction_thread = threading.Thread(
+            target=_run, name="embedding-compaction", daemon=True
+        )
+        self._compaction_thread.start()
+
+    def stop_background_compaction(self) -> None:
+        if self._compaction_thread is None:
+            return
+        self._compaction_stop.set()
+        self._compaction_thread.join()
+        self._compaction_thread = None
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Lỗi khi compaction embedding store: {e}")
+
+    def migrate_from_json(self, json_path: Path) -> int:
+        """
+        Chuyển đổi một lần từ embeddings_store.json (định dạng cũ) sang snapshot nhị phân.
+        Các embedding sai kích thước hoặc không phải list số bị bỏ qua.
+        Trả về số embedding đã chuyển (0 nếu worker khác đã chuyển đổi trước).
+        """
+        with file_lock(lock_path(self.path)):
+            if self.path.exists():
+                return 0
+            return self._migrate_from_json(json_path)
+
+    def _migrate_from_json(self, json_path: Path) -> int:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        users = []
+        for user_id, embeddings in data.items():
+            if not isinstance(embeddings, list):
+                print(
+                    f"Dữ liệu cho user_id '{user_id}' trong store không phải là list, bỏ qua user này."
+                )
+                continue
+            valid = []
+            for emb_list in embeddings:
+                if (
+                    isinstance(emb_list, list)
+                    and len(emb_list) == self.dim
+                    and all(isinstance(x, (int, float)) for x in emb_list)
+                ):
+                    valid.append(emb_list)
+                else:
+                    print(
+                        f"Một embedding cho user_id '{user_id}' không hợp lệ, bỏ qua khi chuyển đổi."
+                    )
+            if valid:
+                users.append((user_id, np.array(valid, dtype=np.float32)))
+        return write_snapshot(self.path, self.dim, users, quantization=self.quantization)
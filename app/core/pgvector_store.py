@@ -0,0 +1,159 @@
+import numpy as np
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Engine, func, text
+from sqlmodel import Session, select
+
+from app.core.quantization import StoredMatrix
+from app.model import FaceEmbedding
+
+
+class PgVectorEmbeddingStore:
+    """
+    Kho embedding khuôn mặt lưu trong Postgres (cột vector(dim) của pgvector) với index
+    ANN (HNSW hoặc IVFFlat). Nhiều worker API dùng chung một store nhất quán và việc
+    nhận diện 1:N không phải quét tuyến tính toàn bộ embedding.
+    Giao diện giống EmbeddingStore để app/core/db.py có thể chọn backend qua Settings.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        dim: int,
+        index_type: str = "hnsw",
+        ivfflat_lists: int = 100,
+        ef_search: int = 40,
+        ivfflat_probes: int = 10,
+    ):
+        if index_type not in ("hnsw", "ivfflat"):
+            raise ValueError(f"Loại index pgvector không hợp lệ: {index_type}")
+        self.engine = engine
+        self.dim = dim
+        self.index_type = index_type
+        self.ivfflat_lists = ivfflat_lists
+        self.ef_search = ef_search
+        self.ivfflat_probes = ivfflat_probes
+
+    # --- Khởi tạo ---
+    def open(self) -> None:
+        """Bật extension vector, tạo bảng và index ANN nếu chưa có."""
+        table = FaceEmbedding.__table__
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        table.create(self.engine, checkfirst=True)
+        if self.index_type == "hnsw":
+            index_sql = (
+                f"CREATE INDEX IF NOT EXISTS ix_{table.name}_embedding_hnsw "
+                f"ON {table.name} USING hnsw (embedding vector_l2_ops)"
+            )
+        else:
+            index_sql = (
+                f"CREATE INDEX IF NOT EXISTS ix_{table.name}_embedding_ivfflat "
+                f"ON {table.name} USING ivfflat (embedding vector_l2_ops) "
+                f"WITH (lists = {int(self.ivfflat_lists)})"
+            )
+        with self.engine.begin() as conn:
+            conn.execute(text(index_sql))
+
+    def import_from(self, users: Iterable[Tuple[str, np.ndarray]]) -> int:
+        """Chép embedding từ một store khác (vd: snapshot file) vào bảng. Trả về số hàng đã chép."""
+        rows = 0
+        with Session(self.engine) as session:
+            for user_id, matrix in users:
+                for vector in np.asarray(matrix, dtype=np.float32):
+                    session.add(FaceEmbedding(user_id=user_id, embedding=vector))
+                    rows += 1
+            session.commit()
+        return rows
+
+    # --- Đọc ---
+    def __len__(self) -> int:
+        with Session(self.engine) as session:
+            return int(session.exec(select(func.count(FaceEmbedding.id))).one())
+
+    def user_ids(self) -> List[str]:
+        with Session(self.engine) as session:
+            statement = (
+                select(FaceEmbedding.user_id)
+                .group_by(FaceEmbedding.user_id)
+                .order_by(func.min(FaceEmbedding.id))
+            )
+            return list(session.exec(statement).all())
+
+    def count(self, user_id: str) -> int:
+        with Session(self.engine) as session:
+            statement = select(func.count(FaceEmbedding.id)).where(
+                FaceEmbedding.user_id == user_id
+            )
+            return int(session.exec(statement).one())
+
+    def get(self, user_id: str) -> Optional[np.ndarray]:
+        with Session(self.engine) as session:
+            statement = (
+                select(FaceEmbedding.embedding)
+                .where(FaceEmbedding.user_id == user_id)
+                .order_by(FaceEmbedding.id)
+            )
+            vectors = session.exec(statement).all()
+        if not vectors:
+            return None
+        return np.stack([np.asarray(v, dtype=np.float32) for v in vectors])
+
+    def get_matrix(self, user_id: str) -> Optional[StoredMatrix]:
+        # Không cache trong process: mọi worker đọc trực tiếp từ Postgres để luôn nhất quán
+        matrix = self.get(user_id)
+        if matrix is None:
+            return None
+        return StoredMatrix(matrix, np.einsum("ij,ij->i", matrix, matrix))
+
+    def search(self, embedding: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """
+        Tìm k user gần nhất với `embedding` qua index ANN.
+        Trả về danh sách (user_id, khoảng cách nhỏ nhất) theo thứ tự tăng dần.
+        """
+        vector = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        distance = FaceEmbedding.embedding.l2_distance(vector)
+        with Session(self.engine) as session:
+            if self.index_type == "hnsw":
+                session.execute(text(f"SET LOCAL hnsw.ef_search = {int(self.ef_search)}"))
+            else:
+                session.execute(text(f"SET LOCAL ivfflat.probes = {int(self.ivfflat_probes)}"))
+            # Lấy dư ứng viên vì một user có thể chiếm nhiều hàng trong top kết quả
+            statement = (
+                select(FaceEmbedding.user_id, distance.label("distance"))
+                .order_by(distance)
+                .limit(max(k, 1) * 10)
+            )
+            rows = session.exec(statement).all()
+        nearest: Dict[str, float] = {}
+        for user_id, dist in rows:
+            if user_id not in nearest:
+                nearest[user_id] = float(dist)
+                if len(nearest) >= k:
+                    break
+        return list(nearest.items())
+
+    # --- Ghi ---
+    def add(self, user_id: str, embedding: np.ndarray) -> int:
+        matrix = np.asarray(embedding, dtype=np.float32).reshape(-1, self.dim)
+        with Session(self.engine) as session:
+            for vector in matrix:
+                session.add(FaceEmbedding(user_id=user_id, embedding=vector))
+            session.commit()
+        return self.count(user_id)
+
+    def add_many(self, entries: List[Tuple[str, np.ndarray]]) -> Dict[str, int]:
+        """Thêm embedding cho nhiều user trong một transaction."""
+        with Session(self.engine) as session:
+            for user_id, embedding in entries:
+                for vector in np.asarray(embedding, dtype=np.float32).reshape(-1, self.dim):
+                    session.add(FaceEmbedding(user_id=user_id, embedding=vector))
+            session.commit()
+        return {user_id: self.count(user_id) for user_id in dict.fromkeys(u for u, _ in entries)}
+
+    # Postgres tự quản lý việc ghi bền vững, không cần compaction
+    def start_background_compaction(self, interval: float) -> None:
+        pass
+
+    def stop_background_compaction(self) -> None:
+        pass
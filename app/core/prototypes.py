@@ -0,0 +1,78 @@
+import numpy as np
+
+from typing import Optional, Tuple
+
+from app.core.quantization import pairwise_distances
+
+
+def summarize(
+    matrix: np.ndarray,
+    weights: Optional[np.ndarray],
+    k: int,
+    iterations: int = 10,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tóm tắt các embedding (n x dim) của một user thành tối đa k prototype bằng k-medoids có trọng số.
+    Prototype là embedding thật (medoid) của mỗi cụm, trọng số của nó là tổng trọng số các embedding
+    trong cụm (mỗi embedding gốc có trọng số 1). Nhờ vậy tỉ lệ trọng số các prototype nằm trong
+    OPTIMAL_THRESHOLD xấp xỉ tỉ lệ embedding gốc nằm trong ngưỡng, tức độ tin cậy giữ nguyên ý nghĩa.
+    Trả về (prototypes k x dim float32, trọng số k float32).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    weights = (
+        np.ones(len(matrix), dtype=np.float32)
+        if weights is None
+        else np.asarray(weights, dtype=np.float32)
+    )
+    if len(matrix) <= k:
+        return matrix.copy(), weights.copy()
+
+    distances = pairwise_distances(matrix)
+    # Khởi tạo kiểu k-means++ (seed cố định để kết quả lặp lại được): bắt đầu từ medoid toàn cục,
+    # điểm tiếp theo được chọn với xác suất tỉ lệ trọng số x bình phương khoảng cách tới medoid gần nhất
+    rng = np.random.default_rng(seed)
+    medoids = [int(np.argmin(distances @ weights))]
+    nearest = distances[medoids[0]].copy()
+    while len(medoids) < k:
+        scores = weights * np.square(nearest)
+        total = scores.sum()
+        if total <= 0:
+            break
+        candidate = int(rng.choice(len(matrix), p=scores / total))
+        medoids.append(candidate)
+        np.minimum(nearest, distances[candidate], out=nearest)
+    k = len(medoids)
+    medoids = np.array(medoids)
+
+    for _ in range(iterations):
+        assignment = np.argmin(distances[:, medoids], axis=1)
+        updated = medoids.copy()
+        for cluster in range(k):
+            members = np.flatnonzero(assignment == cluster)
+            if len(members) == 0:
+                continue
+            costs = distances[np.ix_(members, members)] @ weights[members]
+            updated[cluster] = members[np.argmin(costs)]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+
+    assignment = np.argmin(distances[:, medoids], axis=1)
+    prototype_weights = np.bincount(assignment, weights=weights, minlength=k).astype(np.float32)
+    keep = prototype_weights > 0
+    return matrix[medoids[keep]].copy(), prototype_weights[keep]
+
+
+def centroid_bounds(
+    matrix: np.ndarray, weights: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, float]:
+    """
+    Tâm có trọng số của các embedding và bán kính (khoảng cách lớn nhất từ tâm tới một embedding).
+    Theo bất đẳng thức tam giác, mọi embedding cách ảnh kiểm tra ít nhất
+    ||ảnh - tâm|| - bán kính, nên có thể loại nhanh user mà không cần so từng embedding.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    centroid = np.average(matrix, axis=0, weights=weights).astype(np.float32)
+    radius = float(np.sqrt(np.max(np.sum(np.square(matrix - centroid), axis=1))))
+    return centroid, radius
@@ -0,0 +1,180 @@
+import numpy as np
+
+from typing import List, NamedTuple, Optional, Tuple
+
+# Các chế độ lượng tử hóa embedding được hỗ trợ
+QUANTIZATION_MODES = ("none", "float16", "int8")
+_INT8_MAX = 127.0
+# Số hàng được chuyển sang float32 mỗi lần khi tính khoảng cách trên dữ liệu lượng tử hóa
+_BLOCK_ROWS = 1024
+
+
+class StoredMatrix(NamedTuple):
+    """
+    Ma trận embedding của một user như được lưu trong cache:
+    - matrix: float32, float16, hoặc mã int8 (n x dim)
+    - sq_norms: bình phương chuẩn (float32) của từng hàng sau khi giải lượng tử
+    - scales: hệ số tỉ lệ của từng hàng (chỉ với int8), None nếu không dùng
+    - weights: trọng số từng hàng khi user đã được tóm tắt thành prototype, None = mọi hàng trọng số 1
+    - centroid, radius: tâm và bán kính của các hàng, dùng để loại nhanh user ở xa ảnh kiểm tra
+    """
+    matrix: np.ndarray
+    sq_norms: np.ndarray
+    scales: Optional[np.ndarray] = None
+    weights: Optional[np.ndarray] = None
+    centroid: Optional[np.ndarray] = None
+    radius: float = 0.0
+
+
+def storage_dtype(mode: str) -> np.dtype:
+    if mode == "float16":
+        return np.dtype(np.float16)
+    if mode == "int8":
+        return np.dtype(np.int8)
+    if mode == "none":
+        return np.dtype(np.float32)
+    raise ValueError(f"Chế độ lượng tử hóa không hợp lệ: {mode}")
+
+
+def quantize(matrix: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Lượng tử hóa ma trận float32 (n x dim). Trả về (mã, hệ số tỉ lệ từng hàng hoặc None)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if mode == "none":
+        return matrix, None
+    if mode == "float16":
+        return matrix.astype(np.float16), None
+    if mode == "int8":
+        # Tỉ lệ đối xứng theo từng vector: giá trị tuyệt đối lớn nhất ứng với 127
+        scales = np.abs(matrix).max(axis=1) / _INT8_MAX
+        scales[scales == 0] = 1.0
+        codes = np.rint(matrix / scales[:, None])
+        return np.clip(codes, -_INT8_MAX, _INT8_MAX).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Chế độ lượng tử hóa không hợp lệ: {mode}")
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    matrix = np.asarray(codes, dtype=np.float32)
+    if scales is not None:
+        matrix = matrix * scales[:, None]
+    return matrix
+
+
+def to_stored_matrix(matrix: np.ndarray, mode: str) -> StoredMatrix:
+    codes, scales = quantize(matrix, mode)
+    return StoredMatrix(codes, row_sq_norms(codes, scales), scales)
+
+
+def row_sq_norms(codes: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    sq_norms = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), _BLOCK_ROWS):
+        block = np.asarray(codes[start:start + _BLOCK_ROWS], dtype=np.float32)
+        sq_norms[start:start + len(block)] = np.einsum("ij,ij->i", block, block)
+    if scales is not None:
+        sq_norms *= scales * scales
+    return sq_norms
+
+
+def dot_products(
+    query: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Tích vô hướng giữa `query` (float32) và từng hàng đã lượng tử hóa.
+    Dữ liệu float16/int8 được đưa sang float32 theo từng khối nhỏ, không giải lượng tử cả ma trận.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if codes.dtype == np.float32:
+        dots = codes @ query
+    else:
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _BLOCK_ROWS):
+            block = np.asarray(codes[start:start + _BLOCK_ROWS], dtype=np.float32)
+            dots[start:start + len(block)] = block @ query
+    if scales is not None:
+        dots *= scales
+    return dots
+
+
+def pairwise_distances(a: np.ndarray, b: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Ma trận khoảng cách Euclid giữa từng hàng của `a` và từng hàng của `b` (mặc định `b` = `a`).
+    """
+    a_sq_norms = np.einsum("ij,ij->i", a, a)
+    if b is None:
+        b, b_sq_norms = a, a_sq_norms
+    else:
+        b_sq_norms = np.einsum("ij,ij->i", b, b)
+    distances_sq = a_sq_norms[:, None] + b_sq_norms[None, :] - 2.0 * (a @ b.T)
+    return np.sqrt(np.maximum(distances_sq, 0.0))
+
+
+def calibration_report(
+    users: List[Tuple[str, np.ndarray]],
+    mode: str,
+    distance_threshold: float,
+    confidence_threshold: float,
+    max_embeddings: int = 4000,
+) -> dict:
+    """
+    So sánh quyết định dùng float32 với quyết định trên dữ liệu lượng tử hóa `mode`:
+    - Cặp embedding: độ lệch khoảng cách và số cặp đổi quyết định so với OPTIMAL_THRESHOLD
+      (cặp cùng user và khác user được thống kê riêng).
+    - Xác thực leave-one-out: mỗi embedding làm ảnh cần kiểm tra với các embedding còn lại
+      của mọi user, đếm số lần quyết định chấp nhận/từ chối bị thay đổi.
+    Store lớn hơn `max_embeddings` được lấy mẫu ngẫu nhiên (phép so sánh từng cặp là O(n^2)).
+    """
+    users = [(user_id, np.asarray(m, dtype=np.float32)) for user_id, m in users if len(m) > 0]
+    if not users:
+        return {"mode": mode, "embeddings": 0}
+    original = np.concatenate([m for _, m in users])
+    labels = np.concatenate([np.full(len(m), i) for i, (_, m) in enumerate(users)])
+    if len(original) > max_embeddings:
+        sample = np.sort(np.random.default_rng(0).choice(len(original), max_embeddings, replace=False))
+        original, labels = original[sample], labels[sample]
+    codes, scales = quantize(original, mode)
+    restored = dequantize(codes, scales)
+
+    exact = pairwise_distances(original)
+    approx = pairwise_distances(restored)
+    upper = np.triu_indices(len(original), k=1)
+    same_user = (labels[:, None] == labels[None, :])[upper]
+    drift = np.abs(exact[upper] - approx[upper])
+    flips = (exact[upper] < distance_threshold) != (approx[upper] < distance_threshold)
+
+    # Xác thực leave-one-out theo từng user, bỏ qua chính embedding đang làm ảnh kiểm tra
+    np.fill_diagonal(exact, np.inf)
+    np.fill_diagonal(approx, np.inf)
+    decision_flips = 0
+    decisions = 0
+    for label in np.unique(labels):
+        members = labels == label
+        totals = members.sum() - members  # số embedding so sánh của user với mỗi ảnh kiểm tra
+        valid = totals > 0
+        if not valid.any():
+            continue
+        exact_conf = (exact[:, members] < distance_threshold).sum(axis=1)[valid] / totals[valid]
+        approx_conf = (approx[:, members] < distance_threshold).sum(axis=1)[valid] / totals[valid]
+        decision_flips += int(np.count_nonzero(
+            (exact_conf >= confidence_threshold) != (approx_conf >= confidence_threshold)
+        ))
+        decisions += int(valid.sum())
+
+    bytes_float32 = original.nbytes
+    bytes_quantized = codes.nbytes + (scales.nbytes if scales is not None else 0)
+    return {
+        "mode": mode,
+        "embeddings": int(len(original)),
+        "users": len(users),
+        "bytes_float32": int(bytes_float32),
+        "bytes_quantized": int(bytes_quantized),
+        "compression_ratio": bytes_float32 / bytes_quantized,
+        "max_distance_drift": float(drift.max()) if len(drift) else 0.0,
+        "mean_distance_drift": float(drift.mean()) if len(drift) else 0.0,
+        "genuine_pair_flips": int(np.count_nonzero(flips & same_user)),
+        "genuine_pairs": int(np.count_nonzero(same_user)),
+        "impostor_pair_flips": int(np.count_nonzero(flips & ~same_user)),
+        "impostor_pairs": int(np.count_nonzero(~same_user)),
+        "verification_decision_flips": decision_flips,
+        "verification_decisions": decisions,
+        "distance_threshold": distance_threshold,
+        "confidence_threshold": confidence_threshold,
+    }
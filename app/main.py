@@ -4,13 +4,21 @@ import asyncio
 from contextlib import asynccontextmanager
 from transformers import pipeline, AutoTokenizer, AutoModel
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.utils import aio, send_queue, model_ready, AImodel
 from app.api.main import api_router
 from app.core.config import settings
+from app.core.db import embedding_store
+from app.services.face_verification_service import (
+    FaceModelLoadError, FaceModelWarmingUpError, face_service
+)
+from app.services.image_quality import ImageQualityError
+from app.services.inference_executor import FaceServiceBusyError
+from app.services.voice_recording_service import intent_templates, voice_service
 from app.websocket.main import ws_router
 
 
@@ -43,16 +51,18 @@ async def model_worker():
         print(f"📦 Đang load NLP model lên {'GPU' if device == 0 else 'CPU'}...")
         AImodel.tokenizer = await asyncio.to_thread(
             AutoTokenizer.from_pretrained,
-            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+            settings.NLP_MODEL_NAME,
             trust_remote_code=True
         )
         AImodel.nlp_model = await asyncio.to_thread(
             AutoModel.from_pretrained,
-            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+            settings.NLP_MODEL_NAME,
             trust_remote_code=True,
             use_safetensors=True
         )
         print("✅ NLP model đã sẵn sàng.")
+        # Mã hóa sẵn các câu mẫu intent (hoặc đọc từ cache) trước khi nhận lệnh đầu tiên
+        await asyncio.to_thread(voice_service.load_template_embeddings, intent_templates)
         model_ready.set()  # Đánh dấu mô hình đã sẵn sàng
     except Exception as e:
         print(f"[MODEL ERROR] ❌ Lỗi khi tải mô hình: {e}")
@@ -66,12 +76,20 @@ async def lifespan(app: FastAPI):
     # Startup logic
     worker_task = asyncio.create_task(aio_worker())
     model_task = asyncio.create_task(model_worker())
+    embedding_store.start_background_compaction(settings.EMBEDDINGS_COMPACTION_INTERVAL)
+    if settings.FACE_MODEL_PRELOAD:
+        # Nạp TensorFlow + model khuôn mặt ở nền; các endpoint khuôn mặt trả 503 tới khi xong
+        face_service.start_loading()
     print("AIO Worker started")
     print("Model loading successfully")
     yield
     # Shutdown logic (nếu cần)
     worker_task.cancel()
     model_task.cancel()
+    await asyncio.to_thread(embedding_store.stop_background_compaction)
+    await asyncio.to_thread(face_service.batcher.stop)
+    await asyncio.to_thread(face_service.executor.shutdown)
+    await asyncio.to_thread(voice_service.batcher.stop)
     print("AIO Worker stopped")
     print("Stop model loading")
     print("Application stopped")
@@ -84,6 +102,32 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+@app.exception_handler(FaceServiceBusyError)
+async def face_service_busy_handler(request: Request, exc: FaceServiceBusyError):
+    # Từ chối nhanh khi model khuôn mặt quá tải hoặc đang khởi động, client nên thử lại sau
+    warming_up = isinstance(exc, FaceModelWarmingUpError)
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc), "status": "warming_up" if warming_up else "busy"},
+        headers={"Retry-After": "5" if warming_up else "1"},
+    )
+
+@app.exception_handler(FaceModelLoadError)
+async def face_model_load_error_handler(request: Request, exc: FaceModelLoadError):
+    # Nạp model thất bại: báo lý do thật, không có Retry-After vì thử lại cũng không hết lỗi
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc), "status": "load_failed"},
+    )
+
+@app.exception_handler(ImageQualityError)
+async def image_quality_handler(request: Request, exc: ImageQualityError):
+    # Ảnh mờ / tối / thiếu tương phản bị từ chối trước khi chạy model, kèm mã lý do
+    return JSONResponse(
+        status_code=422,  # Unprocessable Content
+        content={"detail": str(exc), "reasons": exc.reasons, "metrics": exc.metrics},
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
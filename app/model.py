@@ -3,6 +3,9 @@ import datetime
 from typing import Any, Optional
 from sqlmodel import Field, SQLModel, Column, String
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from pgvector.sqlalchemy import Vector
+
+from app.core.config import settings
 
 # Room settings
 class RoomBase(SQLModel):
@@ -84,6 +87,16 @@ class CameraPublic(CameraBase):
     status: bool 
     user_ids: list[str] | None = Field(default_factory=list) 
 
+# Face embedding settings (dùng khi EMBEDDINGS_BACKEND = "pgvector")
+class FaceEmbedding(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    user_id: str = Field(index=True)
+    embedding: Any = Field(sa_column=Column(Vector(settings.EMBEDDING_DIM), nullable=False))
+    created_at: datetime.datetime = Field(
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc),
+        nullable=False
+    )
+
 # Camera metadata Face Verification settings
 class ImageInput(SQLModel):
     image_base64: str  # Chuỗi base64 của ảnh
@@ -97,6 +110,21 @@ class FaceRegistrationResponse(SQLModel):
     user_id: str
     # file_path: Optional[str] = None # Tùy chọn nếu bạn muốn trả về nơi lưu ảnh/embedding
 
+class FaceBulkRegistrationRequest(SQLModel):
+    items: list[FaceRegistrationRequest]  # Mỗi ảnh kèm user_id, có thể thuộc nhiều user
+
+class FaceBulkRegistrationResult(SQLModel):
+    index: int  # Vị trí của ảnh trong request
+    user_id: str
+    success: bool
+    detail: Optional[str] = None  # Lý do khi ảnh không được đăng ký
+    embeddings_count: Optional[int] = None  # Số embedding của user sau khi đăng ký
+
+class FaceBulkRegistrationResponse(SQLModel):
+    registered: int
+    failed: int
+    results: list[FaceBulkRegistrationResult]
+
 class FaceVerificationRequest(SQLModel):
     camera_verify_id: uuid.UUID  # ID của camera xác thực
     image_base64_to_check: str  # Ảnh mới cần kiểm tra
@@ -113,6 +141,23 @@ class FaceVerificationResponse(SQLModel):
     confidence_threshold_used: (
         float  # Ngưỡng dùng để quyết định is_same_person từ confidence_score
     )
+    # Độ tin cậy của từng user đã đăng ký với camera (khi xác thực theo camera)
+    user_confidences: Optional[dict[str, float]] = None
+
+class FaceIdentificationRequest(SQLModel):
+    image_base64: str  # Ảnh cần nhận diện
+    top_k: int | None = Field(default=None, ge=1)  # Số user gần nhất cần trả về
+
+class FaceIdentificationCandidate(SQLModel):
+    user_id: str
+    min_distance_found: float
+    confidence_score: float
+
+class FaceIdentificationResponse(SQLModel):
+    is_signed_person: Optional[str] = None  # user khớp nhất nếu vượt ngưỡng tin cậy
+    candidates: list[FaceIdentificationCandidate]
+    threshold_used_for_distance: float
+    confidence_threshold_used: float
 
 # Voice settings
 class HistoryBase(SQLModel):
@@ -129,7 +174,18 @@ class HistoryVoice(HistoryBase, table=True):
     request: str
     response: str
 
+class IntentCandidate(SQLModel):
+    template: str  # Câu mẫu
+    intent: str
+    similarity: float
+
 class HistoryPublic(SQLModel):
     request: str
     response: str
-    created_at: datetime.datetime 
\ No newline at end of file
+    created_at: datetime.datetime 
+    # Chỉ có khi vừa xử lý lệnh (/voice_logic): các intent gần nhất và độ chênh giữa hai intent đầu
+    candidates: Optional[list[IntentCandidate]] = None
+    margin: Optional[float] = None
+    ambiguous: Optional[bool] = None
+    # "exact" / "prefix": khớp trực tiếp câu mẫu, không chạy model; "embedding": so khớp bằng model
+    matched_by: Optional[str] = None
\ No newline at end of file
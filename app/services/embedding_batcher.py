@@ -0,0 +1,132 @@
+import threading
+import time
+import numpy as np
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+
+class EmbeddingBatcher:
+    """
+    Bộ lập lịch micro-batching cho model embedding khuôn mặt.
+    Các yêu cầu đồng thời (mỗi yêu cầu là một ảnh đã tiền xử lý, shape (1, H, W, C)) được gom
+    trong tối đa `max_wait` giây kể từ yêu cầu đầu tiên, hoặc tới khi đủ `max_batch_size`,
+    rồi chạy MỘT lần forward pass; mỗi Future nhận đúng hàng embedding của mình.
+    Toàn bộ việc chạy model diễn ra trên một luồng riêng.
+    `collate` ghép các đầu vào thành một batch (mặc định np.concatenate; dùng `list` cho
+    đầu vào là câu văn bản của model NLP).
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[Any], Sequence[Any]],
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        name: str = "face-embedding-batcher",
+        collate: Callable[[List[Any]], Any] = np.concatenate,
+    ):
+        self.run_batch = run_batch
+        self.collate = collate
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.name = name
+        self._cond = threading.Condition()
+        # Mỗi phần tử: (đầu vào, future, thời điểm vào hàng đợi)
+        self._queue: Deque[Tuple[Any, Future, float]] = deque()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        # Thống kê
+        self._max_queue_depth = 0
+        self._batches = 0
+        self._requests = 0
+        self._largest_batch = 0
+        self._batch_sizes: Dict[int, int] = {}
+        self._queue_wait_total = 0.0
+        self._inference_total = 0.0
+
+    def submit(self, inputs: Any) -> Future:
+        """Đưa một đầu vào (vd: ảnh đã tiền xử lý) vào hàng đợi. Future trả về embedding (dim,) của nó."""
+        future: Future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("EmbeddingBatcher đã dừng.")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._queue.append((inputs, future, time.monotonic()))
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                # Chờ thêm yêu cầu tới khi đủ batch hoặc hết thời gian chờ của yêu cầu đầu tiên
+                deadline = self._queue[0][2] + self.max_wait
+                while len(self._queue) < self.max_batch_size and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(len(self._queue), self.max_batch_size))
+                ]
+            self._execute(batch)
+
+    def _execute(self, batch: List[Tuple[Any, Future, float]]) -> None:
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            outputs = self.run_batch(self.collate([inputs for inputs, _, _ in batch]))
+        except BaseException as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.monotonic()
+        for row, (_, future, _) in enumerate(batch):
+            future.set_result(outputs[row])
+        with self._cond:
+            size = len(batch)
+            self._batches += 1
+            self._requests += size
+            self._largest_batch = max(self._largest_batch, size)
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._queue_wait_total += sum(started - queued_at for _, _, queued_at in batch)
+            self._inference_total += finished - started
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue_depth": self._max_queue_depth,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "requests": self._requests,
+                "avg_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": (
+                    self._queue_wait_total / self._requests * 1000 if self._requests else 0.0
+                ),
+                "avg_batch_inference_ms": (
+                    self._inference_total / self._batches * 1000 if self._batches else 0.0
+                ),
+            }
+
+    def stop(self) -> None:
+        """Dừng luồng chạy model sau khi xử lý hết các yêu cầu đang chờ."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
@@ -0,0 +1,78 @@
+"""
+So sánh embedding khi giải mã ảnh nhanh (draft JPEG + reduce, như _preprocess_image) với
+giải mã toàn bộ điểm ảnh rồi resize như trước, trên cùng các ảnh khuôn mặt. Độ lệch embedding
+phải nhỏ hơn nhiều so với OPTIMAL_THRESHOLD và không có cặp ảnh nào đổi quyết định.
+
+Chạy: python -m app.services.face_decode_parity --images <thư mục ảnh khuôn mặt>
+"""
+import io
+import logging
+import numpy as np
+
+from pathlib import Path
+from typing import Callable, List
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.onnx_face_backend import compare_embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def decode_full(image_bytes: bytes) -> np.ndarray:
+    """Cách tiền xử lý cũ: giải mã toàn bộ điểm ảnh rồi resize một bước. Trả về (H, W, C) 0..1."""
+    height, width, _ = settings.MODEL_INPUT_SHAPE
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB").resize((width, height))
+    return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def decode_parity_report(
+    embed: Callable[[np.ndarray], np.ndarray],
+    images: List[bytes],
+    distance_threshold: float,
+) -> dict:
+    """
+    Chạy `embed` (model khuôn mặt, nhận batch (n, H, W, C)) trên cùng các ảnh giải mã theo hai cách;
+    các chỉ số như compare_embeddings (phía chuẩn là giải mã toàn bộ), kèm độ lệch điểm ảnh lớn nhất
+    và tỉ lệ max_drift / distance_threshold.
+    """
+    from app.services.face_verification_service import face_service
+
+    full, fast = [], []
+    for image_bytes in images:
+        preprocessed = face_service._preprocess_image(image_bytes)
+        if preprocessed is None:
+            continue
+        full.append(decode_full(image_bytes))
+        fast.append(preprocessed[0])
+    if not full:
+        return {"images": 0}
+    full_batch, fast_batch = np.stack(full), np.stack(fast)
+    report = compare_embeddings(embed(full_batch), embed(fast_batch), distance_threshold)
+    report["max_pixel_diff"] = float(np.abs(full_batch - fast_batch).max())
+    report["drift_to_threshold"] = report["max_drift"] / distance_threshold
+    return report
+
+
+def main() -> None:
+    import argparse
+
+    from app.services.face_verification_service import face_service
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=Path, required=True, help="Thư mục ảnh khuôn mặt mẫu")
+    parser.add_argument("--limit", type=int, default=200)
+    args = parser.parse_args()
+
+    if not face_service.load() or face_service.model is None:
+        raise SystemExit("Face model weights are not loaded, cannot compare decoders.")
+    images = [path.read_bytes() for path in sorted(args.images.iterdir())[:args.limit]]
+    report = decode_parity_report(face_service._run_model, images, settings.OPTIMAL_THRESHOLD)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
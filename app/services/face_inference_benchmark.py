@@ -0,0 +1,102 @@
+"""
+Đo độ trễ suy luận của model khuôn mặt trên CPU: model.predict() (cách cũ) so với
+hàm đã biên dịch theo bucket (FACE_BATCH_BUCKETS).
+
+Chạy: python -m app.services.face_inference_benchmark --iterations 200 --batch-sizes 1 8
+"""
+import os
+
+# Đo trên CPU: phải đặt trước khi import TensorFlow
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+
+import argparse
+import logging
+import time
+import numpy as np
+
+from typing import Callable, Dict, List, Sequence
+
+from app.core.config import settings
+from app.services.face_verification_service import (
+    build_compiled_inference,
+    create_siamese_backbone_service,
+    face_service,
+    run_compiled_inference,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _measure(func: Callable[[], object], iterations: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        func()
+    samples: List[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(np.mean(samples)),
+    }
+
+
+def benchmark(
+    batch_sizes: Sequence[int] = (1,), iterations: int = 200, warmup: int = 10
+) -> List[dict]:
+    """Trả về p50/p99/mean (ms) của cả hai cách chạy model cho từng kích thước batch."""
+    input_shape = settings.MODEL_INPUT_SHAPE
+    face_service.load()
+    model = face_service.model
+    if not face_service.model_loaded or model is None:
+        # Độ trễ không phụ thuộc giá trị trọng số: dùng kiến trúc với trọng số ngẫu nhiên
+        logger.warning("Face model weights not loaded, benchmarking with random weights.")
+        model = create_siamese_backbone_service(input_shape)
+    buckets = [b for b in settings.FACE_BATCH_BUCKETS if b > 0] or [1]
+    compiled = build_compiled_inference(model, input_shape, buckets)
+
+    rng = np.random.default_rng(0)
+    results = []
+    for batch_size in batch_sizes:
+        batch = rng.random((batch_size, *input_shape), dtype=np.float32)
+        predict = _measure(
+            lambda: model.predict(batch, batch_size=batch_size, verbose=0), iterations, warmup
+        )
+        compiled_stats = _measure(
+            lambda: run_compiled_inference(compiled, batch), iterations, warmup
+        )
+        max_diff = float(np.max(np.abs(
+            model.predict(batch, batch_size=batch_size, verbose=0)
+            - run_compiled_inference(compiled, batch)
+        )))
+        results.append({
+            "batch_size": batch_size,
+            "predict": predict,
+            "compiled": compiled_stats,
+            "speedup_p50": predict["p50_ms"] / compiled_stats["p50_ms"],
+            "max_abs_diff": max_diff,
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    print(f"{'batch':>5} | {'predict p50':>11} {'p99':>8} | {'compiled p50':>12} {'p99':>8} | speedup")
+    for row in benchmark(args.batch_sizes, args.iterations, args.warmup):
+        print(
+            f"{row['batch_size']:>5} | "
+            f"{row['predict']['p50_ms']:>9.2f}ms {row['predict']['p99_ms']:>6.2f}ms | "
+            f"{row['compiled']['p50_ms']:>10.2f}ms {row['compiled']['p99_ms']:>6.2f}ms | "
+            f"x{row['speedup_p50']:.1f} (max diff {row['max_abs_diff']:.2e})"
+        )
+
+
+if __name__ == "__main__":
+    main()
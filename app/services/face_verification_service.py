@@ -1,16 +1,24 @@
 # backend_face_id/app/services/face_verification_service.py
-import tensorflow as tf
-
-# from tensorflow.keras.models import load_model # Không cần nữa nếu chỉ load weights
-from keras.models import Model
-from keras.layers import Input, Conv2D, MaxPooling2D, Flatten, Dense
+# TensorFlow / Keras chỉ được import khi nạp model (FaceVerificationService.load), không phải
+# khi import module, để app khởi động nhanh và các route không dùng model không phải chờ TF.
 import numpy as np
 from PIL import Image
 import io
-from pathlib import Path
-from typing import Optional
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
 
 from app.core.config import settings
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.frame_cache import FrameEmbeddingCache, difference_hash
+from app.services.image_quality import ImageQualityError, check_quality
+from app.services.inference_executor import FaceServiceBusyError, InferenceExecutor
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+    from keras.models import Model
 
 # (Logger setup - ví dụ)
 import logging
@@ -33,6 +41,9 @@ def create_siamese_backbone_service(
     Tạo lại kiến trúc CNN cơ sở cho một nhánh của Siamese Network.
     Tất cả các lớp Conv và Dense đều sử dụng hàm kích hoạt ReLU.
     """
+    from keras.models import Model
+    from keras.layers import Input, Conv2D, MaxPooling2D, Flatten, Dense
+
     inputs = Input(shape=input_shape, name="backbone_input")
     x = Conv2D(
         filters=32,
@@ -115,6 +126,61 @@ def create_siamese_backbone_service(
     return backbone_model
 
 
+# --- Suy luận đã biên dịch (tf.function) theo các kích thước batch cố định ---
+def build_compiled_inference(
+    model: "Model", input_shape, buckets: Sequence[int]
+) -> Dict[int, "tf.types.experimental.ConcreteFunction"]:
+    """
+    Biên dịch model thành các ConcreteFunction với chữ ký đầu vào cố định (bucket, H, W, C)
+    cho từng kích thước batch trong `buckets`. Gọi trực tiếp hàm đã biên dịch tránh được chi phí
+    dựng data adapter / callback của model.predict() ở mỗi request.
+    """
+    import tensorflow as tf
+
+    @tf.function
+    def infer(images):
+        return model(images, training=False)
+
+    return {
+        bucket: infer.get_concrete_function(
+            tf.TensorSpec(shape=(bucket, *input_shape), dtype=tf.float32)
+        )
+        for bucket in sorted(set(buckets))
+    }
+
+
+def run_compiled_inference(
+    compiled: Dict[int, "tf.types.experimental.ConcreteFunction"], batch: np.ndarray
+) -> np.ndarray:
+    """
+    Chạy batch bất kỳ qua các hàm đã biên dịch: batch được đệm (padding) tới bucket nhỏ nhất
+    chứa vừa, batch lớn hơn bucket lớn nhất được chia nhỏ.
+    """
+    import tensorflow as tf
+
+    buckets = sorted(compiled)
+    largest = buckets[-1]
+    outputs = []
+    for start in range(0, len(batch), largest):
+        chunk = batch[start:start + largest]
+        size = len(chunk)
+        bucket = next(b for b in buckets if b >= size)
+        if bucket > size:
+            padding = np.zeros((bucket - size, *chunk.shape[1:]), dtype=np.float32)
+            chunk = np.concatenate([chunk, padding])
+        result = compiled[bucket](tf.convert_to_tensor(chunk, dtype=tf.float32))
+        outputs.append(np.asarray(result)[:size])
+    return np.concatenate(outputs)
+
+
+class FaceModelWarmingUpError(FaceServiceBusyError):
+    """Model khuôn mặt đang được nạp ở nền, request bị từ chối ngay (503) thay vì chờ."""
+
+
+class FaceModelLoadError(RuntimeError):
+    """Nạp hoặc warmup model khuôn mặt thất bại; không thử lại cho tới khi khởi động lại."""
+
+
 class FaceVerificationService:
     _instance = None
 
@@ -126,7 +192,7 @@ class FaceVerificationService:
         return cls._instance
 
     def __init__(self):
-        if hasattr(self, "model_loaded") and self.model_loaded:
+        if hasattr(self, "model_ready"):
             return
 
         self.model_path_weights = (
@@ -137,9 +203,85 @@ class FaceVerificationService:
         self.target_width = self.model_input_shape[1]
         self.num_channels = self.model_input_shape[2]
 
-        self.model: Optional[Model] = None  # Khai báo kiểu cho model
+        self.model: Optional["Model"] = None  # Khai báo kiểu cho model
         self.model_loaded = False
-        self._load_model_and_weights()
+        # Được set khi model đã nạp và warmup xong (cùng cách dùng với model_ready của ASR/NLP)
+        self.model_ready = threading.Event()
+        self.load_error: Optional[str] = None  # Lý do nạp model thất bại (không thử lại)
+        self._load_lock = threading.Lock()
+        self._loading_lock = threading.Lock()  # Giữ trong suốt quá trình nạp model
+        self._load_thread: Optional[threading.Thread] = None
+        # Hàm suy luận đã biên dịch theo từng kích thước batch (rỗng: dùng model.predict)
+        self._compiled: Dict[int, "tf.types.experimental.ConcreteFunction"] = {}
+        # Phiên ONNX Runtime khi FACE_MODEL_BACKEND="onnx" (None: chạy bằng TensorFlow)
+        self._onnx: Optional[Callable[[np.ndarray], np.ndarray]] = None
+        # Gom các yêu cầu embedding đồng thời thành một lần chạy model
+        self.batcher = EmbeddingBatcher(
+            self._predict_batch,
+            max_batch_size=settings.FACE_BATCH_MAX_SIZE,
+            max_wait=settings.FACE_BATCH_MAX_WAIT_MS / 1000,
+        )
+        # Cache embedding cho các khung hình gần như trùng nhau (None: tắt)
+        self.frame_cache: Optional[FrameEmbeddingCache] = (
+            FrameEmbeddingCache(
+                max_entries=settings.FACE_FRAME_CACHE_SIZE,
+                ttl=settings.FACE_FRAME_CACHE_TTL_SECONDS,
+                max_hamming=settings.FACE_FRAME_CACHE_MAX_HAMMING,
+            )
+            if settings.FACE_FRAME_CACHE_ENABLED
+            else None
+        )
+        # Thread pool riêng cho xử lý ảnh / model, có giới hạn số request đang xử lý
+        self.executor = InferenceExecutor(
+            workers=settings.FACE_INFERENCE_WORKERS,
+            max_pending=settings.FACE_INFERENCE_MAX_PENDING,
+        )
+
+    def start_loading(self) -> None:
+        """Bắt đầu nạp model ở luồng nền; gọi nhiều lần cũng chỉ nạp một lần."""
+        with self._load_lock:
+            if self._load_thread is None:
+                self._load_thread = threading.Thread(
+                    target=self.load, name="face-model-loader", daemon=True
+                )
+                self._load_thread.start()
+
+    def load(self) -> bool:
+        """
+        Import TensorFlow, dựng model, nạp trọng số rồi warmup; chặn tới khi xong.
+        Trả về model_loaded. Dùng trực tiếp cho các script (benchmark, kiểm tra ONNX).
+        """
+        with self._loading_lock:
+            if self.model_ready.is_set() or self.load_error is not None:
+                return self.model_loaded
+            started = time.perf_counter()
+            try:
+                self._load_model_and_weights()
+                if not self.model_loaded:
+                    self.load_error = f"Face model could not be loaded from {self.model_path_weights}."
+                    return False
+                self.warmup()
+            except Exception as e:
+                # Không để model_ready/load_error ở trạng thái "đang nạp" mãi mãi
+                logger.exception("Face model failed to load or warm up:")
+                self.model_loaded = False
+                self.load_error = str(e) or type(e).__name__
+                return False
+            self.model_ready.set()
+            logger.info(f"Face model ready in {time.perf_counter() - started:.1f} s.")
+            return True
+
+    def ensure_ready(self) -> None:
+        """
+        Ném FaceModelWarmingUpError nếu model chưa sẵn sàng (và bắt đầu nạp nếu chưa nạp),
+        FaceModelLoadError kèm lý do nếu nạp hoặc warmup đã thất bại.
+        """
+        if self.model_ready.is_set():
+            return
+        if self.load_error is not None:
+            raise FaceModelLoadError(f"Face model is unavailable: {self.load_error}")
+        self.start_loading()
+        raise FaceModelWarmingUpError("Face model is warming up, retry later.")
 
     def _load_model_and_weights(self):
         logger.info(
@@ -167,6 +309,21 @@ class FaceVerificationService:
             logger.info(
                 "Model weights loaded successfully into recreated architecture."
             )
+            # 3. Chuyển sang ONNX Runtime nếu được cấu hình; lỗi thì giữ TensorFlow
+            if settings.FACE_MODEL_BACKEND == "onnx":
+                self._load_onnx_backend()
+            elif settings.FACE_MODEL_BACKEND != "tensorflow":
+                logger.error(
+                    f"Unknown FACE_MODEL_BACKEND '{settings.FACE_MODEL_BACKEND}', using tensorflow."
+                )
+            # 4. Biên dịch hàm suy luận với chữ ký đầu vào cố định cho từng bucket
+            # (chỉ khi chạy bằng TensorFlow, ONNX không dùng đến các hàm này)
+            if settings.FACE_COMPILED_INFERENCE and self._onnx is None:
+                buckets = [b for b in settings.FACE_BATCH_BUCKETS if b > 0] or [1]
+                self._compiled = build_compiled_inference(
+                    self.model, self.model_input_shape, buckets
+                )
+                logger.info(f"Compiled inference functions for batch buckets {sorted(self._compiled)}.")
             self.model_loaded = True
             # In summary để kiểm tra (chỉ nên dùng khi debug, có thể bỏ trong production)
             # self.model.summary(print_fn=logger.info)
@@ -177,53 +334,262 @@ class FaceVerificationService:
             )
             # self.model_loaded vẫn là False
 
-    def _preprocess_image(self, image_bytes: bytes) -> Optional[np.ndarray]:
+    def _load_onnx_backend(self) -> None:
+        from app.services.onnx_face_backend import load_onnx_model
+
+        try:
+            self._onnx = load_onnx_model(
+                self.model,
+                self.model_input_shape,
+                self.model_path_weights,
+                int8=settings.FACE_ONNX_QUANTIZE_INT8,
+            )
+            logger.info(f"Face model running on ONNX Runtime: {self._onnx.path}")
+        except Exception:
+            logger.exception("Cannot load ONNX face backend, falling back to tensorflow:")
+            self._onnx = None
+
+    def _decode_image(self, image_bytes: bytes) -> Image.Image:
+        """
+        Giải mã ảnh ở độ phân giải vừa đủ rồi resize về kích thước đầu vào của model.
+        Ảnh camera thường lớn hơn 100x100 rất nhiều: với JPEG, draft() yêu cầu bộ giải mã
+        scale DCT (1/2 .. 1/8) nên không phải giải mã toàn bộ điểm ảnh (vẫn giữ >= 2 lần
+        kích thước đích); định dạng khác (PNG, HEIC, ...) được thu nhỏ nhanh bằng reduce()
+        bên trong resize (reducing_gap) trước bước resample cuối.
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.format == "JPEG":
+            image.draft("RGB", (self.target_width * 2, self.target_height * 2))
+        image = image.convert("RGB")
+        # Sử dụng self.target_width, self.target_height đã lấy từ MODEL_INPUT_SHAPE
+        return image.resize((self.target_width, self.target_height), reducing_gap=3.0)
+
+    def _preprocess_image(
+        self, image_bytes: bytes, out: Optional[np.ndarray] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Trả về ảnh đã chuẩn hóa shape (1, H, W, C) float32. Nếu có `out` (mảng (H, W, C)
+        float32 cấp phát sẵn, ví dụ một hàng của batch) thì ghi thẳng vào đó, không cấp phát thêm.
+        Chỉ đường batch (_preprocess_many) truyền `out`. Ảnh đơn lẻ luôn có mảng riêng vì nó còn
+        nằm trong hàng đợi micro-batching / cache khung hình sau khi hàm trả về, trong khi luồng
+        của executor đã chuyển sang ảnh khác, nên không thể dùng lại một buffer theo luồng.
+        Độ lệch embedding so với cách giải mã toàn bộ ảnh: app.services.face_decode_parity.
+        """
         if not image_bytes:
             logger.warning("preprocess_image received empty image_bytes.")
             return None
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            image = image.convert("RGB")
-            # Sử dụng self.target_width, self.target_height đã lấy từ MODEL_INPUT_SHAPE
-            image = image.resize((self.target_width, self.target_height))
-            img_array = np.array(image, dtype=np.float32)
-            img_array = img_array / 255.0
-            img_array_expanded = np.expand_dims(img_array, axis=0)
+            pixels = np.asarray(self._decode_image(image_bytes), dtype=np.uint8)
 
             expected_shape = (
-                1,
                 self.target_height,
                 self.target_width,
                 self.num_channels,
             )
-            if img_array_expanded.shape != expected_shape:
+            if pixels.shape != expected_shape:
                 logger.error(
-                    f"Preprocessed image shape mismatch. Expected {expected_shape}, got {img_array_expanded.shape}"
+                    f"Preprocessed image shape mismatch. Expected {(1, *expected_shape)}, got {(1, *pixels.shape)}"
                 )
                 return None
-            return img_array_expanded
+            if out is None:
+                out = np.empty(expected_shape, dtype=np.float32)
+            np.divide(pixels, np.float32(255.0), out=out, dtype=np.float32)
+            return out[np.newaxis]
         except Exception as e:
             logger.exception(f"Error preprocessing image:")
             return None
 
-    def get_embedding(self, image_bytes: bytes) -> Optional[np.ndarray]:
+    def get_embedding(
+        self, image_bytes: bytes, frame_stream: Optional[str] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Embedding của một ảnh. `frame_stream` (vd: id camera) bật cache khung hình gần trùng
+        trong phạm vi luồng đó; None (đăng ký, nhận diện) luôn chạy model trên chính ảnh này.
+        """
         if not self.model_loaded or self.model is None:
             logger.error(
                 "Model not loaded or not an instance of Model. Cannot get embedding."
             )
             return None
 
-        preprocessed_img = self._preprocess_image(image_bytes)
+        preprocessed_img, frame_hash, cached = self._preprocess_cached(image_bytes, frame_stream)
+        if cached is not None:
+            return cached
         if preprocessed_img is None:
             logger.error("Image preprocessing failed. Cannot get embedding.")
             return None
 
         try:
-            embedding = self.model.predict(preprocessed_img, verbose=0)
-            return embedding.squeeze()
+            if settings.FACE_MICRO_BATCHING_ENABLED:
+                embedding = self.batcher.submit(preprocessed_img).result()
+            else:
+                embedding = self._run_model(preprocessed_img).squeeze()
         except Exception as e:
             logger.exception(f"Error during model prediction for embedding:")
             return None
+        self._remember_frame(frame_stream, frame_hash, embedding)
+        return embedding
+
+    async def get_embedding_async(
+        self, image_bytes: bytes, frame_stream: Optional[str] = None
+    ) -> Optional[np.ndarray]:
+        """
+        Như get_embedding nhưng không chặn event loop: tiền xử lý chạy trên thread pool riêng
+        của model và các request đồng thời được micro-batching gom thành một lần chạy model.
+        Ném FaceServiceBusyError ngay khi số request đang xử lý chạm FACE_INFERENCE_MAX_PENDING,
+        FaceModelWarmingUpError khi model chưa nạp xong, FaceModelLoadError khi nạp model thất bại,
+        ImageQualityError khi ảnh không đạt
+        ngưỡng chất lượng. `frame_stream`: như get_embedding.
+        """
+        self.ensure_ready()
+        async with self.executor.admit():
+            if not settings.FACE_MICRO_BATCHING_ENABLED:
+                return await self.executor.run(self.get_embedding, image_bytes, frame_stream)
+            if not self.model_loaded or self.model is None:
+                logger.error(
+                    "Model not loaded or not an instance of Model. Cannot get embedding."
+                )
+                return None
+
+            preprocessed_img, frame_hash, cached = await self.executor.run(
+                self._preprocess_cached, image_bytes, frame_stream
+            )
+            if cached is not None:
+                return cached
+            if preprocessed_img is None:
+                logger.error("Image preprocessing failed. Cannot get embedding.")
+                return None
+
+            try:
+                embedding = await asyncio.wrap_future(self.batcher.submit(preprocessed_img))
+            except Exception as e:
+                logger.exception(f"Error during model prediction for embedding:")
+                return None
+            self._remember_frame(frame_stream, frame_hash, embedding)
+            return embedding
+
+    def _preprocess_cached(
+        self, image_bytes: bytes, frame_stream: Optional[str] = None
+    ) -> Tuple[Optional[np.ndarray], Optional[int], Optional[np.ndarray]]:
+        """
+        Tiền xử lý ảnh, kiểm tra chất lượng rồi tra cache khung hình gần trùng của `frame_stream`
+        (không tra khi frame_stream là None).
+        Trả về (ảnh đã tiền xử lý, dHash của ảnh, embedding lấy từ cache hoặc None).
+        Ném ImageQualityError nếu ảnh mờ / tối / thiếu tương phản (không chạy model).
+        """
+        preprocessed_img = self._preprocess_image(image_bytes)
+        if preprocessed_img is None:
+            return None, None, None
+        check_quality(preprocessed_img)
+        if self.frame_cache is None or frame_stream is None:
+            return preprocessed_img, None, None
+        frame_hash = difference_hash(preprocessed_img)
+        return preprocessed_img, frame_hash, self.frame_cache.get(frame_stream, frame_hash)
+
+    def _remember_frame(
+        self,
+        frame_stream: Optional[str],
+        frame_hash: Optional[int],
+        embedding: Optional[np.ndarray],
+    ) -> None:
+        if frame_hash is not None and embedding is not None and self.frame_cache is not None:
+            self.frame_cache.put(frame_stream, frame_hash, embedding)
+
+    def _predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        return self._run_model(batch)
+
+    def _run_model(self, batch: np.ndarray) -> np.ndarray:
+        # Mọi lần chạy model (micro-batching, đăng ký theo lô, warmup) dùng chung giới hạn
+        # FACE_INFERENCE_WORKERS lần chạy đồng thời của executor
+        return self.executor.forward(self._forward, batch)
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        if self._onnx is not None:
+            return self._onnx(batch)
+        if self._compiled:
+            return run_compiled_inference(self._compiled, batch)
+        return self.model.predict(batch, batch_size=len(batch), verbose=0)
+
+    def warmup(self) -> None:
+        """
+        Chạy thử mỗi bucket một lần với ảnh rỗng để request đầu tiên không phải chịu
+        chi phí khởi tạo graph / cấp phát bộ nhớ.
+        """
+        if not self.model_loaded or self.model is None:
+            return
+        started = time.perf_counter()
+        buckets = sorted(self._compiled) if self._onnx is None else [1]
+        for bucket in buckets or [1]:
+            self._run_model(np.zeros((bucket, *self.model_input_shape), dtype=np.float32))
+        logger.info(f"Face model warmed up in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    def _preprocess_many(
+        self, images: List[bytes]
+    ) -> Tuple[np.ndarray, List[int], Dict[int, ImageQualityError]]:
+        """
+        Giải mã và tiền xử lý nhiều ảnh song song (PIL nhả GIL khi giải mã ảnh), ghi thẳng
+        vào một batch (n, H, W, C) cấp phát một lần.
+        Trả về (batch, chỉ số các ảnh hợp lệ, lỗi chất lượng theo chỉ số ảnh bị từ chối).
+        """
+        batch = np.empty((len(images), *self.model_input_shape), dtype=np.float32)
+        rejected: Dict[int, ImageQualityError] = {}
+
+        def preprocess(index: int) -> bool:
+            preprocessed = self._preprocess_image(images[index], out=batch[index])
+            if preprocessed is None:
+                return False
+            try:
+                check_quality(preprocessed)
+            except ImageQualityError as e:
+                rejected[index] = e
+                return False
+            return True
+
+        if len(images) <= 1:
+            ok = [preprocess(i) for i in range(len(images))]
+        else:
+            workers = max(1, min(settings.FACE_DECODE_WORKERS, len(images)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                ok = list(pool.map(preprocess, range(len(images))))
+        return batch, [i for i, valid in enumerate(ok) if valid], rejected
+
+    def get_embeddings(
+        self,
+        images: List[bytes],
+        rejected: Optional[Dict[int, ImageQualityError]] = None,
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Lấy embedding cho nhiều ảnh: tiền xử lý song song rồi chạy model theo batch
+        FACE_EMBEDDING_BATCH_SIZE ảnh mỗi lần thay vì từng ảnh một.
+        Ảnh không xử lý được trả về None ở vị trí tương ứng; ảnh bị cổng chất lượng từ chối
+        được ghi thêm vào `rejected` (chỉ số ảnh -> ImageQualityError) nếu truyền vào.
+        """
+        results: List[Optional[np.ndarray]] = [None] * len(images)
+        if not self.model_loaded or self.model is None:
+            logger.error(
+                "Model not loaded or not an instance of Model. Cannot get embeddings."
+            )
+            return results
+
+        preprocessed, valid, quality_errors = self._preprocess_many(images)
+        if rejected is not None:
+            rejected.update(quality_errors)
+        if len(valid) < len(images):
+            logger.error(f"Image preprocessing failed for {len(images) - len(valid)} image(s).")
+            preprocessed = preprocessed[valid]
+
+        batch_size = max(1, settings.FACE_EMBEDDING_BATCH_SIZE)
+        for start in range(0, len(valid), batch_size):
+            batch_ids = valid[start:start + batch_size]
+            batch = preprocessed[start:start + batch_size]
+            try:
+                embeddings = self._run_model(batch)
+            except Exception as e:
+                logger.exception(f"Error during batched model prediction for embeddings:")
+                continue
+            for i, embedding in zip(batch_ids, embeddings):
+                results[i] = embedding
+        return results
         
 face_service = FaceVerificationService()
 
@@ -0,0 +1,106 @@
+import threading
+import time
+import numpy as np
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+def difference_hash(image: np.ndarray) -> int:
+    """
+    dHash 64 bit của ảnh đã tiền xử lý (H, W, C) hoặc (1, H, W, C): chuyển sang mức xám,
+    lấy trung bình theo 8 x 9 ô rồi so sánh độ sáng hai ô kề nhau theo chiều ngang.
+    Các khung hình gần giống nhau (nhiễu cảm biến, nén JPEG) cho hash chỉ lệch vài bit.
+    """
+    gray = np.asarray(image, dtype=np.float32).reshape(image.shape[-3:]).mean(axis=2)
+    rows = np.linspace(0, gray.shape[0], 9).astype(int)[:-1]
+    cols = np.linspace(0, gray.shape[1], 10).astype(int)[:-1]
+    cells = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    cells /= np.outer(np.diff(np.append(rows, gray.shape[0])), np.diff(np.append(cols, gray.shape[1])))
+    bits = np.packbits(cells[:, 1:] > cells[:, :-1])
+    return int.from_bytes(bits.tobytes(), "big")
+
+
+class FrameEmbeddingCache:
+    """
+    Cache embedding theo dHash của ảnh đã tiền xử lý, dùng cho chuỗi khung hình gần như
+    giống hệt nhau mà camera gửi liên tục khi có người đứng trước cửa.
+    Mỗi luồng khung hình (`stream`, vd: id camera) có vùng cache riêng: ảnh có hash lệch tối đa
+    `max_hamming` bit so với một ảnh CÙNG luồng đã tính trong `ttl` giây gần nhất dùng lại
+    embedding của ảnh đó thay vì chạy lại model; không bao giờ dùng embedding của luồng khác.
+    Loại bỏ theo LRU khi vượt `max_entries` và theo TTL khi tra cứu.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 2.0, max_hamming: int = 4):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_hamming = max(0, max_hamming)
+        self._lock = threading.Lock()
+        # (luồng, hash) -> (embedding, thời điểm tính)
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[np.ndarray, float]]" = OrderedDict()
+        self._exact_hits = 0
+        self._near_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, stream: str, frame_hash: int) -> Optional[np.ndarray]:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get((stream, frame_hash))
+            if entry is not None:
+                self._exact_hits += 1
+                self._entries.move_to_end((stream, frame_hash))
+                return entry[0].copy()
+            if self.max_hamming:
+                best: Optional[Tuple[str, int]] = None
+                best_distance = self.max_hamming + 1
+                for key in self._entries:
+                    if key[0] != stream:
+                        continue
+                    distance = (key[1] ^ frame_hash).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = key, distance
+                if best is not None:
+                    self._near_hits += 1
+                    self._entries.move_to_end(best)
+                    return self._entries[best][0].copy()
+            self._misses += 1
+            return None
+
+    def put(self, stream: str, frame_hash: int, embedding: np.ndarray) -> None:
+        with self._lock:
+            self._entries[(stream, frame_hash)] = (embedding, time.monotonic())
+            self._entries.move_to_end((stream, frame_hash))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def _expire(self, now: float) -> None:
+        # Thứ tự LRU không trùng thứ tự thời gian tính nên phải duyệt hết (cache nhỏ)
+        expired = [key for key, (_, created) in self._entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        self._evictions += len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self._exact_hits + self._near_hits
+            lookups = hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "max_hamming": self.max_hamming,
+                "lookups": lookups,
+                "hits": hits,
+                "exact_hits": self._exact_hits,
+                "near_hits": self._near_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+            }
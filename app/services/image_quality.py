@@ -0,0 +1,63 @@
+import numpy as np
+
+from typing import Dict, List, Tuple
+
+from app.core.config import settings
+
+# Mã lý do ảnh bị từ chối
+TOO_BLURRY = "too_blurry"
+TOO_DARK = "too_dark"
+TOO_BRIGHT = "too_bright"
+LOW_CONTRAST = "low_contrast"
+
+
+class ImageQualityError(ValueError):
+    """Ảnh không đạt ngưỡng chất lượng, bị từ chối trước khi chạy model."""
+
+    def __init__(self, reasons: List[str], metrics: Dict[str, float]):
+        super().__init__(f"Image quality too low: {', '.join(reasons)}.")
+        self.reasons = reasons
+        self.metrics = metrics
+
+
+def quality_metrics(image: np.ndarray) -> Dict[str, float]:
+    """
+    Đo chất lượng ảnh đã tiền xử lý ((1,) H, W, C, giá trị 0..1) trên thang mức xám 0..255:
+    - sharpness: phương sai của Laplacian (ảnh mờ có ít cạnh nên phương sai thấp)
+    - brightness: độ sáng trung bình
+    - contrast: độ lệch chuẩn độ sáng
+    """
+    gray = np.asarray(image, dtype=np.float32).reshape(image.shape[-3:]).mean(axis=2) * 255.0
+    laplacian = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+        - 4.0 * gray[1:-1, 1:-1]
+    )
+    return {
+        "sharpness": float(laplacian.var()),
+        "brightness": float(gray.mean()),
+        "contrast": float(gray.std()),
+    }
+
+
+def assess_quality(image: np.ndarray) -> Tuple[List[str], Dict[str, float]]:
+    """Trả về (danh sách mã lý do không đạt theo ngưỡng FACE_QUALITY_*, các chỉ số đo được)."""
+    metrics = quality_metrics(image)
+    reasons: List[str] = []
+    if metrics["sharpness"] < settings.FACE_QUALITY_MIN_SHARPNESS:
+        reasons.append(TOO_BLURRY)
+    if metrics["brightness"] < settings.FACE_QUALITY_MIN_BRIGHTNESS:
+        reasons.append(TOO_DARK)
+    elif metrics["brightness"] > settings.FACE_QUALITY_MAX_BRIGHTNESS:
+        reasons.append(TOO_BRIGHT)
+    if metrics["contrast"] < settings.FACE_QUALITY_MIN_CONTRAST:
+        reasons.append(LOW_CONTRAST)
+    return reasons, metrics
+
+
+def check_quality(image: np.ndarray) -> None:
+    """Ném ImageQualityError nếu ảnh không đạt (không làm gì khi FACE_QUALITY_GATE_ENABLED=False)."""
+    if not settings.FACE_QUALITY_GATE_ENABLED:
+        return
+    reasons, metrics = assess_quality(image)
+    if reasons:
+        raise ImageQualityError(reasons, metrics)
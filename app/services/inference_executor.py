@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class FaceServiceBusyError(RuntimeError):
+    """Số request khuôn mặt đang xử lý đã chạm giới hạn, request mới bị từ chối ngay (503)."""
+
+
+class InferenceExecutor:
+    """
+    Thread pool riêng cho việc xử lý ảnh / chạy model khuôn mặt, tách khỏi event loop và khỏi
+    thread pool mặc định của asyncio, kèm giới hạn số request đang xử lý (`max_pending`).
+    Khi quá tải, `admit()` từ chối ngay thay vì để request xếp hàng vô hạn, nhờ vậy các
+    endpoint nhẹ (CRUD, WebSocket) vẫn phản hồi nhanh khi xác thực khuôn mặt đang tải nặng.
+    Mọi lần chạy model đi qua `forward()`, bị giới hạn tối đa `workers` lần đồng thời dù được gọi
+    từ pool này, từ luồng micro-batching hay từ luồng khác.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32, name: str = "face-inference"):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending  # 0: không giới hạn
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._forward_slots = threading.BoundedSemaphore(self.workers)
+        self._forwarding = 0
+        self._max_forwarding = 0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        """Giữ một chỗ trong giới hạn request đang xử lý; ném FaceServiceBusyError nếu đã đầy."""
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self._rejected += 1
+                raise FaceServiceBusyError(
+                    f"Face inference is saturated ({self._pending} requests in progress)."
+                )
+            self._pending += 1
+            self._admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Chạy `func(*args)` trên thread pool của model và chờ kết quả mà không chặn event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, functools.partial(func, *args))
+
+    def forward(self, func: Callable[..., T], *args) -> T:
+        """Chạy `func(*args)` (một lần forward pass) trên luồng hiện tại, chờ nếu đã đủ `workers` lần chạy."""
+        with self._forward_slots:
+            with self._lock:
+                self._forwarding += 1
+                self._max_forwarding = max(self._max_forwarding, self._forwarding)
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._forwarding -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "forwarding": self._forwarding,
+                "max_forwarding": self._max_forwarding,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
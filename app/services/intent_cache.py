@@ -0,0 +1,57 @@
+import copy
+import re
+import unicodedata
+
+from collections import OrderedDict
+from typing import Optional
+
+
+def normalize_command(sentence: str) -> str:
+    """Chuẩn hóa câu lệnh: Unicode NFC (tiếng Việt dựng sẵn / tổ hợp như nhau), chữ thường, gộp khoảng trắng."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", sentence).lower()).strip()
+
+
+class IntentResultCache:
+    """
+    Cache LRU kết quả nlp_pipeline theo câu lệnh đã chuẩn hóa. Khóa gồm cả hash của tập câu
+    mẫu nên khi câu mẫu thay đổi, kết quả cũ không còn được dùng (và bị xóa bởi `invalidate`).
+    Chỉ dùng trên event loop nên không cần khóa.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries  # 0: tắt cache
+        self._entries: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, fingerprint: str, command: str) -> Optional[dict]:
+        if not self.max_entries:
+            return None
+        result = self._entries.get((fingerprint, command))
+        if result is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end((fingerprint, command))
+        return copy.deepcopy(result)
+
+    def put(self, fingerprint: str, command: str, result: dict) -> None:
+        if not self.max_entries:
+            return
+        self._entries[(fingerprint, command)] = copy.deepcopy(result)
+        self._entries.move_to_end((fingerprint, command))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": self._hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,80 @@
+import re
+import unicodedata
+
+from typing import Dict, Optional, Tuple
+
+EXACT = "exact"
+PREFIX = "prefix"
+
+
+def fold_command(sentence: str) -> str:
+    """
+    Dạng so khớp của câu lệnh: bỏ dấu tiếng Việt (kể cả đ -> d), bỏ dấu câu, chữ thường,
+    gộp khoảng trắng. Ví dụ "Bật đèn!" và "bat  den" cùng cho "bat den".
+    """
+    decomposed = unicodedata.normalize("NFD", sentence.lower().replace("đ", "d").replace("Đ", "d"))
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]|_", " ", stripped).split())
+
+
+class IntentLexicon:
+    """
+    Bảng tra câu mẫu -> intent không cần chạy model: khớp nguyên câu theo dạng `fold_command`
+    và (tùy chọn) khớp tiền tố theo từ bằng trie, ví dụ "bật đèn phòng khách" -> "bật đèn".
+    Các câu mẫu trùng dạng bỏ dấu nhưng khác intent bị loại khỏi bảng vì không phân biệt được.
+    """
+
+    def __init__(self, intent_templates: Dict[str, str]):
+        self.exact_hits = 0
+        self.prefix_hits = 0
+        self.load(intent_templates)
+
+    def load(self, intent_templates: Dict[str, str]) -> None:
+        table: Dict[str, Tuple[str, str]] = {}
+        conflicts = set()
+        for template, intent in intent_templates.items():
+            key = fold_command(template)
+            if not key or key in conflicts:
+                continue
+            if key in table and table[key][1] != intent:
+                del table[key]
+                conflicts.add(key)
+                continue
+            table.setdefault(key, (template, intent))
+
+        # Trie theo từ: mỗi nút là dict {từ: nút con}, khóa None giữ (câu mẫu, intent) kết thúc tại đó
+        trie: dict = {}
+        for key, match in table.items():
+            node = trie
+            for token in key.split(" "):
+                node = node.setdefault(token, {})
+            node[None] = match
+        # Gán một lần để luồng khác không thấy bảng dở dang
+        self._table, self._trie = table, trie
+
+    def match(self, sentence: str, prefix: bool = False) -> Optional[Tuple[str, str, str]]:
+        """(câu mẫu, intent, EXACT | PREFIX) nếu câu khớp; khớp tiền tố chọn câu mẫu dài nhất."""
+        key = fold_command(sentence)
+        found = self._table.get(key)
+        if found is not None:
+            self.exact_hits += 1
+            return found + (EXACT,)
+        if not prefix:
+            return None
+        node, longest = self._trie, None
+        for token in key.split(" "):
+            node = node.get(token)
+            if node is None:
+                break
+            longest = node.get(None, longest)
+        if longest is None:
+            return None
+        self.prefix_hits += 1
+        return longest + (PREFIX,)
+
+    def stats(self) -> dict:
+        return {
+            "templates": len(self._table),
+            "exact_hits": self.exact_hits,
+            "prefix_hits": self.prefix_hits,
+        }
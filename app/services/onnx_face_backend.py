@@ -0,0 +1,181 @@
+"""
+Backend ONNX Runtime (CPU) cho model khuôn mặt, có thể lượng tử hóa int8 (dynamic quantization).
+Cần cài thêm: pip install onnxruntime tf2onnx
+
+Kiểm tra độ lệch so với TensorFlow:
+python -m app.services.onnx_face_backend --images <thư mục ảnh khuôn mặt> [--int8]
+"""
+import logging
+import numpy as np
+
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from app.core.config import settings
+from app.core.quantization import pairwise_distances
+
+logger = logging.getLogger(__name__)
+
+
+def _require(module: str):
+    try:
+        return __import__(module, fromlist=["_"])
+    except ImportError as e:
+        raise RuntimeError(
+            f"FACE_MODEL_BACKEND=onnx cần package '{module}' (pip install onnxruntime tf2onnx)."
+        ) from e
+
+
+def export_to_onnx(model, input_shape, path: Path) -> Path:
+    """Xuất model Keras đã nạp trọng số sang ONNX với batch động (None, H, W, C)."""
+    tf = _require("tensorflow")
+    tf2onnx = _require("tf2onnx")
+    spec = (tf.TensorSpec((None, *input_shape), tf.float32, name="images"),)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=str(path))
+    logger.info(f"Exported face model to ONNX: {path}")
+    return path
+
+
+def quantize_int8(source: Path, target: Path) -> Path:
+    """Lượng tử hóa sau huấn luyện (dynamic, trọng số int8) bằng onnxruntime.quantization."""
+    quantization = _require("onnxruntime.quantization")
+    quantization.quantize_dynamic(
+        str(source), str(target), weight_type=quantization.QuantType.QInt8
+    )
+    logger.info(f"Quantized ONNX face model to int8: {target}")
+    return target
+
+
+class OnnxFaceModel:
+    """Phiên ONNX Runtime trên CPU, nhận batch (n, H, W, C) float32 và trả về embedding (n, dim)."""
+
+    def __init__(self, path: Path, threads: int = 0):
+        ort = _require("onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(
+            str(path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def onnx_model_path(int8: bool) -> Path:
+    path = settings.FACE_ONNX_PATH
+    return path.with_name(f"{path.stem}_int8{path.suffix}") if int8 else path
+
+
+def load_onnx_model(model, input_shape, weights_path: Path, int8: bool = False) -> OnnxFaceModel:
+    """
+    Mở model ONNX (và bản int8 nếu `int8`), tự xuất lại từ model Keras khi file ONNX
+    chưa có hoặc cũ hơn file trọng số .h5.
+    """
+    fp32_path = onnx_model_path(False)
+    if not fp32_path.exists() or fp32_path.stat().st_mtime < weights_path.stat().st_mtime:
+        export_to_onnx(model, input_shape, fp32_path)
+    path = fp32_path
+    if int8:
+        path = onnx_model_path(True)
+        if not path.exists() or path.stat().st_mtime < fp32_path.stat().st_mtime:
+            quantize_int8(fp32_path, path)
+    return OnnxFaceModel(path, threads=settings.FACE_ONNX_THREADS)
+
+
+def compare_embeddings(
+    ref: np.ndarray, cand: np.ndarray, distance_threshold: float
+) -> dict:
+    """
+    So sánh hai bộ embedding của cùng các ảnh (`cand` là phía cần kiểm tra, `ref` là phía chuẩn):
+    - drift: khoảng cách giữa hai embedding của cùng một ảnh.
+    - pair_decision_flips: số cặp ảnh đổi quyết định khớp/không khớp (so với `distance_threshold`)
+      khi cả hai phía đều dùng cand.
+    - cross_decision_flips: như trên nhưng ảnh kiểm tra dùng cand còn embedding đã đăng ký
+      vẫn từ ref - trường hợp thực tế ngay sau khi đổi cách tính embedding.
+    """
+    ref = np.asarray(ref, dtype=np.float32)
+    cand = np.asarray(cand, dtype=np.float32)
+    drift = np.linalg.norm(ref - cand, axis=1)
+    upper = np.triu_indices(len(ref), k=1)
+    ref_match = pairwise_distances(ref)[upper] < distance_threshold
+    cand_match = pairwise_distances(cand)[upper] < distance_threshold
+    cross_match = pairwise_distances(cand, ref)[upper] < distance_threshold
+    pairs = len(upper[0])
+    return {
+        "images": int(len(ref)),
+        "max_drift": float(drift.max()) if len(drift) else 0.0,
+        "mean_drift": float(drift.mean()) if len(drift) else 0.0,
+        "relative_drift": float(drift.mean() / max(np.linalg.norm(ref, axis=1).mean(), 1e-12)),
+        "pairs": pairs,
+        "pair_decision_flips": int(np.count_nonzero(ref_match != cand_match)),
+        "cross_decision_flips": int(np.count_nonzero(ref_match != cross_match)),
+        "distance_threshold": distance_threshold,
+    }
+
+
+def parity_report(
+    reference: Callable[[np.ndarray], np.ndarray],
+    candidate: Callable[[np.ndarray], np.ndarray],
+    images: np.ndarray,
+    distance_threshold: float,
+) -> dict:
+    """
+    So sánh embedding của `candidate` (ONNX) với `reference` (TensorFlow) trên cùng các ảnh,
+    các chỉ số như compare_embeddings.
+    """
+    return compare_embeddings(reference(images), candidate(images), distance_threshold)
+
+
+def _load_images(directory: Optional[Path], limit: int) -> np.ndarray:
+    from app.services.face_verification_service import face_service
+
+    images: List[np.ndarray] = []
+    if directory is not None:
+        for path in sorted(directory.iterdir())[:limit]:
+            preprocessed = face_service._preprocess_image(path.read_bytes())
+            if preprocessed is not None:
+                images.append(preprocessed[0])
+    if not images:
+        logger.warning("No face images given, using random images (drift only is meaningful).")
+        height, width, channels = settings.MODEL_INPUT_SHAPE
+        return np.random.default_rng(0).random((min(limit, 64), height, width, channels), dtype=np.float32)
+    return np.stack(images)
+
+
+def main() -> None:
+    import argparse
+
+    from app.services.face_verification_service import face_service
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=Path, default=None, help="Thư mục ảnh khuôn mặt mẫu")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--int8", action="store_true", default=settings.FACE_ONNX_QUANTIZE_INT8)
+    args = parser.parse_args()
+
+    if not face_service.load() or face_service.model is None:
+        raise SystemExit("Face model weights are not loaded, cannot compare backends.")
+    model = face_service.model
+    onnx_model = load_onnx_model(
+        model, settings.MODEL_INPUT_SHAPE, settings.MODEL_PATH, int8=args.int8
+    )
+    report = parity_report(
+        lambda batch: model.predict(batch, verbose=0),
+        onnx_model,
+        _load_images(args.images, args.limit),
+        settings.OPTIMAL_THRESHOLD,
+    )
+    report["onnx_model"] = str(onnx_model.path)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
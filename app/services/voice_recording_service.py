@@ -1,16 +1,24 @@
 from scipy.io.wavfile import write
-from sklearn.metrics.pairwise import cosine_similarity
+from app.core.config import settings
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.intent_cache import IntentResultCache, normalize_command
+from app.services.intent_lexicon import IntentLexicon
 from app.utils import AImodel, model_ready
 
 import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import threading
+import hashlib
+import asyncio
 import torch
+import json
 import time
 import os
 import re
 
+from typing import List
+
 # Mẫu câu lệnh và intent tương ứng
 intent_templates = {
     "bật đèn": "TURN_ON_LIGHT",
@@ -73,18 +81,113 @@ intent_templates = {
     "tắt tất cả thiết bị": "TURN_OFF_LIGHT_AND_TURN_OFF_FAN_AND_CLOSE_DOOR",
 }
 
+def mean_pooling(last_hidden_state: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """Trung bình embedding các token thật của mỗi câu, bỏ qua token đệm (padding) trong batch."""
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    return (last_hidden_state * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+
+def templates_fingerprint(model_name: str, templates: List[str]) -> str:
+    """Hash của tên model và danh sách câu mẫu (theo thứ tự), dùng làm khóa cache."""
+    payload = json.dumps([model_name, templates], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
 class VoiceRecordingService:
     def __init__(self):
         os.makedirs("app/voices", exist_ok=True)
         # Lưu sẵn embeddings của intent mẫu
         self.template_embeddings = None
+        # Ma trận embedding (đã chuẩn hóa L2) của các câu mẫu, hàng i ứng với template_keys[i]
+        self.template_keys: List[str] = []
+        self.template_matrix: torch.Tensor | None = None
+        # Chỉ số intent của từng câu mẫu, dùng để tính độ chênh với intent khác gần nhất
+        self.template_intent_ids: torch.Tensor | None = None
+        self.templates_fingerprint: str | None = None
+        # Kết quả nlp_pipeline của các câu lệnh lặp lại (khóa: câu đã chuẩn hóa + hash câu mẫu)
+        self.result_cache = IntentResultCache(settings.NLP_RESULT_CACHE_SIZE)
+        # Bảng tra câu mẫu (bỏ dấu, bỏ dấu câu), dùng trước khi phải chạy model
+        self.lexicon = IntentLexicon(intent_templates)
+        # Luồng riêng chạy model NLP: gom các câu đến đồng thời thành một lần forward có padding
+        self.batcher = EmbeddingBatcher(
+            self.encode_sentences,
+            max_batch_size=settings.NLP_BATCH_MAX_SIZE,
+            max_wait=settings.NLP_BATCH_MAX_WAIT_MS / 1000,
+            name="nlp-embedding-batcher",
+            collate=list,
+        )
 
     async def init_embeddings(self, intent_templates: dict):
         if self.template_embeddings is None:
-            self.template_embeddings = {
-                k: await self.get_sentence_embedding(k)
-                for k in intent_templates.keys()
-            }
+            await model_ready.wait()
+            await asyncio.to_thread(self.load_template_embeddings, intent_templates)
+
+    def encode_sentences(self, sentences: List[str]) -> torch.Tensor:
+        """
+        Embedding (n, hidden_dim) của nhiều câu, mỗi batch NLP_ENCODE_BATCH_SIZE câu được đệm
+        cùng độ dài và chạy một lần forward. Câu được xếp theo độ dài để giảm token đệm.
+        """
+        batch_size = max(1, settings.NLP_ENCODE_BATCH_SIZE)
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        embeddings: List[torch.Tensor | None] = [None] * len(sentences)
+        for start in range(0, len(order), batch_size):
+            batch_ids = order[start:start + batch_size]
+            encoded = AImodel.tokenizer(
+                [sentences[i] for i in batch_ids],
+                padding=True,
+                truncation=True,
+                return_tensors="pt",
+            )
+            with torch.no_grad():
+                outputs = AImodel.nlp_model(**encoded)
+            pooled = mean_pooling(outputs[0], encoded["attention_mask"])
+            for i, embedding in zip(batch_ids, pooled):
+                embeddings[i] = embedding
+        return torch.stack(embeddings)
+
+    def load_template_embeddings(self, intent_templates: dict) -> None:
+        """
+        Nạp ma trận embedding của các câu mẫu: đọc từ cache trên đĩa nếu đúng model và đúng
+        tập câu mẫu, nếu không thì mã hóa theo batch rồi lưu lại. Cần model NLP đã nạp.
+        """
+        templates = list(intent_templates.keys())
+        fingerprint = templates_fingerprint(settings.NLP_MODEL_NAME, templates)
+        cache_path = settings.INTENT_EMBEDDINGS_CACHE_DIR / f"intent_embeddings_{fingerprint}.npy"
+        matrix = None
+        if cache_path.exists():
+            try:
+                matrix = np.load(cache_path, allow_pickle=False)
+                if matrix.ndim != 2 or matrix.shape[0] != len(templates):
+                    matrix = None
+            except Exception as e:
+                print(f"⚠️ Không đọc được cache embedding câu mẫu {cache_path}: {e}")
+                matrix = None
+        if matrix is None:
+            start_time = time.time()
+            embeddings = torch.nn.functional.normalize(self.encode_sentences(templates), dim=1)
+            matrix = embeddings.numpy().astype(np.float32)
+            try:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = cache_path.with_suffix(".tmp")
+                with open(tmp_path, "wb") as f:
+                    np.save(f, matrix)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                print(f"⚠️ Không lưu được cache embedding câu mẫu: {e}")
+            print(f"✅ Đã mã hóa {len(templates)} câu mẫu intent trong {time.time() - start_time:.2f}s.")
+        else:
+            print(f"✅ Đã nạp embedding {len(templates)} câu mẫu intent từ cache.")
+        if fingerprint != self.templates_fingerprint:
+            self.result_cache.invalidate()
+            self.lexicon.load(intent_templates)
+        self.templates_fingerprint = fingerprint
+        intent_ids = {intent: i for i, intent in enumerate(dict.fromkeys(intent_templates.values()))}
+        self.template_keys = templates
+        self.template_matrix = torch.from_numpy(matrix)
+        self.template_intent_ids = torch.tensor(
+            [intent_ids[intent_templates[template]] for template in templates]
+        )
+        self.template_embeddings = {
+            template: self.template_matrix[i] for i, template in enumerate(templates)
+        }
 
     # Voice recording service for handling audio input into strings
     def countdown_timer(self, duration):
@@ -162,14 +265,12 @@ class VoiceRecordingService:
         
     # Text from audio handling by NLP model
     async def get_sentence_embedding(self, sentence: str) -> torch.Tensor:
-        """Chuyển câu thành vector embedding trung bình (mean pooling)."""
+        """
+        Chuyển câu thành vector embedding trung bình (mean pooling). Tokenize và forward chạy
+        trên luồng của batcher (không chặn event loop), cùng batch với các câu đến đồng thời.
+        """
         await model_ready.wait()  # ✅ Chờ mô hình sẵn sàng
-        input_ids = AImodel.tokenizer.encode(sentence, return_tensors='pt')
-        with torch.no_grad():
-            outputs = AImodel.nlp_model(input_ids)
-            last_hidden_state = outputs[0]  # (1, seq_len, hidden_dim)
-            sentence_embedding = last_hidden_state.mean(dim=1)  # (1, hidden_dim)
-        return sentence_embedding.squeeze(0)  # (hidden_dim,)
+        return await asyncio.wrap_future(self.batcher.submit(sentence))  # (hidden_dim,)
 
     # # Hàm embedding
     # def get_sentence_embedding(sentence: str) -> torch.Tensor:
@@ -337,24 +438,93 @@ class VoiceRecordingService:
         return None
 
     async def nlp_pipeline(self, sentence: str) -> dict:
-        await self.init_embeddings(intent_templates=intent_templates)
+        """
+        Hiểu câu lệnh: intent gần nhất và điều kiện số. Câu được chuẩn hóa (Unicode, chữ thường,
+        khoảng trắng) trước khi xử lý nên các câu lặp lại dùng lại kết quả trong cache. Điều kiện
+        cũng được trích từ câu đã chuẩn hóa: các mẫu và từ khóa điều kiện đều viết thường, nên câu
+        viết hoa ("Nóng") sẽ khớp mẫu nhưng mất toán tử / giá trị nếu không chuẩn hóa, và khi đó
+        kết quả trong cache sẽ phụ thuộc vào cách viết của câu đầu tiên.
+        Câu trùng một câu mẫu (không phân biệt dấu, dấu câu) được trả ngay mà không chạy model.
+        """
+        command = normalize_command(sentence)
+        result = self.match_lexical(command)
+        if result is None:
+            await self.init_embeddings(intent_templates=intent_templates)
+            result = self.result_cache.get(self.templates_fingerprint, command)
+            if result is None:
+                result = await self._understand(command)
+                self.result_cache.put(self.templates_fingerprint, command, result)
+        result["sentence"] = sentence
+        return result
+
+    def split_condition(self, sentence: str) -> tuple[dict | None, str]:
+        """(điều kiện số, phần câu lệnh còn lại sau khi bỏ mệnh đề điều kiện/thời gian)."""
         condition = self.extract_numeric_condition(sentence)
         sentence_wo_condition = re.sub(r"khi .*|nếu .*|lúc .*|khi trời .*|nếu trời .*|lúc trời .*|sau .*", "", sentence).strip()
-
-        emb = (await self.get_sentence_embedding(sentence_wo_condition)).unsqueeze(0)
-        sims = {}
-        for template, template_emb in self.template_embeddings.items():
-            template_emb = template_emb.unsqueeze(0)
-            sim = cosine_similarity(emb, template_emb)[0][0]
-            sims[template] = sim
-        best_template = max(sims, key=sims.get)
-
+        return condition, sentence_wo_condition
+
+    def match_lexical(self, sentence: str) -> dict | None:
+        """Kết quả với similarity 1.0 nếu phần câu lệnh khớp câu mẫu trong bảng tra, ngược lại None."""
+        if not settings.NLP_LEXICAL_MATCH_ENABLED:
+            return None
+        condition, sentence_wo_condition = self.split_condition(sentence)
+        match = self.lexicon.match(sentence_wo_condition, prefix=settings.NLP_LEXICAL_PREFIX_MATCH)
+        if match is None:
+            return None
+        template, intent, matched_by = match
+        candidates = [{"template": template, "intent": intent, "similarity": 1.0}]
+        return self.build_result(sentence, condition, candidates, None, matched_by)
+
+    async def _understand(self, sentence: str) -> dict:
+        condition, sentence_wo_condition = self.split_condition(sentence)
+
+        emb = await self.get_sentence_embedding(sentence_wo_condition)
+        candidates, margin = self.score_intents(emb, settings.NLP_INTENT_TOP_K)
+        return self.build_result(sentence, condition, candidates, margin, "embedding")
+
+    def build_result(
+        self,
+        sentence: str,
+        condition: dict | None,
+        candidates: List[dict],
+        margin: float | None,
+        matched_by: str,
+    ) -> dict:
+        best = candidates[0]
         return {
             "sentence": sentence,
-            "intent": intent_templates[best_template],
-            "matched_template": best_template,
-            "similarity": float(sims[best_template]),
-            "condition": condition
+            "intent": best["intent"],
+            "matched_template": best["template"],
+            "similarity": best["similarity"],
+            "condition": condition,
+            "candidates": candidates,
+            "margin": margin,
+            # Khớp bảng tra là khớp chính xác câu mẫu nên không mơ hồ
+            "ambiguous": margin is not None and margin < settings.NLP_AMBIGUITY_MARGIN,
+            "matched_by": matched_by,
         }
 
+    def score_intents(self, embedding: torch.Tensor, top_k: int = 3) -> tuple[List[dict], float]:
+        """
+        Độ tương đồng cosine của câu với TẤT CẢ câu mẫu bằng một phép nhân ma trận-vector
+        (ma trận câu mẫu đã chuẩn hóa sẵn). Trả về (top_k câu mẫu gần nhất, margin) với margin là
+        độ chênh giữa câu mẫu tốt nhất và câu mẫu tốt nhất thuộc intent KHÁC: margin nhỏ nghĩa là
+        lệnh mơ hồ giữa hai intent.
+        """
+        query = torch.nn.functional.normalize(embedding.float(), dim=0)
+        sims = self.template_matrix @ query  # (số câu mẫu,)
+        values, indices = torch.topk(sims, min(max(1, top_k), len(self.template_keys)))
+        candidates = [
+            {
+                "template": self.template_keys[i],
+                "intent": intent_templates[self.template_keys[i]],
+                "similarity": float(value),
+            }
+            for value, i in zip(values.tolist(), indices.tolist())
+        ]
+        best = int(indices[0])
+        other = sims[self.template_intent_ids != self.template_intent_ids[best]]
+        margin = float(sims[best] - other.max()) if len(other) else 1.0
+        return candidates, margin
+
 voice_service = VoiceRecordingService()
\ No newline at end of file
@@ -3,11 +3,12 @@ import base64
 import time
 import numpy as np
 
-from typing import Any, Optional, Tuple
+from typing import Any, List, Optional, Tuple
 from sqlmodel import select, Session
 
 from app.core.config import settings
-from app.core.db import get_embeddings_for_user, engine
+from app.core.db import get_embedding_matrix, search_nearest_users, engine
+from app.core.quantization import dot_products
 from app.model import Camera, Device
 from app.services.face_verification_service import face_service
 
@@ -54,60 +55,151 @@ def euclidean_distance_numpy(embedding1: np.ndarray, embedding2: np.ndarray) ->
         return float("inf")
     return float(np.sqrt(np.sum(np.square(embedding1 - embedding2))))
 
-async def verify_face(user_id: str, image_base64: str) -> Tuple[bool, int, str | dict[str, Any]]: 
-    user_id_to_verify = user_id
-    # 1. Lấy embedding của ảnh mới cần kiểm tra
+def squared_distances(
+    embedding: np.ndarray,
+    matrix: np.ndarray,
+    sq_norms: np.ndarray,
+    scales: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Bình phương khoảng cách Euclid từ `embedding` tới từng hàng của `matrix`,
+    dùng ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b với một phép nhân ma trận-vector (BLAS).
+    `matrix` có thể là float32 hoặc dữ liệu lượng tử hóa float16/int8 (kèm `scales`).
+    """
+    embedding = np.asarray(embedding, dtype=np.float32)
+    distances = dot_products(embedding, matrix, scales)
+    distances *= -2.0
+    distances += sq_norms
+    distances += float(embedding @ embedding)
+    return np.maximum(distances, 0.0, out=distances)
+
+async def verify_face_for_users(
+    user_ids: List[str], image_base64: str, frame_stream: Optional[str] = None
+) -> Tuple[bool, int, str | dict[str, Any]]:
     new_image_bytes = decode_base64_image(image_base64)
     if not new_image_bytes:
         return False, 400, "Invalid base64 data for the image to check."
-
-    new_embedding = face_service.get_embedding(new_image_bytes)
+    return await verify_image_for_users(user_ids, new_image_bytes, frame_stream)
+
+async def verify_image_for_users(
+    user_ids: List[str], image_bytes: bytes, frame_stream: Optional[str] = None
+) -> Tuple[bool, int, str | dict[str, Any]]:
+    """
+    Xác thực một ảnh (bytes đã giải mã) với danh sách user_id (vd: các user đã đăng ký của camera).
+    Embedding của ảnh chỉ được tính MỘT lần, sau đó so sánh với ma trận embedding đã cache
+    của từng user bằng một phép nhân ma trận-vector (không lặp từng embedding).
+    `frame_stream` (id camera) cho phép dùng lại embedding của khung hình gần trùng từ cùng camera.
+    """
+    # 1. Lấy embedding của ảnh mới cần kiểm tra
+    new_embedding = await face_service.get_embedding_async(image_bytes, frame_stream)
     if new_embedding is None:
         return False, 500, "Failed to extract embedding from the new image."
 
-    # 2. Lấy DANH SÁCH embedding của user_id đã đăng ký
-    stored_embeddings_list = get_embeddings_for_user(
-        user_id_to_verify
-    )
-
-    if not stored_embeddings_list:  # Kiểm tra None hoặc list rỗng
-        return False, 404, f"User ID '{user_id_to_verify}' not found or no embeddings registered."
-
-    # 3. So sánh và Đếm số lần "Khớp"
-    match_count = 0
-    min_distance_found = float("inf")
-    total_stored_embeddings = len(stored_embeddings_list)
-
-    for stored_embedding in stored_embeddings_list:
-        distance = euclidean_distance_numpy(new_embedding, stored_embedding)
-        min_distance_found = min(
-            min_distance_found, distance
-        )  # Cập nhật khoảng cách nhỏ nhất
+    # 2. Tính độ tin cậy cho từng user đã đăng ký (ngoài event loop)
+    scores = await asyncio.to_thread(score_embedding_against_users, new_embedding, user_ids)
+    if not scores:
+        return False, 404, f"User ID(s) {list(user_ids)} not found or no embeddings registered."
 
-        if distance < settings.OPTIMAL_THRESHOLD:  # OPTIMAL_THRESHOLD từ config.py
-            match_count += 1
-
-    # 4. Tính Độ Tin Cậy (Confidence Score)
-    confidence_score = (
-        match_count / total_stored_embeddings if total_stored_embeddings > 0 else 0.0
-    )
-
-    # 5. Đưa ra Quyết định Cuối cùng is_same_person
+    # 3. Chọn user có độ tin cậy cao nhất và đưa ra quyết định
+    best_user_id, best_score = scores[0]
     is_same_person = (
-        confidence_score >= settings.CONFIDENCE_VERIFICATION_THRESHOLD
+        best_score["confidence_score"] >= settings.CONFIDENCE_VERIFICATION_THRESHOLD
     )  # Từ config.py
 
     if is_same_person:
         message :dict[str, Any] = {
-            "is_signed_person": user_id,
-            "confidence_score": confidence_score,
-            "min_distance_found": min_distance_found,
+            "is_signed_person": best_user_id,
+            "confidence_score": best_score["confidence_score"],
+            "min_distance_found": best_score["min_distance_found"],
+            "user_confidences": {
+                user_id: score["confidence_score"] for user_id, score in scores
+            },
         } 
     else:
         message :str = "Not Correct Person"
 
     return True, 200, message
 
+async def identify_face(image_base64: str, top_k: int) -> Tuple[bool, int, str | dict[str, Any]]:
+    """
+    Nhận diện 1:N không cần user_id: tìm top_k user gần nhất qua kho embedding
+    (index ANN với pgvector), rồi tính độ tin cậy cho từng ứng viên.
+    """
+    new_image_bytes = decode_base64_image(image_base64)
+    if not new_image_bytes:
+        return False, 400, "Invalid base64 data for the image to check."
+
+    new_embedding = await face_service.get_embedding_async(new_image_bytes)
+    if new_embedding is None:
+        return False, 500, "Failed to extract embedding from the new image."
+
+    nearest = await asyncio.to_thread(search_nearest_users, new_embedding, top_k)
+    if not nearest:
+        return False, 404, "No embeddings registered."
+
+    # Ứng viên đã là những user gần nhất nên tính khoảng cách chính xác, không loại nhanh theo tâm
+    scores = await asyncio.to_thread(
+        score_embedding_against_users,
+        new_embedding,
+        [user_id for user_id, _ in nearest],
+        False,
+    )
+    best_user_id, best_score = scores[0]
+    is_same_person = (
+        best_score["confidence_score"] >= settings.CONFIDENCE_VERIFICATION_THRESHOLD
+    )
+    message :dict[str, Any] = {
+        "is_signed_person": best_user_id if is_same_person else None,
+        "candidates": [
+            {"user_id": user_id, **score} for user_id, score in scores
+        ],
+    }
+    return True, 200, message
+
+def score_embedding_against_users(
+    embedding: np.ndarray, user_ids: List[str], precheck: bool = True
+) -> List[Tuple[str, dict[str, float]]]:
+    """
+    So sánh một embedding với ma trận embedding (đã cache) của từng user_id, bỏ qua user
+    chưa có embedding. Trả về [(user_id, {"confidence_score", "min_distance_found"})]
+    sắp xếp theo độ tin cậy giảm dần (hòa thì khoảng cách nhỏ hơn đứng trước).
+    Với `precheck` khi đang bật tóm tắt prototype (MAX_EMBEDDINGS_PER_USER > 0), user có tâm
+    cách ảnh xa hơn bán kính + OPTIMAL_THRESHOLD bị loại ngay (độ tin cậy 0) và
+    "min_distance_found" khi đó là cận dưới ||ảnh - tâm|| - bán kính. Khi tắt tóm tắt,
+    "min_distance_found" luôn là khoảng cách nhỏ nhất thật.
+    """
+    threshold_sq = settings.OPTIMAL_THRESHOLD ** 2
+    precheck = precheck and settings.MAX_EMBEDDINGS_PER_USER > 0
+    scores: List[Tuple[str, dict[str, float]]] = []
+    for user_id in dict.fromkeys(user_ids):
+        cached = get_embedding_matrix(user_id)
+        if cached is None:
+            continue
+        if precheck and cached.centroid is not None:
+            lower_bound = euclidean_distance_numpy(embedding, cached.centroid) - cached.radius
+            if lower_bound >= settings.OPTIMAL_THRESHOLD:
+                scores.append((user_id, {
+                    "confidence_score": 0.0,
+                    "min_distance_found": lower_bound,
+                }))
+                continue
+        distances_sq = squared_distances(
+            embedding, cached.matrix, cached.sq_norms, cached.scales
+        )
+        # Độ tin cậy = tỉ lệ embedding đã lưu có khoảng cách nhỏ hơn OPTIMAL_THRESHOLD;
+        # với user đã tóm tắt, mỗi prototype được tính theo số embedding gốc mà nó đại diện
+        matches = distances_sq < threshold_sq
+        if cached.weights is None:
+            confidence = int(np.count_nonzero(matches)) / len(distances_sq)
+        else:
+            confidence = float(cached.weights[matches].sum() / cached.weights.sum())
+        scores.append((user_id, {
+            "confidence_score": confidence,
+            "min_distance_found": float(np.sqrt(distances_sq.min())),
+        }))
+    scores.sort(key=lambda item: (-item[1]["confidence_score"], item[1]["min_distance_found"]))
+    return scores
+
 async def timing_task(device: dict[str, str], time_delay: int) -> None:
     time.sleep(time_delay)
     session = Session(engine)
@@ -0,0 +1,155 @@
+import asyncio
+import uuid
+
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, status
+from sqlmodel import Session
+
+from app.api.routes.cameras import NOT_REGISTERED_MESSAGE, build_verification_response
+from app.core.db import engine
+from app.model import Camera
+from app.services.face_verification_service import FaceModelLoadError, FaceModelWarmingUpError
+from app.services.image_quality import ImageQualityError
+from app.services.inference_executor import FaceServiceBusyError
+from app.utils import verify_image_for_users
+
+router = APIRouter(prefix="/cameras", tags=["cameras"])
+
+
+class LatestFrameSlot:
+    """
+    Chỉ giữ khung hình mới nhất của camera. Khi model xử lý chậm hơn tốc độ camera gửi,
+    khung hình cũ chưa xử lý bị ghi đè (đếm vào `dropped`) nên độ trễ không tăng dần.
+    """
+
+    def __init__(self):
+        self._frame: Optional[bytes] = None
+        self._event = asyncio.Event()
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame: bytes) -> None:
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self.received += 1
+        self._event.set()
+
+    async def take(self) -> Optional[bytes]:
+        """Chờ và lấy khung hình mới nhất; None khi kết nối đã đóng."""
+        while self._frame is None and not self._closed:
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def close(self) -> None:
+        self._closed = True
+        self._frame = None
+        self._event.set()
+
+
+async def verify_frame(session: Session, camera: Camera, frame: bytes) -> Dict[str, Any]:
+    if not camera.user_ids:
+        return {"event": "face:verification", "result": NOT_REGISTERED_MESSAGE.model_dump()}
+    try:
+        result = await verify_image_for_users(camera.user_ids, frame, str(camera.id))
+        response = await build_verification_response(session, camera, result)
+        return {"event": "face:verification", "result": response.model_dump(mode="json")}
+    except HTTPException as e:
+        return {"event": "face:error", "status_code": e.status_code, "detail": e.detail}
+    except FaceModelLoadError as e:
+        return {"event": "face:error", "status_code": 503, "detail": str(e)}
+    except ImageQualityError as e:
+        return {"event": "face:rejected", "reasons": e.reasons, "metrics": e.metrics}
+    except FaceServiceBusyError as e:
+        # Bỏ qua khung hình này, khung hình tiếp theo sẽ được thử lại
+        return {
+            "event": "face:busy",
+            "status": "warming_up" if isinstance(e, FaceModelWarmingUpError) else "busy",
+            "detail": str(e),
+        }
+
+
+def camera_unavailable(camera: Optional[Camera], id: uuid.UUID) -> Optional[Dict[str, Any]]:
+    """Sự kiện lỗi nếu camera không còn tồn tại hoặc đã bị tắt, ngược lại None."""
+    if not camera:
+        return {"event": "face:error", "status_code": 404, "detail": f"Camera with ID {id} not found"}
+    if not camera.status:
+        return {"event": "face:error", "status_code": 400, "detail": "Camera is not active"}
+    return None
+
+
+async def process_frames(
+    websocket: WebSocket, session: Session, id: uuid.UUID, slot: LatestFrameSlot
+) -> None:
+    processed = 0
+    while True:
+        frame = await slot.take()
+        if frame is None:
+            return
+        # Đọc lại camera trước mỗi khung hình: camera bị tắt hoặc user bị gỡ khỏi camera
+        # phải có hiệu lực ngay, không đợi camera kết nối lại
+        camera = session.get(Camera, id, populate_existing=True)
+        error = camera_unavailable(camera, id)
+        if error:
+            await websocket.send_json(error)
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        payload = await verify_frame(session, camera, frame)
+        processed += 1
+        payload.update(
+            frames_received=slot.received, frames_processed=processed, frames_dropped=slot.dropped
+        )
+        await websocket.send_json(payload)
+
+
+@router.websocket("/{id}")
+async def stream_face_verification(websocket: WebSocket, id: uuid.UUID):
+    """
+    Camera gửi liên tục các khung hình dạng binary (mỗi message là một ảnh JPEG/PNG),
+    server luôn xác thực khung hình mới nhất và đẩy kết quả về ngay trên cùng kết nối.
+    """
+    await websocket.accept()
+    session = Session(engine)
+    try:
+        error = camera_unavailable(session.get(Camera, id), id)
+        if error:
+            await websocket.send_json(error)
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+        slot = LatestFrameSlot()
+        processor = asyncio.create_task(process_frames(websocket, session, id, slot))
+        receiver: Optional[asyncio.Task] = None
+        try:
+            # Chờ đồng thời message mới và luồng xử lý để biết ngay khi luồng xử lý dừng hoặc lỗi
+            while True:
+                receiver = asyncio.create_task(websocket.receive())
+                await asyncio.wait({receiver, processor}, return_when=asyncio.FIRST_COMPLETED)
+                if not receiver.done():
+                    break
+                message = receiver.result()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes"):
+                    slot.put(message["bytes"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if receiver is not None and not receiver.done():
+                receiver.cancel()
+            slot.close()
+            if not processor.done():
+                processor.cancel()
+            await asyncio.gather(processor, return_exceptions=True)
+        print(f"Camera stream {id} closed: {slot.received} frame(s), {slot.dropped} dropped")
+        if not processor.cancelled() and processor.exception() is not None:
+            error = processor.exception()
+            if not isinstance(error, WebSocketDisconnect):
+                print(f"Camera stream {id} failed: {error!r}")
+                raise error
+    finally:
+        session.close()
@@ -2,9 +2,11 @@ from fastapi import APIRouter
 
 from app.websocket import environment
 from app.websocket import devices
+from app.websocket import cameras
 
 ws_router = APIRouter()
 # api_router.include_router(rooms.router)
 ws_router.include_router(devices.router)
 ws_router.include_router(environment.router)
+ws_router.include_router(cameras.router)
 
@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+# Cấu hình tối thiểu để import được app mà không cần Postgres/model thật:
+# kho embedding nằm trong thư mục tạm và không nạp model khi khởi động.
+_store_dir = tempfile.mkdtemp(prefix="embeddings-test-")
+os.environ.setdefault("POSTGRES_SERVER", "localhost")
+os.environ.setdefault("POSTGRES_USER", "test")
+os.environ.setdefault("POSTGRES_PASSWORD", "test")
+os.environ.setdefault("POSTGRES_DB", "test")
+os.environ["EMBEDDINGS_BACKEND"] = "file"
+os.environ["EMBEDDINGS_STORE_DIR"] = _store_dir
+os.environ["EMBEDDINGS_STORE_PATH"] = os.path.join(_store_dir, "embeddings_store.json")
+os.environ["EMBEDDINGS_SNAPSHOT_PATH"] = os.path.join(_store_dir, "embeddings_store.bin")
+os.environ["FACE_MODEL_PRELOAD"] = "false"
@@ -0,0 +1,122 @@
+import numpy as np
+
+from app.core.ann_index import IVFFlatIndex
+
+DIM = 16
+
+
+def _vectors(rng, n):
+    return rng.normal(size=(n, DIM)).astype(np.float32)
+
+
+def _top_user(index, vector):
+    return index.search(vector, k=1, nprobe=1024)[0][0]
+
+
+def test_rows_added_after_replace_are_searchable():
+    rng = np.random.default_rng(0)
+    index = IVFFlatIndex(DIM, flat_threshold=10, retrain_factor=1.1)
+    index.add("a", _vectors(rng, 5))
+    index.add("b", _vectors(rng, 5))
+    assert index.is_trained
+
+    # Thay 5 vector của "a" bằng 1 prototype: lần huấn luyện lại dọn vector đã xóa,
+    # số vector còn sống (6) thấp hơn flat_threshold
+    index.replace("a", _vectors(rng, 1))
+    c = _vectors(rng, 2)
+    index.add("c", c)
+
+    assert len(index) == 8
+    for vector in c:
+        assert _top_user(index, vector) == "c"
+    assert index.self_check(queries=8, k=1, noise=0.0, nprobe=1024)["recall"] == 1.0
+
+
+def test_rows_added_after_remove_are_assigned_to_lists():
+    rng = np.random.default_rng(1)
+    index = IVFFlatIndex(DIM, flat_threshold=10)
+    index.add("a", _vectors(rng, 6))
+    index.add("b", _vectors(rng, 6))
+    assert index.is_trained
+
+    index.remove("a")
+    c = _vectors(rng, 3)
+    index.add("c", c)
+
+    assert index.is_trained
+    for vector in c:
+        assert _top_user(index, vector) == "c"
+
+
+RECALL_DIM = 64
+
+
+def _users(rng, count, per_user=8, start=0):
+    # Mỗi user là một cụm embedding quanh một tâm riêng; ở số chiều này user thứ 2..k
+    # nằm rải rác ở nhiều cụm IVF, giống embedding khuôn mặt thật
+    centers = rng.normal(size=(count, RECALL_DIM))
+    return [
+        (
+            f"user-{start + i}",
+            (centers[i] + rng.normal(size=(per_user, RECALL_DIM))).astype(np.float32),
+        )
+        for i in range(count)
+    ]
+
+
+def _recall(index, users, queries, k):
+    vectors = np.concatenate([matrix for _, matrix in users])
+    labels = np.repeat([user_id for user_id, _ in users], [len(m) for _, m in users])
+    hits = 0
+    for query in queries:
+        distances = np.linalg.norm(vectors - query, axis=1)
+        expected = []
+        for row in np.argsort(distances):
+            if labels[row] not in expected:
+                expected.append(labels[row])
+            if len(expected) == k:
+                break
+        hits += len(set(expected) & {user_id for user_id, _ in index.search(query, k)})
+    return hits / (len(queries) * k)
+
+
+def _noisy(rng, rows, count):
+    picked = rows[rng.choice(len(rows), size=count, replace=False)]
+    return (picked + 0.05 * rng.normal(size=picked.shape)).astype(np.float32)
+
+
+def test_default_probes_keep_top_k_recall():
+    rng = np.random.default_rng(2)
+    users = _users(rng, 1500)
+    index = IVFFlatIndex(RECALL_DIM, flat_threshold=2048)
+    index.build(users)
+    assert index.is_trained
+
+    # Với nprobe cố định (không tăng theo k) recall@5 ở đây chỉ khoảng 0.57
+    queries = _noisy(rng, np.concatenate([m for _, m in users]), 100)
+    assert _recall(index, users, queries, k=1) == 1.0
+    assert _recall(index, users, queries, k=5) >= 0.8
+
+
+def test_rows_added_after_retrain_keep_top_k_recall():
+    rng = np.random.default_rng(3)
+    users = _users(rng, 200)
+    index = IVFFlatIndex(RECALL_DIM, flat_threshold=2048, retrain_factor=2.5)
+    index.build(users)
+    assert not index.is_trained
+
+    # Vượt flat_threshold thì huấn luyện, vượt retrain_factor thì huấn luyện lại;
+    # hai lô cuối chỉ được gán vào các cụm đã có
+    batches = [_users(rng, 200, start=200 * (i + 1)) for i in range(5)]
+    trained_sizes = []
+    for batch in batches:
+        for user_id, matrix in batch:
+            index.add(user_id, matrix)
+        trained_sizes.append(index._trained_size)
+        users += batch
+    assert trained_sizes == [2048, 2048, 5120, 5120, 5120]
+
+    added = np.concatenate([m for batch in batches[3:] for _, m in batch])
+    queries = _noisy(rng, added, 100)
+    assert _recall(index, users, queries, k=1) == 1.0
+    assert _recall(index, users, queries, k=5) >= 0.8
@@ -0,0 +1,70 @@
+import types
+import uuid
+
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.websocket import cameras as camera_stream
+
+
+class FakeSession:
+    """Session giả: trả về camera theo id, luôn là bản mới nhất (như populate_existing)."""
+
+    cameras: dict = {}
+
+    def __init__(self, engine=None):
+        pass
+
+    def get(self, model, id, **kwargs):
+        return self.cameras.get(id)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def camera(monkeypatch):
+    camera = types.SimpleNamespace(id=uuid.uuid4(), status=True, user_ids=["alice"])
+    FakeSession.cameras = {camera.id: camera}
+    monkeypatch.setattr(camera_stream, "Session", FakeSession)
+    return camera
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(camera_stream.router)
+    return TestClient(app)
+
+
+def test_deactivated_camera_stops_stream(monkeypatch, camera, client):
+    async def fake_verify(session, camera, frame):
+        return {"event": "face:verification", "user_ids": list(camera.user_ids)}
+
+    monkeypatch.setattr(camera_stream, "verify_frame", fake_verify)
+    with client.websocket_connect(f"/cameras/{camera.id}") as websocket:
+        websocket.send_bytes(b"frame-1")
+        assert websocket.receive_json()["event"] == "face:verification"
+
+        camera.status = False
+        websocket.send_bytes(b"frame-2")
+        assert websocket.receive_json() == {
+            "event": "face:error", "status_code": 400, "detail": "Camera is not active"
+        }
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1008
+
+
+def test_processor_error_is_raised(monkeypatch, camera, client):
+    async def failing_verify(session, camera, frame):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(camera_stream, "verify_frame", failing_verify)
+    with pytest.raises(RuntimeError, match="database unavailable"):
+        with client.websocket_connect(f"/cameras/{camera.id}") as websocket:
+            websocket.send_bytes(b"frame-1")
+            websocket.receive_json()
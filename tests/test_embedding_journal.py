@@ -0,0 +1,137 @@
+import threading
+
+import numpy as np
+
+from app.core.embedding_journal import (
+    OP_ADD,
+    EmbeddingJournal,
+    encode_record,
+    journal_path,
+    replay,
+)
+
+DIM = 4
+
+
+def _record(user_id, value):
+    matrix = np.full((1, DIM), value, dtype=np.float32)
+    return encode_record(OP_ADD, user_id, matrix), (OP_ADD, user_id, matrix, None)
+
+
+def _journal(base, generation=1, received=None):
+    committed = []
+
+    def on_records(entries, generation):
+        if received is not None:
+            received.extend((user_id, float(matrix[0, 0]), generation) for _, user_id, matrix, _ in entries)
+
+    journal = EmbeddingJournal(
+        base, DIM, generation,
+        on_commit=lambda payloads, generation: committed.extend(payloads),
+        on_records=on_records,
+    )
+    return journal, committed
+
+
+def test_torn_tail_is_truncated_on_replay(tmp_path):
+    base = tmp_path / "store.bin"
+    journal, _ = _journal(base)
+    journal.append(*_record("alice", 1.0))
+    journal.append(*_record("bob", 2.0))
+    journal.close()
+    path = journal_path(base, 1)
+    valid_size = path.stat().st_size
+
+    # Bản ghi thứ ba bị ghi dở (crash giữa chừng)
+    torn, _ = _record("carol", 3.0)
+    with open(path, "ab") as f:
+        f.write(torn[:len(torn) // 2])
+
+    assert [user_id for _, user_id, _, _ in replay(path, DIM)] == ["alice", "bob"]
+    assert path.stat().st_size == valid_size
+
+    # Bản ghi cuối đủ độ dài nhưng sai CRC cũng bị cắt
+    corrupt = bytearray(torn)
+    corrupt[-1] ^= 0xFF
+    with open(path, "ab") as f:
+        f.write(bytes(corrupt))
+    assert [user_id for _, user_id, _, _ in replay(path, DIM)] == ["alice", "bob"]
+    assert path.stat().st_size == valid_size
+
+    # Ghi tiếp sau khi cắt nối đúng ranh giới bản ghi
+    reopened, _ = _journal(base)
+    reopened.append(*_record("dave", 4.0))
+    reopened.close()
+    assert [user_id for _, user_id, _, _ in replay(path, DIM)] == ["alice", "bob", "dave"]
+
+
+def test_concurrent_append_many_commits_every_caller(tmp_path):
+    base = tmp_path / "store.bin"
+    journal, committed = _journal(base)
+    threads_count, per_thread = 8, 25
+    errors = []
+    start = threading.Barrier(threads_count)
+
+    def writer(thread_id):
+        start.wait()
+        for i in range(per_thread):
+            records = [_record(f"user-{thread_id}", thread_id * 1000 + i)]
+            journal.append_many(records)
+            # on_commit chạy trước khi append_many trả về: bản ghi của chính luồng đã được áp dụng
+            if not any(payload is records[0][1] for payload in committed):
+                errors.append((thread_id, i))
+
+    threads = [threading.Thread(target=writer, args=(t,)) for t in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    assert errors == []
+    assert len(committed) == threads_count * per_thread
+    replayed = [float(matrix[0, 0]) for _, _, matrix, _ in replay(journal_path(base, 1), DIM)]
+    assert sorted(replayed) == sorted(t * 1000 + i for t in range(threads_count) for i in range(per_thread))
+    # Thứ tự trong file khớp thứ tự on_commit
+    assert replayed == [float(matrix[0, 0]) for _, _, matrix, _ in committed]
+
+
+def test_reader_follows_rotation_of_another_instance(tmp_path):
+    base = tmp_path / "store.bin"
+    received = []
+    writer, _ = _journal(base)
+    reader, _ = _journal(base, received=received)
+
+    writer.append(*_record("alice", 1.0))
+    assert writer.rotate() == 1
+    writer.append(*_record("bob", 2.0))
+
+    # Reader vẫn đang ở generation 1: đọc nốt bản ghi cũ rồi chuyển sang generation 2
+    assert reader.sync()
+    assert received == [("alice", 1.0, 1), ("bob", 2.0, 2)]
+    assert reader.generation == 2
+
+    # Reader tự ghi sau đó: nối vào generation mới, writer thấy bản ghi đó
+    writer_seen = []
+    writer._on_records = lambda entries, generation: writer_seen.extend(
+        (user_id, generation) for _, user_id, _, _ in entries
+    )
+    reader.append(*_record("carol", 3.0))
+    assert writer.sync()
+    assert writer_seen == [("carol", 2)]
+
+
+def test_reader_keeps_old_generation_after_it_is_deleted(tmp_path):
+    base = tmp_path / "store.bin"
+    received = []
+    writer, _ = _journal(base)
+    reader, _ = _journal(base, received=received)
+
+    writer.append(*_record("alice", 1.0))
+    writer.rotate()
+    writer.append(*_record("bob", 2.0))
+    # Compaction xóa file generation cũ trong khi reader vẫn đang mở nó
+    journal_path(base, 1).unlink()
+
+    assert reader.sync()
+    assert received == [("alice", 1.0, 1), ("bob", 2.0, 2)]
@@ -0,0 +1,131 @@
+import json
+
+import numpy as np
+
+from app.core.embedding_store import EmbeddingStore, write_snapshot
+
+DIM = 8
+
+
+def _matrix(seed, rows):
+    return np.random.default_rng(seed).normal(size=(rows, DIM)).astype(np.float32)
+
+
+def _open_store(path, **kwargs):
+    store = EmbeddingStore(path, DIM, **kwargs)
+    store.open()
+    return store
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = tmp_path / "store.bin"
+    users = {"alice": _matrix(0, 3), "bob": _matrix(1, 1), "chị Hà": _matrix(2, 2)}
+    assert write_snapshot(path, DIM, users.items(), generation=4) == 6
+
+    store = _open_store(path)
+    assert sorted(store.user_ids()) == sorted(users)
+    assert len(store) == 6
+    for user_id, matrix in users.items():
+        stored = store.get(user_id)
+        np.testing.assert_array_equal(stored, matrix)
+        # View trên vùng nhớ đã map, không phải bản sao ghi được
+        assert not stored.flags.writeable
+    assert store.get("nobody") is None
+
+
+def test_snapshot_survives_add_compact_and_reopen(tmp_path):
+    path = tmp_path / "store.bin"
+    write_snapshot(path, DIM, [("alice", _matrix(0, 2))])
+    store = _open_store(path)
+    added = _matrix(1, 1)
+    store.add("alice", added[0])
+    store.add("bob", _matrix(2, 1)[0])
+    assert store.compact()
+
+    reopened = _open_store(path)
+    np.testing.assert_array_equal(
+        reopened.get("alice"), np.concatenate([_matrix(0, 2), added])
+    )
+    assert reopened.count("bob") == 1
+
+
+def test_migrate_legacy_json(tmp_path):
+    json_path = tmp_path / "embeddings_store.json"
+    alice = _matrix(0, 2)
+    json_path.write_text(json.dumps({
+        "alice": alice.tolist(),
+        # Embedding sai kích thước bị bỏ qua, embedding hợp lệ còn lại vẫn được giữ
+        "bob": [[1.0] * (DIM - 1), [0.5] * DIM],
+        "broken": "not a list",
+        "empty": [],
+    }), encoding="utf-8")
+    path = tmp_path / "store.bin"
+    store = EmbeddingStore(path, DIM)
+
+    assert store.migrate_from_json(json_path) == 3
+    store.open()
+    assert sorted(store.user_ids()) == ["alice", "bob"]
+    np.testing.assert_allclose(store.get("alice"), alice)
+    np.testing.assert_array_equal(store.get("bob"), np.full((1, DIM), 0.5, dtype=np.float32))
+    # Đã có snapshot: lần khởi động sau (hoặc worker khác) không chuyển đổi lại
+    assert EmbeddingStore(path, DIM).migrate_from_json(json_path) == 0
+
+
+def test_writes_of_one_worker_are_visible_to_another(tmp_path):
+    path = tmp_path / "store.bin"
+    write_snapshot(path, DIM, [("alice", _matrix(0, 1))])
+    first, second = _open_store(path), _open_store(path)
+
+    first.add("alice", _matrix(1, 1)[0])
+    first.add("bob", _matrix(2, 1)[0])
+
+    # Mọi lần đọc đều sync() trước
+    assert second.count("alice") == 2
+    np.testing.assert_array_equal(second.get("bob"), _matrix(2, 1))
+    assert sorted(second.user_ids()) == ["alice", "bob"]
+
+
+def test_compaction_while_another_worker_appends(tmp_path):
+    path = tmp_path / "store.bin"
+    write_snapshot(path, DIM, [])
+    compactor, writer = _open_store(path), _open_store(path)
+    expected = {}
+    for i in range(30):
+        user_id = f"user-{i % 5}"
+        embedding = _matrix(100 + i, 1)[0]
+        expected.setdefault(user_id, []).append(embedding)
+        (writer if i % 2 else compactor).add(user_id, embedding)
+        if i % 7 == 6:
+            assert compactor.compact()
+
+    assert compactor.compact()
+    generation = compactor._generation
+    assert generation > 0
+    # Worker thứ hai map lại snapshot mới và bỏ các bản ghi journal đã được gộp
+    assert writer.count("user-0") == len(expected["user-0"])
+    assert writer._generation == generation
+    assert writer._tail == {}
+    for store in (compactor, writer, _open_store(path)):
+        for user_id, embeddings in expected.items():
+            np.testing.assert_array_equal(
+                np.sort(store.get(user_id), axis=0), np.sort(np.stack(embeddings), axis=0)
+            )
+
+
+def test_local_write_does_not_force_a_journal_read(tmp_path, monkeypatch):
+    path = tmp_path / "store.bin"
+    write_snapshot(path, DIM, [])
+    store = _open_store(path)
+    calls = []
+    sync = store._journal.sync
+    monkeypatch.setattr(store._journal, "sync", lambda: calls.append(1) or sync())
+
+    store.add("alice", _matrix(0, 1)[0])
+    store.add_many([("alice", _matrix(1, 1)[0]), ("carol", _matrix(2, 1)[0])])
+    assert store.count("alice") == 2
+    assert calls == []
+
+    # Ghi của worker khác vẫn được phát hiện
+    _open_store(path).add("bob", _matrix(1, 1)[0])
+    store.count("bob")
+    assert calls == [1]
@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.face_decode_parity import decode_parity_report
+
+
+def _camera_frame(seed: int, fmt: str) -> bytes:
+    # Khung hình lớn, mịn (nhiễu tần số thấp phóng to) như ảnh camera thật
+    coarse = np.random.default_rng(seed).integers(0, 256, size=(12, 16, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((960, 720), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _stand_in_embedding(seed: int = 0, dim: int = 128):
+    # Thay cho model khuôn mặt (cần TensorFlow): phép chiếu ngẫu nhiên chuẩn hóa L2, khoảng cách
+    # giữa hai embedding nằm trong [0, 2] cùng thang với OPTIMAL_THRESHOLD
+    size = int(np.prod(settings.MODEL_INPUT_SHAPE))
+    projection = np.random.default_rng(seed).normal(size=(size, dim)).astype(np.float32)
+
+    def embed(batch: np.ndarray) -> np.ndarray:
+        centered = batch.reshape(len(batch), -1) - 0.5
+        embeddings = centered @ projection
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    return embed
+
+
+def test_draft_decode_drift_is_far_below_threshold():
+    images = [_camera_frame(seed, fmt) for seed in range(4) for fmt in ("JPEG", "PNG")]
+
+    report = decode_parity_report(_stand_in_embedding(), images, settings.OPTIMAL_THRESHOLD)
+
+    assert report["images"] == len(images)
+    assert report["max_pixel_diff"] < 0.02
+    assert report["drift_to_threshold"] < 0.02
+    assert report["pair_decision_flips"] == 0
+    assert report["cross_decision_flips"] == 0
@@ -0,0 +1,86 @@
+import pytest
+
+from app.core.config import settings
+from app.services import face_verification_service as service_module
+from app.services.face_verification_service import (
+    FaceModelLoadError, FaceModelWarmingUpError, face_service
+)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(face_service, "load_error", None)
+    monkeypatch.setattr(face_service, "model_loaded", False)
+    face_service.model_ready.clear()
+    yield face_service
+    face_service.model_ready.clear()
+
+
+def test_warmup_failure_is_reported(monkeypatch, service):
+    def load_model():
+        service.model_loaded = True
+
+    def failing_warmup():
+        raise RuntimeError("out of memory during warmup")
+
+    monkeypatch.setattr(service, "_load_model_and_weights", load_model)
+    monkeypatch.setattr(service, "warmup", failing_warmup)
+
+    assert service.load() is False
+    assert not service.model_ready.is_set()
+    assert service.load_error == "out of memory during warmup"
+    with pytest.raises(FaceModelLoadError, match="out of memory during warmup"):
+        service.ensure_ready()
+
+
+def test_not_loaded_yet_is_warming_up(monkeypatch, service):
+    monkeypatch.setattr(service, "start_loading", lambda: None)
+    with pytest.raises(FaceModelWarmingUpError):
+        service.ensure_ready()
+
+
+class _FakeModel:
+    def load_weights(self, path):
+        pass
+
+
+@pytest.fixture
+def fake_weights(monkeypatch, tmp_path, service):
+    weights = tmp_path / "weights.h5"
+    weights.write_bytes(b"")
+    compiled = []
+    monkeypatch.setattr(service, "model_path_weights", weights)
+    monkeypatch.setattr(service, "model", None)
+    monkeypatch.setattr(service, "_onnx", None)
+    monkeypatch.setattr(service, "_compiled", {})
+    monkeypatch.setattr(settings, "FACE_COMPILED_INFERENCE", True)
+
+    def build_compiled_inference(model, shape, buckets):
+        compiled.extend(buckets)
+        return {bucket: None for bucket in buckets}
+
+    monkeypatch.setattr(service_module, "create_siamese_backbone_service", lambda shape: _FakeModel())
+    monkeypatch.setattr(service_module, "build_compiled_inference", build_compiled_inference)
+    return compiled
+
+
+def test_onnx_backend_skips_compiled_tensorflow_functions(monkeypatch, service, fake_weights):
+    monkeypatch.setattr(settings, "FACE_MODEL_BACKEND", "onnx")
+    monkeypatch.setattr(service, "_load_onnx_backend", lambda: setattr(service, "_onnx", object()))
+
+    service._load_model_and_weights()
+
+    assert service.model_loaded
+    assert fake_weights == []
+    assert service._compiled == {}
+
+
+def test_onnx_fallback_compiles_tensorflow_functions(monkeypatch, service, fake_weights):
+    monkeypatch.setattr(settings, "FACE_MODEL_BACKEND", "onnx")
+    monkeypatch.setattr(service, "_load_onnx_backend", lambda: None)
+
+    service._load_model_and_weights()
+
+    assert service.model_loaded
+    assert fake_weights
+    assert sorted(service._compiled) == sorted(fake_weights)
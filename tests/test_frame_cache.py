@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+import pytest
+
+from PIL import Image
+
+from app.services.face_verification_service import face_service
+from app.services.frame_cache import FrameEmbeddingCache, difference_hash
+
+
+def _image_bytes(seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(120, 120, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_near_duplicate_hit_is_scoped_to_stream():
+    cache = FrameEmbeddingCache(max_entries=8, ttl=60.0, max_hamming=4)
+    embedding = np.ones(4, dtype=np.float32)
+    cache.put("camera-a", 0b1011, embedding)
+
+    assert np.array_equal(cache.get("camera-a", 0b1011), embedding)
+    assert np.array_equal(cache.get("camera-a", 0b1001), embedding)
+    assert cache.get("camera-b", 0b1011) is None
+    assert cache.get("camera-b", 0b1001) is None
+
+
+def test_frames_without_stream_bypass_cache(monkeypatch):
+    cache = FrameEmbeddingCache(max_entries=8, ttl=60.0, max_hamming=4)
+    monkeypatch.setattr(face_service, "frame_cache", cache)
+    image = _image_bytes(0)
+
+    preprocessed, frame_hash, cached = face_service._preprocess_cached(image)
+    assert frame_hash is None and cached is None
+    face_service._remember_frame(None, frame_hash, np.ones(4, dtype=np.float32))
+    assert cache.stats()["size"] == 0
+
+    _, frame_hash, cached = face_service._preprocess_cached(image, "camera-a")
+    assert frame_hash == difference_hash(preprocessed) and cached is None
+    face_service._remember_frame("camera-a", frame_hash, np.ones(4, dtype=np.float32))
+    assert face_service._preprocess_cached(image, "camera-a")[2] is not None
+    assert face_service._preprocess_cached(image, "camera-b")[2] is None
@@ -0,0 +1,114 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+
+from fastapi.testclient import TestClient
+from PIL import Image, ImageFilter
+
+from app.core.config import settings
+from app.services.face_verification_service import face_service
+from app.services.image_quality import (
+    LOW_CONTRAST, TOO_BLURRY, TOO_BRIGHT, TOO_DARK, ImageQualityError, assess_quality, check_quality,
+)
+
+
+def _png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _sharp() -> Image.Image:
+    # Ô bàn cờ lớn (giữ tương phản khi làm mờ) cộng nhiễu hạt mịn (chi tiết bị mất khi làm mờ)
+    rows, cols = np.mgrid[0:160, 0:160]
+    base = np.where((rows // 40 + cols // 40) % 2 == 0, 80.0, 180.0)
+    noise = np.random.default_rng(0).normal(0.0, 12.0, size=base.shape)
+    gray = np.clip(base + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(np.stack([gray] * 3, axis=-1))
+
+
+def _scaled(image: Image.Image, factor: float, offset: float = 0.0) -> Image.Image:
+    pixels = np.asarray(image, dtype=np.float32) * factor + offset
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+IMAGES = {
+    "sharp": _sharp(),
+    "blurred": _sharp().filter(ImageFilter.GaussianBlur(4)),
+    "dark": _scaled(_sharp(), 0.12),
+    "bright": _scaled(_sharp(), 0.3, 190.0),
+    "flat": Image.new("RGB", (160, 160), (128, 128, 128)),
+}
+
+
+@pytest.fixture
+def gate(monkeypatch):
+    monkeypatch.setattr(settings, "FACE_QUALITY_GATE_ENABLED", True)
+
+
+def _preprocessed(name: str) -> np.ndarray:
+    return face_service._preprocess_image(_png(IMAGES[name]))
+
+
+def test_gate_is_opt_in():
+    assert settings.FACE_QUALITY_GATE_ENABLED is False
+    check_quality(_preprocessed("flat"))
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("sharp", []),
+    ("blurred", [TOO_BLURRY]),
+    ("dark", [TOO_DARK, LOW_CONTRAST]),
+    ("bright", [TOO_BRIGHT]),
+    ("flat", [TOO_BLURRY, LOW_CONTRAST]),
+])
+def test_reason_codes(gate, name, expected):
+    reasons, metrics = assess_quality(_preprocessed(name))
+
+    assert reasons == expected, metrics
+    assert set(metrics) == {"sharpness", "brightness", "contrast"}
+
+
+def test_rejected_images_are_reported_per_index(gate, monkeypatch):
+    monkeypatch.setattr(face_service, "model_loaded", True)
+    monkeypatch.setattr(face_service, "model", object())
+    monkeypatch.setattr(
+        face_service, "_run_model",
+        lambda batch: np.ones((len(batch), settings.EMBEDDING_DIM), dtype=np.float32),
+    )
+    rejected = {}
+
+    embeddings = face_service.get_embeddings(
+        [_png(IMAGES["sharp"]), _png(IMAGES["blurred"])], rejected
+    )
+
+    assert embeddings[0] is not None and embeddings[1] is None
+    assert list(rejected) == [1]
+    assert rejected[1].reasons == [TOO_BLURRY]
+
+
+def test_rejected_image_returns_422_with_reasons(gate, monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from app.main import app
+
+    monkeypatch.setattr(face_service, "ensure_ready", lambda: None)
+    monkeypatch.setattr(face_service, "model_loaded", True)
+    monkeypatch.setattr(face_service, "model", object())
+    client = TestClient(app)
+
+    response = client.post(
+        f"{settings.API_V1_STR}/cameras/register_face",
+        json={
+            "user_id": "user-quality",
+            "image_base64": base64.b64encode(_png(IMAGES["flat"])).decode(),
+        },
+    )
+
+    assert response.status_code == 422
+    body = response.json()
+    assert body["reasons"] == [TOO_BLURRY, LOW_CONTRAST]
+    assert body["metrics"]["contrast"] == 0.0
+    assert "too_blurry" in body["detail"]
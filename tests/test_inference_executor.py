@@ -0,0 +1,74 @@
+import io
+import threading
+import time
+
+import numpy as np
+
+from PIL import Image
+
+from app.core.config import settings
+from app.services.face_verification_service import face_service
+from app.services.inference_executor import InferenceExecutor
+
+
+class _ConcurrencyProbe:
+    """Model giả ghi lại số lần chạy đồng thời lớn nhất."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def __call__(self, batch):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        return np.ones((len(batch), settings.EMBEDDING_DIM), dtype=np.float32)
+
+
+def _run_threads(targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_forward_is_bounded_by_workers():
+    executor = InferenceExecutor(workers=2)
+    probe = _ConcurrencyProbe()
+
+    _run_threads([lambda: executor.forward(probe, np.zeros((1, 4)))] * 6)
+
+    assert probe.max_running == 2
+    assert executor.stats()["max_forwarding"] == 2
+    assert executor.stats()["forwarding"] == 0
+    executor.shutdown()
+
+
+def test_batcher_and_batch_registration_share_the_bound(monkeypatch):
+    probe = _ConcurrencyProbe()
+    executor = InferenceExecutor(workers=1)
+    monkeypatch.setattr(face_service, "executor", executor)
+    monkeypatch.setattr(face_service, "_onnx", probe)
+    monkeypatch.setattr(face_service, "model_loaded", True)
+    monkeypatch.setattr(face_service, "model", object())
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (90, 120, 150)).save(buffer, format="PNG")
+    image = buffer.getvalue()
+    single = np.zeros((1, *face_service.model_input_shape), dtype=np.float32)
+
+    def micro_batched():
+        face_service.batcher.submit(single).result(timeout=5)
+
+    def batch_registration():
+        face_service.get_embeddings([image, image])
+
+    _run_threads([micro_batched, batch_registration] * 3)
+
+    assert probe.max_running == 1
+    assert executor.stats()["max_forwarding"] == 1
+    executor.shutdown()
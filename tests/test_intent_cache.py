@@ -0,0 +1,99 @@
+import unicodedata
+
+import pytest
+
+from app.services.intent_cache import IntentResultCache, normalize_command
+
+# Câu lệnh dạng ASR thường trả về (đã chuẩn hóa) kèm điều kiện trích được từ chúng
+COMMANDS = {
+    "bật đèn khi nhiệt độ trên 30 độ": (
+        {"sensor": "temperature", "op": "=", "value": 30, "unit": "°C"}, "bật đèn"
+    ),
+    "bật quạt khi trời nóng": (
+        {"sensor": "temperature", "op": ">", "value": 30, "unit": "°C"}, "bật quạt"
+    ),
+    "bật máy bơm khi độ ẩm dưới 40": (
+        {"sensor": "humidity", "op": "=", "value": 40, "unit": "%"}, "bật máy bơm"
+    ),
+    "bật đèn khi trời tối": (
+        {"sensor": "light", "op": "<", "value": 20, "unit": "lux"}, "bật đèn"
+    ),
+    "tắt đèn sau 5 phút": (
+        {"sensor": "time", "op": "=", "value": 300, "unit": "seconds"}, "tắt đèn"
+    ),
+}
+
+
+def _variants(command: str):
+    yield command.capitalize()
+    yield command.upper()
+    yield unicodedata.normalize("NFD", command)
+    yield "  " + command.replace(" ", " \t ") + "\n"
+
+
+@pytest.mark.parametrize("command", list(COMMANDS))
+def test_normalization_keeps_asr_commands_and_folds_variants(command):
+    # Câu đã ở dạng chuẩn đi vào trích điều kiện y như trước khi có cache
+    assert normalize_command(command) == command
+    for variant in _variants(command):
+        assert normalize_command(variant) == command
+
+
+@pytest.mark.parametrize("command, expected", list(COMMANDS.items()))
+def test_condition_extraction_on_normalized_commands(command, expected):
+    for module in ("torch", "transformers", "sounddevice", "soundfile", "scipy"):
+        pytest.importorskip(module)
+    from app.services.voice_recording_service import voice_service
+
+    assert voice_service.split_condition(command) == expected
+    # Mẫu điều kiện viết thường: câu viết hoa chỉ trích đúng điều kiện sau khi chuẩn hóa
+    for variant in _variants(command):
+        assert voice_service.split_condition(normalize_command(variant)) == expected
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = IntentResultCache(max_entries=2)
+    cache.put("v1", "bật đèn", {"intent": "TURN_ON_LIGHT"})
+    cache.put("v1", "tắt đèn", {"intent": "TURN_OFF_LIGHT"})
+    assert cache.get("v1", "bật đèn") is not None  # "tắt đèn" giờ là cũ nhất
+
+    cache.put("v1", "bật quạt", {"intent": "TURN_ON_FAN"})
+
+    assert cache.get("v1", "tắt đèn") is None
+    assert cache.get("v1", "bật đèn") == {"intent": "TURN_ON_LIGHT"}
+    assert cache.get("v1", "bật quạt") == {"intent": "TURN_ON_FAN"}
+    assert cache.stats()["size"] == 2
+
+
+def test_results_of_old_templates_are_not_reused():
+    cache = IntentResultCache(max_entries=8)
+    cache.put("v1", "bật đèn", {"intent": "TURN_ON_LIGHT"})
+
+    assert cache.get("v2", "bật đèn") is None
+    assert cache.get("v1", "bật đèn") is not None
+    cache.invalidate()
+    assert cache.get("v1", "bật đèn") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_cached_results_are_isolated_copies():
+    cache = IntentResultCache(max_entries=8)
+    result = {"intent": "TURN_ON_LIGHT", "candidates": [{"template": "bật đèn"}]}
+    cache.put("v1", "bật đèn", result)
+    result["candidates"].append({"template": "mở đèn"})
+
+    first = cache.get("v1", "bật đèn")
+    first["sentence"] = "Bật đèn"
+    first["candidates"][0]["template"] = "changed"
+
+    assert cache.get("v1", "bật đèn") == {
+        "intent": "TURN_ON_LIGHT", "candidates": [{"template": "bật đèn"}]
+    }
+
+
+def test_zero_size_disables_cache():
+    cache = IntentResultCache(max_entries=0)
+    cache.put("v1", "bật đèn", {"intent": "TURN_ON_LIGHT"})
+
+    assert cache.get("v1", "bật đèn") is None
+    assert cache.stats()["size"] == 0
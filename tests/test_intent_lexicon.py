@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app.services.intent_lexicon import EXACT, PREFIX, IntentLexicon, fold_command
+
+TEMPLATES = {
+    "bật đèn": "TURN_ON_LIGHT",
+    "tắt đèn": "TURN_OFF_LIGHT",
+    "bật quạt": "TURN_ON_FAN",
+    "bật quạt mức cao": "FAN_HIGH",
+    # Cùng dạng bỏ dấu "bat quat" nhưng khác intent: cả hai bị loại khỏi bảng tra
+    "bắt quát": "UNRELATED",
+    "bát quạt": "TURN_ON_FAN",
+}
+
+
+def test_fold_command_drops_accents_punctuation_and_case():
+    assert fold_command("Bật  ĐÈN!") == "bat den"
+    assert fold_command("bật_đèn, nhé") == "bat den nhe"
+
+
+def test_folded_exact_hit():
+    lexicon = IntentLexicon(TEMPLATES)
+
+    assert lexicon.match("Bật đèn!") == ("bật đèn", "TURN_ON_LIGHT", EXACT)
+    assert lexicon.match("tat den") == ("tắt đèn", "TURN_OFF_LIGHT", EXACT)
+    assert lexicon.match("bật đèn phòng khách") is None
+    assert lexicon.stats()["exact_hits"] == 2
+
+
+def test_trie_prefix_hit_picks_longest_template():
+    lexicon = IntentLexicon({**TEMPLATES, "bật đèn phòng": "TURN_ON_ROOM_LIGHT"})
+
+    assert lexicon.match("bật đèn phòng khách", prefix=True) == (
+        "bật đèn phòng", "TURN_ON_ROOM_LIGHT", PREFIX
+    )
+    assert lexicon.match("bật đèn ngủ", prefix=True) == ("bật đèn", "TURN_ON_LIGHT", PREFIX)
+    assert lexicon.match("mở cửa", prefix=True) is None
+    assert lexicon.stats()["prefix_hits"] == 2
+
+
+def test_conflicting_keys_are_dropped():
+    lexicon = IntentLexicon(TEMPLATES)
+
+    assert lexicon.match("bat quat") is None
+    assert lexicon.match("bật quạt") is None
+    # Tiền tố cũng không rơi về câu mẫu bị loại
+    assert lexicon.match("bật quạt mức cao", prefix=True) == ("bật quạt mức cao", "FAN_HIGH", EXACT)
+    assert lexicon.match("bật quạt phòng ngủ", prefix=True) is None
+    assert lexicon.stats()["templates"] == 3
+
+
+def test_conflict_stays_dropped_after_a_third_duplicate():
+    lexicon = IntentLexicon({"bật đèn": "A", "bát đèn": "B", "bắt đèn": "A"})
+
+    assert lexicon.match("bat den") is None
+    assert lexicon.stats()["templates"] == 0
+
+
+def test_lexical_hit_does_not_wait_for_the_model(monkeypatch):
+    for module in ("torch", "transformers", "sounddevice", "soundfile", "scipy"):
+        pytest.importorskip(module)
+    from app.core.config import settings
+    from app.services.voice_recording_service import voice_service
+    from app.utils import model_ready
+
+    async def model_not_ready(*args, **kwargs):
+        await model_ready.wait()
+
+    monkeypatch.setattr(settings, "NLP_LEXICAL_MATCH_ENABLED", True)
+    monkeypatch.setattr(voice_service, "init_embeddings", model_not_ready)
+    assert not model_ready.is_set()
+
+    result = asyncio.run(asyncio.wait_for(voice_service.nlp_pipeline("Bật đèn!"), timeout=1))
+
+    assert result["intent"] == "TURN_ON_LIGHT"
+    assert result["matched_by"] == EXACT
+    assert result["sentence"] == "Bật đèn!"
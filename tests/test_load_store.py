@@ -0,0 +1,44 @@
+import numpy as np
+
+from app.core import db
+
+
+class FakePgStore:
+    def __init__(self, engine, dim, **kwargs):
+        self.rows = []
+
+    def open(self):
+        pass
+
+    def __len__(self):
+        return len(self.rows)
+
+    def import_from(self, items):
+        self.rows.extend(items)
+        return len(self.rows)
+
+
+def test_pgvector_backend_does_not_open_file_store(monkeypatch, tmp_path):
+    opened = []
+    monkeypatch.setattr(db.settings, "EMBEDDINGS_BACKEND", "pgvector")
+    monkeypatch.setattr(db, "PgVectorEmbeddingStore", FakePgStore)
+    monkeypatch.setattr(db, "snapshot_path", tmp_path / "missing.bin")
+    monkeypatch.setattr(db, "store_path", tmp_path / "missing.json")
+    monkeypatch.setattr(db, "load_file_store", lambda *args: opened.append(args))
+
+    assert isinstance(db.load_store(), FakePgStore)
+    assert opened == []
+
+
+def test_pgvector_backend_imports_existing_file_store(monkeypatch, tmp_path):
+    snapshot = tmp_path / "embeddings_store.bin"
+    monkeypatch.setattr(db, "snapshot_path", snapshot)
+    monkeypatch.setattr(db, "store_path", tmp_path / "missing.json")
+    file_store = db.load_file_store()
+    file_store.add("alice", np.ones(db.settings.EMBEDDING_DIM, dtype=np.float32))
+
+    monkeypatch.setattr(db.settings, "EMBEDDINGS_BACKEND", "pgvector")
+    monkeypatch.setattr(db, "PgVectorEmbeddingStore", FakePgStore)
+    pg_store = db.load_store()
+
+    assert [user_id for user_id, _ in pg_store.rows] == ["alice"]
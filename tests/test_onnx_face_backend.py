@@ -0,0 +1,27 @@
+import numpy as np
+
+from app.services.onnx_face_backend import parity_report
+
+
+def test_parity_report_counts_decision_flips():
+    rng = np.random.default_rng(0)
+    images = rng.normal(size=(6, 4)).astype(np.float32)
+
+    def reference(batch):
+        return batch
+
+    def shifted(batch):
+        # Kéo ảnh đầu tiên về đúng vị trí ảnh thứ hai: chỉ cặp (0, 1) đổi quyết định
+        out = batch.copy()
+        out[0] = batch[1]
+        return out
+
+    same = parity_report(reference, reference, images, distance_threshold=0.5)
+    assert same["max_drift"] == 0.0
+    assert same["pairs"] == 15
+    assert same["pair_decision_flips"] == 0 and same["cross_decision_flips"] == 0
+
+    report = parity_report(reference, shifted, images, distance_threshold=0.5)
+    assert report["max_drift"] > 0.0
+    assert report["pair_decision_flips"] == 1
+    assert report["cross_decision_flips"] == 1
@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+
+from app.core.quantization import (
+    calibration_report, dequantize, dot_products, quantize, storage_dtype, to_stored_matrix,
+)
+
+
+def _matrix(seed=0, rows=32, dim=64):
+    return np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+
+
+def test_int8_round_trip_error_is_within_half_a_step():
+    matrix = _matrix()
+    codes, scales = quantize(matrix, "int8")
+
+    assert codes.dtype == np.int8 and scales.dtype == np.float32
+    step = np.abs(matrix).max(axis=1) / 127
+    error = np.abs(dequantize(codes, scales) - matrix)
+    assert np.all(error <= step[:, None] / 2 + 1e-6)
+    # Phần tử có giá trị tuyệt đối lớn nhất của mỗi hàng ứng với mã +-127
+    assert np.all(np.abs(codes).max(axis=1) == 127)
+
+
+def test_float16_round_trip_error_is_relative():
+    matrix = _matrix(1)
+    codes, scales = quantize(matrix, "float16")
+
+    assert codes.dtype == storage_dtype("float16") and scales is None
+    error = np.abs(dequantize(codes) - matrix)
+    assert np.all(error <= np.abs(matrix) * 2.0 ** -11 + 1e-7)
+
+
+def test_zero_rows_keep_unit_scale_and_stay_zero():
+    matrix = _matrix(2, rows=4)
+    matrix[1] = 0.0
+    stored = to_stored_matrix(matrix, "int8")
+
+    assert stored.scales[1] == 1.0
+    assert np.all(stored.matrix[1] == 0)
+    restored = dequantize(stored.matrix, stored.scales)
+    assert np.all(np.isfinite(restored)) and np.all(restored[1] == 0.0)
+    assert stored.sq_norms[1] == 0.0
+    assert dot_products(matrix[0], stored.matrix, stored.scales)[1] == 0.0
+
+
+@pytest.mark.parametrize("mode", ["none", "float16", "int8"])
+def test_dot_products_and_norms_match_dequantized_rows(mode):
+    matrix = _matrix(3)
+    query = _matrix(4, rows=1)[0]
+    stored = to_stored_matrix(matrix, mode)
+    restored = dequantize(stored.matrix, stored.scales)
+
+    assert np.allclose(dot_products(query, stored.matrix, stored.scales), restored @ query, atol=1e-4)
+    assert np.allclose(stored.sq_norms, np.einsum("ij,ij->i", restored, restored), rtol=1e-5)
+
+
+def _reference_counts(users, mode, distance_threshold, confidence_threshold):
+    """Đếm lại bằng vòng lặp thường các số liệu calibration_report so sánh."""
+    original = np.concatenate([m for _, m in users])
+    labels = np.concatenate([np.full(len(m), i) for i, (_, m) in enumerate(users)])
+    restored = dequantize(*quantize(original, mode))
+    n = len(original)
+
+    def distance(matrix, i, j):
+        return float(np.linalg.norm(matrix[i].astype(np.float64) - matrix[j]))
+
+    genuine = impostor = 0
+    for i in range(n):
+        for j in range(i + 1, n):
+            flipped = (distance(original, i, j) < distance_threshold) != (
+                distance(restored, i, j) < distance_threshold
+            )
+            if flipped and labels[i] == labels[j]:
+                genuine += 1
+            elif flipped:
+                impostor += 1
+
+    decision_flips = decisions = 0
+    for label in np.unique(labels):
+        for probe in range(n):
+            others = [j for j in range(n) if labels[j] == label and j != probe]
+            if not others:
+                continue
+            accepted = []
+            for matrix in (original, restored):
+                matches = sum(distance(matrix, probe, j) < distance_threshold for j in others)
+                accepted.append(matches / len(others) >= confidence_threshold)
+            decision_flips += accepted[0] != accepted[1]
+            decisions += 1
+    return genuine, impostor, decision_flips, decisions
+
+
+def test_calibration_report_counts_match_a_direct_recount():
+    rng = np.random.default_rng(5)
+    centers = rng.normal(size=(6, 8)).astype(np.float32)
+    users = [
+        (f"user-{i}", centers[i] + 0.6 * rng.normal(size=(5, 8)).astype(np.float32))
+        for i in range(6)
+    ]
+    users.append(("single", rng.normal(size=(1, 8)).astype(np.float32)))
+    # Ngưỡng nằm giữa khoảng cách gốc và khoảng cách sau int8 của hai embedding của "pair":
+    # cặp này chắc chắn đổi quyết định, kéo theo quyết định xác thực của cả hai ảnh
+    pair = rng.normal(size=(2, 8)).astype(np.float32)
+    users.append(("pair", pair))
+    restored = dequantize(*quantize(pair, "int8"))
+    exact = float(np.linalg.norm(pair[0] - pair[1]))
+    approx = float(np.linalg.norm(restored[0] - restored[1]))
+    assert exact != approx
+    distance_threshold = (exact + approx) / 2
+
+    report = calibration_report(users, "int8", distance_threshold, confidence_threshold=0.5)
+    genuine, impostor, decision_flips, decisions = _reference_counts(
+        users, "int8", distance_threshold, 0.5
+    )
+
+    assert report["embeddings"] == 33 and report["users"] == 8
+    assert report["genuine_pairs"] == 6 * 10 + 1
+    assert report["impostor_pairs"] == 33 * 32 // 2 - 61
+    assert report["genuine_pair_flips"] == genuine
+    assert report["impostor_pair_flips"] == impostor
+    assert report["verification_decision_flips"] == decision_flips
+    # Mỗi embedding là ảnh kiểm tra cho mọi user, trừ user "single" với chính embedding duy nhất của nó
+    assert report["verification_decisions"] == decisions == 8 * 33 - 1
+    assert genuine >= 1 and decision_flips >= 2
+    assert report["compression_ratio"] == pytest.approx(4 * 8 / (8 + 4))  # float32 -> int8 + scale
+
+
+def test_calibration_report_without_quantization_has_no_flips():
+    users = [("a", _matrix(6, rows=4, dim=8)), ("b", _matrix(7, rows=3, dim=8))]
+
+    report = calibration_report(users, "none", 3.0, 0.5)
+
+    assert report["max_distance_drift"] < 1e-5
+    assert report["genuine_pair_flips"] == report["impostor_pair_flips"] == 0
+    assert report["verification_decision_flips"] == 0
@@ -0,0 +1,51 @@
+import base64
+import uuid
+
+import numpy as np
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.routes import cameras
+from app.core.config import settings
+from app.services.face_verification_service import face_service
+
+
+@pytest.fixture
+def client(monkeypatch):
+    rng = np.random.default_rng(0)
+
+    async def fake_embedding(image_bytes, *args, **kwargs):
+        return rng.normal(size=settings.EMBEDDING_DIM).astype(np.float32)
+
+    monkeypatch.setattr(face_service, "get_embedding_async", fake_embedding)
+    app = FastAPI()
+    app.include_router(cameras.router)
+    return TestClient(app)
+
+
+def test_register_face_twice_reports_count(client):
+    user_id = f"user-{uuid.uuid4()}"
+    payload = {"user_id": user_id, "image_base64": base64.b64encode(b"image").decode()}
+
+    first = client.post("/cameras/register_face", json=payload)
+    second = client.post("/cameras/register_face", json=payload)
+
+    assert first.status_code == 201, first.text
+    assert "now has 1 registered" in first.json()["message"]
+    assert second.status_code == 201, second.text
+    assert "now has 2 registered" in second.json()["message"]
+
+
+def test_register_face_upload_twice_reports_count(client):
+    user_id = f"user-{uuid.uuid4()}"
+    for expected in (1, 2):
+        response = client.post(
+            "/cameras/register_face/upload",
+            params={"user_id": user_id},
+            content=b"image",
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        assert response.status_code == 201, response.text
+        assert f"now has {expected} registered" in response.json()["message"]
@@ -0,0 +1,54 @@
+import numpy as np
+
+from app import utils
+from app.core.config import settings
+from app.core.prototypes import centroid_bounds
+from app.core.quantization import StoredMatrix, pairwise_distances
+
+
+def _stored(matrix: np.ndarray) -> StoredMatrix:
+    centroid, radius = centroid_bounds(matrix, None)
+    return StoredMatrix(
+        matrix=matrix,
+        sq_norms=np.einsum("ij,ij->i", matrix, matrix),
+        centroid=centroid,
+        radius=radius,
+    )
+
+
+def _far_user(monkeypatch):
+    rng = np.random.default_rng(0)
+    matrix = (rng.normal(size=(6, 16)) + 50.0).astype(np.float32)
+    monkeypatch.setattr(utils, "get_embedding_matrix", lambda user_id: _stored(matrix))
+    return matrix, np.zeros(16, dtype=np.float32)
+
+
+def test_min_distance_is_exact_without_summarization(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_EMBEDDINGS_PER_USER", 0)
+    matrix, query = _far_user(monkeypatch)
+
+    [(user_id, score)] = utils.score_embedding_against_users(query, ["u"])
+    exact = float(np.min(np.linalg.norm(matrix - query, axis=1)))
+    assert user_id == "u"
+    assert score["confidence_score"] == 0.0
+    assert np.isclose(score["min_distance_found"], exact, rtol=1e-5)
+
+
+def test_precheck_reports_lower_bound_with_summarization(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_EMBEDDINGS_PER_USER", 4)
+    matrix, query = _far_user(monkeypatch)
+
+    [(_, score)] = utils.score_embedding_against_users(query, ["u"])
+    exact = float(np.min(np.linalg.norm(matrix - query, axis=1)))
+    assert score["confidence_score"] == 0.0
+    assert settings.OPTIMAL_THRESHOLD <= score["min_distance_found"] <= exact + 1e-4
+
+
+def test_pairwise_distances_matches_direct_norms():
+    rng = np.random.default_rng(1)
+    a = rng.normal(size=(5, 8)).astype(np.float32)
+    b = rng.normal(size=(3, 8)).astype(np.float32)
+    direct = np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+
+    assert np.allclose(pairwise_distances(a, b), direct, atol=1e-4)
+    assert np.allclose(pairwise_distances(a), pairwise_distances(a, a), atol=1e-5)